@@ -0,0 +1,330 @@
+"""Measures request latency and peak memory of the server on large documents.
+
+The documents consist of deeply nested sections with a footnote in every
+section. Their paragraphs are drawn from hypothesis_doctree with a fixed seed
+and the documents are written by the RstWriter of the test suite. For every
+document size, the script reports the 50th, 95th and 99th percentile latency
+of parse_rst, didChange, completion, documentSymbol and the semantic token edits
+after each change and the tokens of a viewport as well as the peak memory
+allocated while opening the document and answering requests.
+
+Usage: python -m benchmarks.latency [--sizes 1000 10000 100000] [--output FILE]
+
+The output file contains the results as JSON, so that runs of different
+releases can be compared.
+"""
+import argparse
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List
+
+import docutils
+import docutils.nodes as nodes
+import hypothesis.strategies as st
+from docutils.io import StringOutput
+from docutils.utils import new_document
+from hypothesis import HealthCheck, Phase, given, seed, settings
+from pygls.lsp.methods import (
+    COMPLETION,
+    DOCUMENT_SYMBOL,
+    TEXT_DOCUMENT_DID_CHANGE,
+    TEXT_DOCUMENT_DID_OPEN,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
+)
+from pygls.lsp.types import (
+    CompletionParams,
+    DidChangeTextDocumentParams,
+    DidOpenTextDocumentParams,
+    DocumentSymbolParams,
+    Position,
+    Range,
+    SemanticTokensDeltaParams,
+    SemanticTokensParams,
+    SemanticTokensRangeParams,
+    TextDocumentContentChangeEvent,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+)
+
+import hypothesis_doctree as du
+from rst_language_server.server import create_server, parse_rst
+from tests.rst_writer import RstWriter
+
+URI = "file:///benchmark.rst"
+# Number of lines that an editor shows at once
+VIEWPORT_LINES = 60
+# Every section has this many subsections down to the maximum depth
+BRANCHING = 2
+MAX_DEPTH = 5
+
+
+def _paragraph_pool(size: int = 64) -> List[nodes.paragraph]:
+    pool = []
+
+    @seed(0)
+    @settings(
+        max_examples=1,
+        database=None,
+        deadline=None,
+        phases=[Phase.generate],
+        suppress_health_check=list(HealthCheck),
+    )
+    @given(st.lists(du.paragraphs(), min_size=size, max_size=size))
+    def draw(paragraphs: List[nodes.paragraph]):
+        pool[:] = paragraphs
+
+    draw()
+    return pool
+
+
+def _sections(paragraphs: List[nodes.paragraph]) -> Iterator[nodes.section]:
+    """Yields top-level sections with nested subsections and footnotes."""
+    counter = 0
+
+    def section(depth: int) -> nodes.section:
+        nonlocal counter
+        counter += 1
+        label = f"#note{counter}"
+        children = [
+            nodes.title("", f"Section {counter}"),
+            paragraphs[counter % len(paragraphs)].deepcopy(),
+            nodes.paragraph("", "See ", nodes.footnote_reference("", label)),
+            nodes.footnote(
+                "",
+                nodes.label("", label),
+                paragraphs[(counter + 1) % len(paragraphs)].deepcopy(),
+            ),
+        ]
+        if depth < MAX_DEPTH:
+            children += [section(depth + 1) for _ in range(BRANCHING)]
+        return nodes.section("", *children)
+
+    while True:
+        yield section(0)
+
+
+def generate_document(line_count: int, paragraphs: List[nodes.paragraph]) -> str:
+    chunks = []
+    lines = 0
+    for section in _sections(paragraphs):
+        # Writing every top-level section separately avoids repeatedly copying
+        # the text of the whole document
+        document = new_document("benchmark.rst")
+        document.append(section)
+        output = StringOutput(encoding="unicode")
+        RstWriter().write(document, output)
+        chunks.append(output.destination)
+        lines += output.destination.count("\n")
+        if lines >= line_count:
+            return "".join(chunks)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if len(samples) == 1:
+        samples = samples * 2
+    cut_points = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": cut_points[49] * 1000,
+        "p95": cut_points[94] * 1000,
+        "p99": cut_points[98] * 1000,
+    }
+
+
+def _seconds(function: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _open(features: Dict[str, Callable], text: str) -> None:
+    features[TEXT_DOCUMENT_DID_OPEN](
+        DidOpenTextDocumentParams(
+            text_document=TextDocumentItem(
+                uri=URI, language_id="rst", version=0, text=text
+            )
+        )
+    )
+
+
+def _change(features: Dict[str, Callable], version: int, line: int) -> None:
+    # Alternately insert and remove a character, so that the document does not grow
+    insert = version % 2 == 1
+    features[TEXT_DOCUMENT_DID_CHANGE](
+        DidChangeTextDocumentParams(
+            text_document=VersionedTextDocumentIdentifier(uri=URI, version=version),
+            content_changes=[
+                TextDocumentContentChangeEvent(
+                    range=Range(
+                        start=Position(line=line, character=0),
+                        end=Position(line=line, character=0 if insert else 1),
+                    ),
+                    text="x" if insert else "",
+                )
+            ],
+        )
+    )
+
+
+def _complete(features: Dict[str, Callable], position: Position) -> None:
+    features[COMPLETION](
+        CompletionParams(
+            text_document=TextDocumentIdentifier(uri=URI), position=position
+        )
+    )
+
+
+def _symbols(features: Dict[str, Callable]) -> None:
+    features[DOCUMENT_SYMBOL](
+        DocumentSymbolParams(text_document=TextDocumentIdentifier(uri=URI))
+    )
+
+
+def _semantic_tokens(features: Dict[str, Callable]) -> str:
+    """Requests all semantic tokens and returns the ID of the result."""
+    result = features[TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL](
+        SemanticTokensParams(text_document=TextDocumentIdentifier(uri=URI))
+    )
+    return json.loads(result.body)["resultId"]
+
+
+def _semantic_token_edits(
+    features: Dict[str, Callable], previous_result_id: str
+) -> str:
+    """Requests the changes of semantic tokens and returns the ID of the result."""
+    result = features[TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA](
+        SemanticTokensDeltaParams(
+            text_document=TextDocumentIdentifier(uri=URI),
+            previous_result_id=previous_result_id,
+        )
+    )
+    return json.loads(result.body)["resultId"]
+
+
+def _semantic_tokens_in_range(features: Dict[str, Callable], line: int) -> None:
+    features[TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE](
+        SemanticTokensRangeParams(
+            text_document=TextDocumentIdentifier(uri=URI),
+            range=Range(
+                start=Position(line=line, character=0),
+                end=Position(line=line + VIEWPORT_LINES, character=0),
+            ),
+        )
+    )
+
+
+def _features() -> Dict[str, Callable]:
+    return create_server().lsp.fm.features
+
+
+def measure(text: str, iterations: int, parse_repeats: int) -> Dict[str, Any]:
+    lines = text.splitlines()
+    middle = len(lines) // 2
+    # Edit a paragraph and complete a footnote reference near the middle
+    edit_line = next(
+        index for index in range(middle, len(lines)) if lines[index].startswith("See ")
+    )
+    completion_position = Position(
+        line=edit_line, character=lines[edit_line].index("[#") + len("[#note1")
+    )
+    result: Dict[str, Any] = {
+        "lines": len(lines),
+        "footnotes": text.count("\n.. [#"),
+    }
+    result["parse_rst"] = _percentiles(
+        [_seconds(lambda: parse_rst(text)) for _ in range(parse_repeats)]
+    )
+
+    features = _features()
+    _open(features, text)
+    result_id = _semantic_tokens(features)
+    viewport_line = max(edit_line - VIEWPORT_LINES // 2, 0)
+    latencies: Dict[str, List[float]] = {
+        "did_change": [],
+        "completion": [],
+        "symbols": [],
+        "token_edits": [],
+        "token_range": [],
+    }
+    for version in range(1, iterations + 1):
+        latencies["did_change"].append(
+            _seconds(lambda: _change(features, version, edit_line))
+        )
+        latencies["completion"].append(
+            _seconds(lambda: _complete(features, completion_position))
+        )
+        latencies["symbols"].append(_seconds(lambda: _symbols(features)))
+        latencies["token_range"].append(
+            _seconds(lambda: _semantic_tokens_in_range(features, viewport_line))
+        )
+        start = time.perf_counter()
+        result_id = _semantic_token_edits(features, result_id)
+        latencies["token_edits"].append(time.perf_counter() - start)
+    for request, samples in latencies.items():
+        result[request] = _percentiles(samples)
+
+    tracemalloc.start()
+    features = _features()
+    _open(features, text)
+    _change(features, 1, edit_line)
+    _complete(features, completion_position)
+    _symbols(features)
+    result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--parse-repeats", type=int, default=3)
+    parser.add_argument("--output", help="Writes the results as JSON to this file")
+    args = parser.parse_args()
+
+    paragraphs = _paragraph_pool()
+    results = []
+    print(
+        f"{'lines':>8}{'request':>12}{'p50 [ms]':>12}{'p95 [ms]':>12}{'p99 [ms]':>12}"
+    )
+    for size in args.sizes:
+        text = generate_document(size, paragraphs)
+        result = measure(text, args.iterations, args.parse_repeats)
+        results.append(result)
+        for request in (
+            "parse_rst",
+            "did_change",
+            "completion",
+            "symbols",
+            "token_edits",
+            "token_range",
+        ):
+            latency = result[request]
+            print(
+                f"{result['lines']:>8}{request:>12}{latency['p50']:>12.2f}"
+                f"{latency['p95']:>12.2f}{latency['p99']:>12.2f}"
+            )
+        peak_memory = result["peak_memory_bytes"] / 2**20
+        print(f"{result['lines']:>8}{'peak memory':>12}{peak_memory:>11.1f}M")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "docutils": docutils.__version__,
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measures the memory that the parse results of open documents retain.
+
+A parse result keeps the lines of a document along with compact records of the
+sections, footnotes, targets and system messages of every block. For comparison,
+the script also measures the docutils doctrees of the same blocks, which parse
+results used to keep.
+
+Usage: python -m benchmarks.memory [--documents 20] [--lines 1000]
+"""
+import argparse
+import gc
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+from benchmarks.latency import _paragraph_pool, generate_document
+from rst_language_server.server import _parse_lines, parse_rst
+
+
+def _retained_bytes(function: Callable[[], Any]) -> Tuple[int, Any]:
+    """Returns the size of the memory allocated by *function* that is still in use."""
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    retained_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return retained_bytes, result
+
+
+def _parse_results(documents: List[List[str]]) -> list:
+    parsed_documents = []
+    for index, lines in enumerate(documents):
+        parsed_document = _parse_lines(f"file:///{index}.rst", 0, lines)
+        # Build the derived indexes that requests use
+        parsed_document.sections
+        parsed_document.footnote_labels
+        parsed_document.names
+        parsed_documents.append(parsed_document)
+    return parsed_documents
+
+
+def _doctrees(documents: List[List[str]]) -> list:
+    doctrees = []
+    for index, lines in enumerate(documents):
+        parsed_document = _parse_lines(f"file:///{index}.rst", 0, lines)
+        starts = parsed_document.block_starts
+        doctrees.append(
+            [
+                parse_rst("".join(lines[start:end]))
+                for start, end in zip(starts, starts[1:] + [len(lines)])
+            ]
+        )
+    return doctrees
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=1000)
+    args = parser.parse_args()
+
+    paragraphs = _paragraph_pool()
+    text = generate_document(args.lines, paragraphs)
+    # Every document has its own lines, just like open documents do
+    documents = [text.splitlines(True) for _ in range(args.documents)]
+    source_bytes, _ = _retained_bytes(lambda: [text.splitlines(True)])
+    # Parse one document first, so that the measurements leave out the import of
+    # the docutils parser and the settings that all parses share
+    _parse_results(documents[:1])
+
+    parse_result_bytes, _ = _retained_bytes(lambda: _parse_results(documents))
+    doctree_bytes, _ = _retained_bytes(lambda: _doctrees(documents))
+    print(f"{args.documents} documents with {len(documents[0])} lines each")
+    print(f"{'retained by':<16}{'total [MiB]':>14}{'per document [KiB]':>22}")
+    for name, retained_bytes in (
+        ("lines", source_bytes * args.documents),
+        ("parse results", parse_result_bytes),
+        ("block doctrees", doctree_bytes),
+    ):
+        print(
+            f"{name:<16}{retained_bytes / 2**20:>14.1f}"
+            f"{retained_bytes / args.documents / 2**10:>22.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
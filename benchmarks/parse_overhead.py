@@ -0,0 +1,49 @@
+"""Measures the per-call overhead of parse_rst.
+
+Compares the current implementation against building the docutils settings and
+parser from scratch for every parse, which is what parse_rst used to do.
+
+Usage: python -m benchmarks.parse_overhead
+"""
+import timeit
+
+from docutils.frontend import OptionParser
+from docutils.parsers.rst import Parser
+from docutils.utils import new_document
+
+from rst_language_server.server import parse_rst
+
+SAMPLES = {
+    "empty": "",
+    "paragraph": "Paragraph\n",
+    "section": "Title\n=====\n\nParagraph with *emphasis*.\n\n.. [#note] Footnote\n",
+}
+
+
+def parse_rst_without_reuse(text: str):
+    rst_parser = Parser()
+    settings = OptionParser(
+        components=(Parser,), defaults=dict(report_level=3)
+    ).get_default_values()
+    document = new_document("rst document", settings=settings)
+    rst_parser.parse(text, document)
+    return document
+
+
+def _per_call_microseconds(parse, text: str, number: int) -> float:
+    parse(text)  # warm up
+    return (
+        min(timeit.repeat(lambda: parse(text), number=number, repeat=5)) / number * 1e6
+    )
+
+
+def main(number: int = 200):
+    print(f"{'sample':<12}{'before [µs]':>14}{'after [µs]':>14}{'speedup':>10}")
+    for name, text in SAMPLES.items():
+        before = _per_call_microseconds(parse_rst_without_reuse, text, number)
+        after = _per_call_microseconds(parse_rst, text, number)
+        print(f"{name:<12}{before:>14.1f}{after:>14.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
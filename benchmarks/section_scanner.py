@@ -0,0 +1,52 @@
+"""Compares scanning section titles to parsing the whole document.
+
+Both approaches produce the same section tree for the generated document.
+
+Usage: python -m benchmarks.section_scanner
+"""
+import time
+
+from rst_language_server.parsing import scan_headings
+from rst_language_server.server import _build_sections, _parse_lines
+
+SECTION = (
+    "Title {0}\n"
+    "=========\n"
+    "\n"
+    "Paragraph {0} with *emphasis* and ``literal text``.\n"
+    "\n"
+    "Subtitle {0}\n"
+    "-----------\n"
+    "\n"
+    "- Item\n"
+    "- Item with a footnote reference [#note{0}]_\n"
+    "\n"
+    ".. [#note{0}] Footnote\n"
+    "\n"
+)
+
+
+def _seconds(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(section_counts=(100, 1000, 5000)):
+    print(f"{'lines':>8}{'parse [ms]':>14}{'scan [ms]':>14}{'speedup':>10}")
+    for section_count in section_counts:
+        text = "".join(SECTION.format(i) for i in range(section_count))
+        lines = text.splitlines(True)
+        parse_seconds, parsed_sections = _seconds(
+            lambda: _parse_lines("file:///benchmark.rst", 0, lines).sections
+        )
+        scan_seconds, headings = _seconds(scan_headings, lines)
+        assert _build_sections(headings, len(lines)) == parsed_sections
+        print(
+            f"{len(lines):>8}{parse_seconds * 1000:>14.1f}{scan_seconds * 1000:>14.1f}"
+            f"{parse_seconds / scan_seconds:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Reports the modules that take the longest to import when rst-ls starts.
+
+The report is taken from python -X importtime in a new interpreter, which imports
+the command line interface and creates the server like rst-ls does. It lists the
+slowest imports by cumulative import time and whether the docutils parser was
+imported, which the server defers until after initialization.
+
+Usage: python -m benchmarks.startup [--limit 25]
+"""
+import argparse
+import subprocess
+import sys
+
+STARTUP = (
+    "from rst_language_server.cli import rst_ls; "
+    "from rst_language_server.server import create_server; "
+    "create_server()"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=25)
+    args = parser.parse_args()
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP],
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative_time, module = line.split(":", 1)[1].split("|")
+        imports.append((int(cumulative_time), int(self_time), module.rstrip()))
+    total = sum(self_time for _, self_time, _ in imports)
+    print(f"Imported {len(imports)} modules in {total / 1000:.1f} ms")
+    print(f"{'cumulative [ms]':>16}{'self [ms]':>12}  module")
+    for cumulative_time, self_time, module in sorted(imports, reverse=True)[
+        : args.limit
+    ]:
+        print(f"{cumulative_time / 1000:>16.1f}{self_time / 1000:>12.1f}  {module}")
+    parser_imported = any(
+        module.strip() == "docutils.parsers.rst" for _, _, module in imports
+    )
+    print(f"docutils parser imported: {'yes' if parser_imported else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Measures workspace symbol queries against a large number of section titles.
+
+Usage: python -m benchmarks.workspace_symbols
+"""
+import random
+import time
+
+from rst_language_server.server import _Section, _SymbolIndex
+
+WORDS = (
+    "installation configuration usage reference tutorial changelog api guide "
+    "advanced deployment testing release notes overview introduction license "
+    "contributing architecture plugins extensions troubleshooting faq security"
+).split()
+QUERIES = ("in", "conf", "instalation", "release notes", "plugin api", "xyz")
+
+
+def _titles(count: int, titles_per_document: int = 20):
+    generator = random.Random(0)
+    for document in range(count // titles_per_document):
+        yield f"file:///docs/{document}.rst", [
+            _Section(
+                name=" ".join(generator.sample(WORDS, 3)).title() + f" {title}",
+                start=10 * title,
+                end=10 * title + 9,
+            )
+            for title in range(titles_per_document)
+        ]
+
+
+def main(title_count: int = 100_000, limit: int = 100):
+    symbol_index = _SymbolIndex()
+    start = time.perf_counter()
+    for uri, sections in _titles(title_count):
+        symbol_index.update(uri, sections)
+    print(f"Indexed {title_count} titles in {time.perf_counter() - start:.2f} s")
+    print(f"{'query':<16}{'results':>8}{'time [ms]':>12}")
+    for query in QUERIES:
+        start = time.perf_counter()
+        results = symbol_index.search(query, limit)
+        elapsed = time.perf_counter() - start
+        print(f"{query:<16}{len(results):>8}{elapsed * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
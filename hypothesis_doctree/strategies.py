@@ -23,6 +23,7 @@ def text(draw) -> st.SearchStrategy[nodes.Text]:
             .map(lambda t: t.strip())
             .filter(lambda t: t)
             .filter(lambda t: t[-1] not in ".)")  # e.g. "0.", "0)"
+            .filter(lambda t: not t.endswith("::"))  # Literal block marker
             .filter(lambda t: combining(t[0]) == 0),
         )
     )
@@ -1,8 +1,12 @@
+import json
 import logging
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+from urllib.parse import quote
 
 import click
 
-from rst_language_server.server import create_server
+from rst_language_server.server import LintResult, create_server, lint_paths
 
 _log_level_names = [
     logging.getLevelName(level).lower()
@@ -10,7 +14,7 @@ _log_level_names = [
 ]
 
 
-@click.command("rst-ls")
+@click.group("rst-ls", invoke_without_command=True)
 @click.option(
     "--log-file",
     type=click.Path(dir_okay=False),
@@ -29,15 +33,209 @@ _log_level_names = [
     show_default=True,
     help="Whether a client interprets the text returned in autocompletion responses",
 )
-def rst_ls(log_file, log_level: str, client_insert_text_interpretation: bool):
+@click.option(
+    "--parse-delay",
+    type=click.FloatRange(min=0),
+    help=(
+        "Parses changed documents in the background once no edits occurred for "
+        "the specified number of seconds. By default, documents are parsed "
+        "immediately upon each change"
+    ),
+)
+@click.option(
+    "--parse-processes",
+    type=click.IntRange(min=1),
+    help=(
+        "Parses changed documents in the background using the specified number "
+        "of worker processes, so that several documents are parsed in parallel. "
+        "Implies --parse-delay 0 unless specified otherwise"
+    ),
+)
+@click.option(
+    "--index-workspace",
+    is_flag=True,
+    help="Indexes all reStructuredText files in the workspace upon initialization",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help=(
+        "Stores the workspace index in the specified directory, so that only "
+        "changed files are indexed again when the server restarts"
+    ),
+)
+@click.option(
+    "--metrics",
+    is_flag=True,
+    help=(
+        "Records the latency of requests, parses and index updates as well as the "
+        "size of responses, which clients can query with the rst.metrics command"
+    ),
+)
+@click.option(
+    "--metrics-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Writes the recorded metrics to the log file at the specified interval in "
+        "seconds. Implies --metrics"
+    ),
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help=(
+        "Samples the call stacks of the server and writes them to the specified "
+        "file in the collapsed format of flame graph tools when the server exits"
+    ),
+)
+@click.pass_context
+def rst_ls(
+    ctx: click.Context,
+    log_file,
+    log_level: str,
+    client_insert_text_interpretation: bool,
+    parse_delay: Optional[float],
+    parse_processes: Optional[int],
+    index_workspace: bool,
+    cache_dir: Optional[str],
+    metrics: bool,
+    metrics_interval: Optional[float],
+    profile: Optional[str],
+):
+    if ctx.invoked_subcommand is not None:
+        return
     if log_file:
         file_handler = logging.FileHandler(filename=log_file)
-        pygls_logger = logging.getLogger("pygls")
-        pygls_logger.setLevel(log_level.upper())
-        pygls_logger.addHandler(file_handler)
-    server_ = create_server(client_insert_text_interpretation)
+        for logger_name in ("pygls", "rst_language_server"):
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(log_level.upper())
+            logger.addHandler(file_handler)
+    server_ = create_server(
+        client_insert_text_interpretation,
+        parse_delay=parse_delay,
+        parse_processes=parse_processes,
+        index_workspace=index_workspace,
+        cache_dir=cache_dir,
+        collect_metrics=metrics,
+        metrics_log_interval=metrics_interval,
+        profile_path=profile,
+    )
     server_.start_io()
 
 
+# Exit codes of the check command by the severity of the worst system message
+_EXIT_CODE_WARNINGS = 1
+_EXIT_CODE_ERRORS = 2
+
+_SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+@rst_ls.command("check")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Number of worker processes. Defaults to the number of CPUs",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["jsonl", "sarif"]),
+    default="jsonl",
+    show_default=True,
+    help="Writes one JSON object per diagnostic or a SARIF log",
+)
+@click.pass_context
+def check(
+    ctx: click.Context, paths: Tuple[str, ...], jobs: Optional[int], output_format: str
+):
+    """Reports warnings and errors in reStructuredText files.
+
+    Directories are searched for files with the suffix ".rst". Diagnostics are
+    written to stdout as soon as a file has been parsed. The exit code is 1 if
+    there were warnings and 2 if there were errors.
+    """
+    severities: Set[str] = set()
+
+    def results() -> Iterator[LintResult]:
+        for result in lint_paths(paths, jobs):
+            severities.update(message.severity for message in result.messages)
+            yield result
+
+    write_output = _write_sarif if output_format == "sarif" else _write_json_lines
+    write_output(results())
+    if "error" in severities:
+        ctx.exit(_EXIT_CODE_ERRORS)
+    if severities:
+        ctx.exit(_EXIT_CODE_WARNINGS)
+
+
+def _write_json_lines(results: Iterable[LintResult]) -> None:
+    for path, messages in results:
+        for message in messages:
+            diagnostic = dict(
+                path=path,
+                line=message.line + 1,
+                severity=message.severity,
+                message=message.message,
+            )
+            click.echo(json.dumps(diagnostic))
+
+
+def _write_sarif(results: Iterable[LintResult]) -> None:
+    # The log is written piecemeal, so that results need not be held in memory
+    source_root = Path.cwd().resolve()
+    header = json.dumps(
+        {
+            "version": "2.1.0",
+            "$schema": _SARIF_SCHEMA,
+            "runs": [
+                {
+                    "tool": {"driver": {"name": "rst-ls"}},
+                    "originalUriBaseIds": {
+                        "%SRCROOT%": {"uri": source_root.as_uri().rstrip("/") + "/"}
+                    },
+                    "results": [],
+                }
+            ],
+        }
+    )
+    prefix, suffix = header.rsplit("[]", 1)
+    click.echo(prefix + "[")
+    separator = ""
+    for path, messages in results:
+        for message in messages:
+            result = {
+                "level": message.severity,
+                "message": {"text": message.message},
+                "locations": [
+                    {
+                        "physicalLocation": {
+                            "artifactLocation": _artifact_location(path, source_root),
+                            "region": {"startLine": message.line + 1},
+                        }
+                    }
+                ],
+            }
+            click.echo(separator + json.dumps(result), nl=False)
+            separator = ",\n"
+    click.echo("\n]" + suffix)
+
+
+def _artifact_location(path: str, source_root: Path) -> Dict[str, str]:
+    """Returns the SARIF artifact location of the file at *path*.
+
+    Files below *source_root* are referred to relative to it, so that code
+    scanning services can match them with the files in their repositories.
+    """
+    absolute_path = Path(path).resolve()
+    try:
+        relative_path = absolute_path.relative_to(source_root)
+    except ValueError:
+        return {"uri": absolute_path.as_uri()}
+    return {"uri": quote(relative_path.as_posix()), "uriBaseId": "%SRCROOT%"}
+
+
 def main():
     rst_ls()
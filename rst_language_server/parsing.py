@@ -0,0 +1,601 @@
+"""Parsing of reStructuredText with docutils.
+
+Importing the docutils parser takes longer than starting the rest of the server.
+The server therefore imports this module on first use or in the background after
+initialization, so that it can answer the initialize request right away.
+"""
+import copy
+import re
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import docutils
+import docutils.nodes as nodes
+from docutils.frontend import OptionParser
+from docutils.parsers.rst import Parser, roles, states
+from docutils.statemachine import string2lines
+from docutils.utils import column_width, new_document
+
+from rst_language_server.records import (
+    DIRECTIVE_TOKEN,
+    LITERAL_TOKEN,
+    REFERENCE_TOKEN,
+    ROLE_TOKEN,
+    SECTION_TOKEN,
+    WARNING_LEVEL,
+    Block,
+    Footnote,
+    Heading,
+    Occurrence,
+    SystemMessage,
+    find_block_starts,
+    simple_table_border,
+    utf16_column,
+)
+
+
+class _IndexVisitor(nodes.SparseNodeVisitor):
+    def __init__(self, doc: nodes.document, lines: Sequence[str]):
+        super().__init__(doc)
+        self.lines = lines
+        self.footnotes: List[Footnote] = []
+        self.headings: List[Heading] = []
+        self.definitions: List[Occurrence] = []
+        self.references: List[Occurrence] = []
+        # Semantic tokens as (line, start, length, type) tuples
+        self.tokens: List[Tuple[int, int, int, int]] = []
+        self.literal_block_lines: Set[int] = set()
+        self.previous_underline_index = -1
+        # Offsets up to which the source text starting at a line was searched
+        self._search_offsets: Dict[int, int] = {}
+        # Line from which literal blocks without a known line are searched
+        self._literal_search_line = 0
+
+    def visit_footnote(self, node: nodes.footnote) -> None:
+        self._add_definitions("footnote", node)
+        if not node["names"]:
+            # Anonymous auto-numbered footnotes and auto-symbol footnotes
+            return
+        paragraphs = [child for child in node.children if child.tagname == "paragraph"]
+        self.footnotes.append(
+            Footnote(
+                label=node["names"][0],
+                auto_numbered="auto" in node,
+                detail=paragraphs[0].astext() if paragraphs else None,
+            )
+        )
+
+    def visit_section(self, node: nodes.section) -> None:
+        # docutils reports the (1-based) line number of the title underline
+        underline_index = node.line - 1
+        title_index = underline_index - 1
+        underline = self.lines[underline_index].rstrip()
+        style = underline[0] if underline else ""
+        overline_index = title_index - 1
+        # Only another title can directly precede a title. Thus, the line is an
+        # overline unless it belongs to the previous title.
+        if (
+            overline_index > self.previous_underline_index
+            and self.lines[overline_index].rstrip() == underline
+        ):
+            title_index = overline_index
+            style = 2 * style
+        self.previous_underline_index = underline_index
+        self.headings.append(
+            Heading(name=node[0].astext(), line=title_index, style=style)
+        )
+        title = self.lines[underline_index - 1]
+        indent = len(title) - len(title.lstrip())
+        self.tokens.append(
+            (underline_index - 1, indent, len(title.strip()), SECTION_TOKEN)
+        )
+
+    def visit_citation(self, node: nodes.citation) -> None:
+        self._add_definitions("citation", node)
+
+    def visit_target(self, node: nodes.target) -> None:
+        self._add_definitions("target", node)
+
+    def visit_substitution_definition(
+        self, node: nodes.substitution_definition
+    ) -> None:
+        self._add_definitions("substitution", node)
+
+    def visit_footnote_reference(self, node: nodes.footnote_reference) -> None:
+        self._add_reference("footnote", node, REFERENCE_TOKEN)
+
+    def visit_citation_reference(self, node: nodes.citation_reference) -> None:
+        self._add_reference("citation", node, REFERENCE_TOKEN)
+
+    def visit_reference(self, node: nodes.reference) -> None:
+        self._add_reference("target", node)
+
+    def visit_substitution_reference(self, node: nodes.substitution_reference) -> None:
+        self._add_reference("substitution", node)
+
+    def visit_literal(self, node: nodes.literal) -> None:
+        line, start, end = self._locate(node)
+        self._add_token(line, start, end, LITERAL_TOKEN)
+
+    def visit_literal_block(self, node: nodes.literal_block) -> None:
+        content = node.rawsource.splitlines()
+        if not content:
+            return
+        if node.line is not None:
+            first_line = node.line - 1
+        else:
+            # Literal blocks of directives, e.g. "code"
+            first_content = content[0].strip()
+            first_line = next(
+                (
+                    index
+                    for index in range(self._literal_search_line, len(self.lines))
+                    if self.lines[index].strip() == first_content
+                ),
+                None,
+            )
+            if first_line is None:
+                return
+        self._literal_search_line = first_line + len(content)
+        for line in range(first_line, min(first_line + len(content), len(self.lines))):
+            text = self.lines[line].rstrip()
+            indent = len(text) - len(text.lstrip())
+            if text:
+                self.tokens.append((line, indent, len(text) - indent, LITERAL_TOKEN))
+                self.literal_block_lines.add(line)
+        raise nodes.SkipNode()
+
+    def visit_system_message(self, node: nodes.system_message) -> None:
+        if (
+            len(node) == 2
+            and node[0].astext() == "Title level inconsistent:"
+            and node.get("line") is not None
+        ):
+            # Rejected titles do not start sections, but their underline must not
+            # be mistaken for the overline of the next title. docutils reports the
+            # (1-based) line of the underline, or of the text of overlined titles.
+            source_lines = node[1].astext().count("\n") + 1
+            self.previous_underline_index = node["line"] - 1 + source_lines - 2
+        # Messages quote the offending source, e.g. unknown directives
+        raise nodes.SkipNode()
+
+    def unknown_visit(self, node: nodes.Node) -> None:
+        pass
+
+    def dispatch_visit(self, node: nodes.Node) -> None:
+        rawsource = getattr(node, "rawsource", "")
+        if isinstance(node, nodes.Inline) and rawsource[:1] in (":", "`"):
+            match = _role.search(rawsource)
+            if match is not None:
+                # Highlights the role rather than the text
+                role = match.group(1) or match.group(2)
+                line, start, end = self._locate(node)
+                if match.group(1) is None:
+                    # The role follows the text, which may span several lines
+                    line, start = self._line_offset(line, end - len(role))
+                self._add_token(line, start, start + len(role), ROLE_TOKEN)
+                raise nodes.SkipNode()
+        super().dispatch_visit(node)
+
+    def _add_definitions(self, kind: str, node: nodes.Element) -> None:
+        # docutils moves the names of duplicate definitions to "dupnames"
+        names = node["names"] + node["dupnames"]
+        if not names:
+            return
+        if node.line is None:
+            # Inline targets and targets of embedded URIs
+            line, start, end = self._locate(node)
+        else:
+            line = node.line - 1
+            text = self.lines[line].rstrip() if line < len(self.lines) else ""
+            match = _explicit_markup_name.match(text)
+            start, end = match.span(1) if match else (0, len(text))
+        for name in names:
+            self.definitions.append(
+                Occurrence(
+                    kind=kind,
+                    name=name,
+                    line=line,
+                    start=start,
+                    end=end,
+                    uri=node.get("refuri"),
+                )
+            )
+
+    def _add_reference(
+        self, kind: str, node: nodes.Element, token_type: Optional[int] = None
+    ) -> None:
+        if "refname" not in node and token_type is None:
+            # Anonymous references, auto-numbered and auto-symbol footnote
+            # references, and references to URIs
+            return
+        line, start, end = self._locate(node)
+        if token_type is not None:
+            self._add_token(line, start, end, token_type)
+        if "refname" in node:
+            self.references.append(
+                Occurrence(
+                    kind=kind, name=node["refname"], line=line, start=start, end=end
+                )
+            )
+
+    def _add_token(self, line: int, start: int, end: int, token_type: int) -> None:
+        """Adds a token that may continue on the following lines.
+
+        *end* is an offset from the start of *line* and exceeds the line if the
+        token spans several lines. Such tokens are split into one token per line.
+        """
+        while line < len(self.lines):
+            text = self.lines[line].rstrip("\r\n")
+            if end <= len(text):
+                if end > start:
+                    self.tokens.append((line, start, end - start, token_type))
+                return
+            if len(text) > start:
+                self.tokens.append((line, start, len(text) - start, token_type))
+            end -= len(self.lines[line])
+            line += 1
+            next_text = self.lines[line] if line < len(self.lines) else ""
+            start = len(next_text) - len(next_text.lstrip())
+
+    def _line_offset(self, line: int, offset: int) -> Tuple[int, int]:
+        """Returns the line and character at *offset* from the start of *line*."""
+        while line + 1 < len(self.lines) and offset >= len(self.lines[line]):
+            offset -= len(self.lines[line])
+            line += 1
+        return line, offset
+
+    def _locate(self, node: nodes.Element) -> Tuple[int, int, int]:
+        """Finds the source text of an inline node in the lines of the block.
+
+        Returns the line as well as the start and end character of the text. The
+        search starts at the first line of the closest ancestor with a known line
+        and stops at the next blank line. Inline nodes with the same source text are
+        found one after another. Nodes that cannot be found are located at the
+        start of the ancestor.
+        """
+        element = node.parent
+        while element.line is None and element.parent is not None:
+            element = element.parent
+        first_line = element.line - 1 if element.line else 0
+        text_lines = []
+        for line in self.lines[first_line:]:
+            if not line.strip():
+                break
+            text_lines.append(line)
+        text = "".join(text_lines)
+        pattern = r"\s+".join(map(re.escape, node.rawsource.split()))
+        offset = self._search_offsets.get(first_line, 0)
+        match = re.compile(pattern).search(text, offset) if pattern else None
+        if match is None:
+            return first_line, 0, 0
+        self._search_offsets[first_line] = match.end()
+        line = first_line + text.count("\n", 0, match.start())
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        return line, match.start() - line_start, match.end() - line_start
+
+
+# Matches the role of interpreted text, which precedes or follows the text, e.g.
+# ":emphasis:`text`" or "`text`:code:"
+_role = re.compile(
+    rf"^(:{states.Inliner.simplename}:)`|`(:{states.Inliner.simplename}:)$"
+)
+# Matches the explicit markup start and the type of a directive, e.g. ".. note::"
+_directive = re.compile(
+    rf"[ \t]*(\.\.[ \t]+{states.Inliner.simplename}[ \t]*::)(?:\s|$)"
+)
+
+# Matches the name of an explicit markup construct including its delimiters, such
+# as "[#label]", "|name|" or "_`name`:"
+_explicit_markup_name = re.compile(
+    r"\s*\.\.\s+(\[[^\]]+\]|\|[^|]+\||_(?:`[^`]+`|(?:[^:\\]|\\.)+):)"
+)
+
+
+def parse_block(lines: Sequence[str]) -> Block:
+    """Parses a top-level block and returns the records that the server keeps."""
+    rst = parse_rst("".join(lines))
+    visitor = _IndexVisitor(rst, lines)
+    rst.walk(visitor)
+    return Block(
+        footnotes=tuple(visitor.footnotes),
+        headings=tuple(visitor.headings),
+        definitions=_utf16_columns(lines, visitor.definitions),
+        references=_utf16_columns(lines, visitor.references),
+        messages=tuple(system_messages(rst, lines)),
+        tokens=_semantic_tokens(lines, visitor.tokens, visitor.literal_block_lines),
+    )
+
+
+def _utf16_columns(
+    lines: Sequence[str], occurrences: List[Occurrence]
+) -> Tuple[Occurrence, ...]:
+    """Converts the columns of occurrences from code points to UTF-16 code units."""
+    return tuple(
+        occurrence._replace(
+            start=utf16_column(lines[occurrence.line], occurrence.start),
+            end=utf16_column(lines[occurrence.line], occurrence.end),
+        )
+        if occurrence.line < len(lines)
+        else occurrence
+        for occurrence in occurrences
+    )
+
+
+def _semantic_tokens(
+    lines: Sequence[str],
+    tokens: List[Tuple[int, int, int, int]],
+    literal_block_lines: Set[int],
+) -> Tuple[int, ...]:
+    """Returns the tokens of a block as a flat tuple in the order of their position.
+
+    The doctree does not tell where directives are, so they are found in the lines
+    outside literal blocks. Tokens that overlap a preceding token, e.g. inline
+    literals in section titles, are dropped. Starts and lengths are converted to
+    UTF-16 code units, like the columns of occurrences.
+    """
+    for index, line in enumerate(lines):
+        if index in literal_block_lines:
+            continue
+        match = _directive.match(line)
+        if match is not None:
+            start, end = match.span(1)
+            tokens.append((index, start, end - start, DIRECTIVE_TOKEN))
+    flat_tokens: List[int] = []
+    previous_line, previous_end = -1, 0
+    for line, start, length, token_type in sorted(tokens):
+        if line == previous_line and start < previous_end:
+            continue
+        previous_line, previous_end = line, start + length
+        utf16_start = utf16_column(lines[line], start)
+        utf16_end = utf16_column(lines[line], start + length)
+        flat_tokens += (line, utf16_start, utf16_end - utf16_start, token_type)
+    return tuple(flat_tokens)
+
+
+def system_messages(rst: nodes.document, lines: Sequence[str]) -> List[SystemMessage]:
+    """Returns the warnings and errors reported while parsing *lines*."""
+    return [
+        SystemMessage(
+            line=_message_line(rst, lines, message),
+            level=message["level"],
+            message=message[0].astext() if message.children else "",
+        )
+        for message in rst.parse_messages
+        if message["level"] >= WARNING_LEVEL
+    ]
+
+
+def _message_line(
+    rst: nodes.document, lines: Sequence[str], message: nodes.system_message
+) -> int:
+    """Returns the index of the line in *lines* that a system message refers to.
+
+    Messages about inline markup refer to the element that contains the markup.
+    docutils reports other messages on the line following the offending
+    construct at times, which is blank at the end of a block. Such messages are
+    moved to the last non-blank line before it.
+    """
+    # Some messages, e.g. about duplicate substitution definitions, only record
+    # their line in the attribute
+    line = message.line or message.get("line")
+    for node_id in message["backrefs"]:
+        node = rst.ids.get(node_id)
+        while node is not None and node.line is None:
+            node = node.parent
+        if node is not None:
+            line = node.line
+            break
+    line_index = min(max((line or 1) - 1, 0), max(len(lines) - 1, 0))
+    while line_index > 0 and not lines[line_index].strip():
+        line_index -= 1
+    return line_index
+
+
+# Lines that docutils treats as title adornments or transitions
+_adornment = re.compile(states.Body.patterns["line"])
+# Body elements that docutils tries to match before section titles
+_body_element_starts = [
+    re.compile(states.Body.patterns[name])
+    for name in states.Body.initial_transitions[
+        : states.Body.initial_transitions.index("line")
+    ]
+]
+# Characters that may start inline markup or change the text of a title
+_title_markup_characters = frozenset("*`|_\\\t\v\f")
+
+
+class _AmbiguousMarkup(Exception):
+    pass
+
+
+def scan_headings(lines: Sequence[str]) -> Optional[List[Heading]]:
+    """Finds section titles without parsing the document.
+
+    The scanner recognizes the same titles as parsing the blocks of a document
+    with docutils. It returns headings with absolute line numbers, or None if the
+    document contains constructs that the scanner cannot interpret with
+    certainty, such as titles with inline markup or malformed adornments.
+    """
+    try:
+        return list(_HeadingScanner(lines).scan())
+    except _AmbiguousMarkup:
+        return None
+
+
+class _HeadingScanner:
+    def __init__(self, lines: Sequence[str]):
+        self.lines = [line.rstrip() for line in lines]
+        block_starts, _ = find_block_starts(lines, 0, len(lines))
+        self.block_starts = frozenset(block_starts)
+        # Title styles and the current section level, which docutils tracks per
+        # parse and thus per block
+        self.styles: List[str] = []
+        self.level = 0
+
+    def line(self, index: int) -> str:
+        return self.lines[index] if index < len(self.lines) else ""
+
+    def scan(self) -> Iterator[Heading]:
+        index = 0
+        at_element_start = True
+        expects_literal_block = False
+        in_table = False
+        while index < len(self.lines):
+            line = self.lines[index]
+            if index in self.block_starts:
+                self.styles, self.level = [], 0
+            if not line:
+                at_element_start = True
+                index += 1
+                continue
+            if line[0].isspace():
+                expects_literal_block = False
+                # docutils warns about unindented text right after indented text
+                at_element_start = False
+                index += 1
+                continue
+            if in_table:
+                # Like find_block_starts, end simple tables at a border and a blank line
+                if simple_table_border.match(line) and not self.line(index + 1):
+                    in_table = False
+                elif _adornment.match(line):
+                    # Possibly a title following a malformed table
+                    raise _AmbiguousMarkup()
+                index += 1
+                continue
+            if not at_element_start:
+                if _adornment.match(line):
+                    # Possibly an unexpected section title
+                    raise _AmbiguousMarkup()
+                index += 1
+                continue
+            if expects_literal_block:
+                # Possibly a quoted literal block
+                raise _AmbiguousMarkup()
+            at_element_start = False
+            next_line = self.line(index + 1)
+            next_line_is_adornment = bool(next_line) and bool(
+                _adornment.match(next_line)
+            )
+            if _adornment.match(line):
+                if not next_line:
+                    # Transition or paragraph
+                    index += 1
+                    continue
+                if len(line) < 4 or next_line_is_adornment:
+                    raise _AmbiguousMarkup()
+                heading = self.over_and_underlined_title(index)
+                index += 3
+            elif any(pattern.match(line) for pattern in _body_element_starts):
+                if next_line_is_adornment:
+                    raise _AmbiguousMarkup()
+                in_table = bool(simple_table_border.match(line)) and bool(next_line)
+                index += 1
+                continue
+            elif next_line_is_adornment:
+                if column_width(line) > len(next_line) and len(next_line) < 4:
+                    # docutils treats short underlines as paragraph text
+                    index += 2
+                    continue
+                heading = self.underlined_title(index)
+                index += 2
+            else:
+                expects_literal_block = self.paragraph_ends_with_literal_marker(index)
+                index += 1
+                continue
+            at_element_start = True
+            if heading is not None:
+                yield heading
+
+    def over_and_underlined_title(self, index: int) -> Optional[Heading]:
+        overline, title, underline = (self.line(index + i) for i in range(3))
+        if underline != overline:
+            raise _AmbiguousMarkup()
+        return self.heading(title.strip(), index, 2 * overline[0])
+
+    def underlined_title(self, index: int) -> Optional[Heading]:
+        title, underline = self.lines[index], self.lines[index + 1]
+        return self.heading(title, index, underline[0])
+
+    def heading(self, title: str, index: int, style: str) -> Optional[Heading]:
+        if _title_markup_characters.intersection(title):
+            raise _AmbiguousMarkup()
+        if style in self.styles:
+            level = self.styles.index(style) + 1
+            if level > self.level + 1:
+                # docutils reports an inconsistent title level and drops the title
+                return None
+        elif len(self.styles) == self.level:
+            self.styles.append(style)
+            level = len(self.styles)
+        else:
+            return None
+        self.level = level
+        return Heading(name=title, line=index, style=style)
+
+    def paragraph_ends_with_literal_marker(self, index: int) -> bool:
+        while self.line(index + 1) and not self.line(index + 1)[0].isspace():
+            index += 1
+        return self.lines[index].endswith("::")
+
+
+# Never abort parsing of incomplete text. System messages are taken from the
+# parsed document rather than written to stderr.
+_settings_overrides = dict(report_level=3, halt_level=5, warning_stream=False)
+# Identifies the parser settings, so that parse results are only shared between
+# parsers that produce the same results
+SETTINGS_KEY = f"docutils {docutils.__version__} {sorted(_settings_overrides.items())}"
+
+
+class _ParseContext(threading.local):
+    """Docutils machinery that is reused across calls to :func:`parse_rst`.
+
+    Computing the default settings and building the rST state machine take
+    longer than parsing short texts. Both are therefore created once per thread.
+    Every parse still operates on a fresh document with its own copy of the
+    settings.
+    """
+
+    def __init__(self):
+        self.settings = OptionParser(
+            components=(Parser,), defaults=_settings_overrides
+        ).get_default_values()
+        self._state_machine: Optional[states.RSTStateMachine] = None
+
+    def new_document(self) -> nodes.document:
+        return new_document("rst document", settings=copy.copy(self.settings))
+
+    def parse(self, text: str) -> nodes.document:
+        # Mirrors docutils.parsers.rst.Parser.parse, but keeps the state machine
+        document = self.new_document()
+        document.reporter.attach_observer(document.note_parse_message)
+        input_lines = string2lines(
+            text, tab_width=document.settings.tab_width, convert_whitespace=True
+        )
+        for line_index, line in enumerate(input_lines):
+            if len(line) > document.settings.line_length_limit:
+                error = document.reporter.error(
+                    f"Line {line_index + 1} exceeds the line-length-limit."
+                )
+                document.append(error)
+                break
+        else:
+            state_machine = self._state_machine or states.RSTStateMachine(
+                state_classes=states.state_classes, initial_state="Body"
+            )
+            # A state machine that failed midway may be left in an unusable state
+            self._state_machine = None
+            state_machine.run(input_lines, document)
+            self._state_machine = state_machine
+        # Restore the "default" default role after parsing a document
+        roles._roles.pop("", None)
+        document.reporter.detach_observer(document.note_parse_message)
+        return document
+
+
+_parse_context = _ParseContext()
+
+
+def parse_rst(text: str) -> nodes.document:
+    return _parse_context.parse(text)
@@ -0,0 +1,134 @@
+"""Records that parsing produces and the server keeps for every document.
+
+This module does not import docutils, so that the server can split documents
+into blocks and handle parse results without waiting for the docutils parser to
+be imported.
+"""
+import re
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+
+class Heading(NamedTuple):
+    name: str
+    # Line of the title or overline, relative to the start of the block
+    line: int
+    # Underline character, preceded by the overline character if present
+    style: str
+
+
+class Footnote(NamedTuple):
+    label: str
+    auto_numbered: bool
+    # Text of the first paragraph of the footnote
+    detail: Optional[str]
+
+
+class Occurrence(NamedTuple):
+    """Definition or use of a name, such as a footnote label or a target name."""
+
+    # One of "footnote", "citation", "target" and "substitution"
+    kind: str
+    name: str
+    line: int
+    # Characters in UTF-16 code units, like in LSP positions
+    start: int
+    end: int
+    # URI that a hyperlink target refers to, if any
+    uri: Optional[str] = None
+
+
+# docutils system message levels
+WARNING_LEVEL = 2
+ERROR_LEVEL = 3
+SEVERE_LEVEL = 4
+
+
+class SystemMessage(NamedTuple):
+    """Warning or error that docutils reported while parsing a document."""
+
+    line: int
+    # docutils system message level, i.e. 2 for warnings and 3 or 4 for errors
+    level: int
+    message: str
+
+    @property
+    def severity(self) -> str:
+        """Returns "error" or "warning" depending on the level of the message."""
+        return "error" if self.level >= ERROR_LEVEL else "warning"
+
+
+# LSP semantic token types in the order of the indexes that blocks record
+TOKEN_TYPES = ["class", "macro", "function", "variable", "string"]
+(
+    SECTION_TOKEN,
+    DIRECTIVE_TOKEN,
+    ROLE_TOKEN,
+    REFERENCE_TOKEN,
+    LITERAL_TOKEN,
+) = range(len(TOKEN_TYPES))
+
+
+class Block(NamedTuple):
+    """Result of parsing a top-level block of a document in isolation.
+
+    Blocks only keep the records that requests need rather than their doctrees,
+    because the doctrees of large documents take up hundreds of megabytes. Most
+    blocks are plain paragraphs, so the records are tuples and empty blocks share
+    the empty tuple.
+    """
+
+    footnotes: Tuple[Footnote, ...] = ()
+    headings: Tuple[Heading, ...] = ()
+    definitions: Tuple[Occurrence, ...] = ()
+    references: Tuple[Occurrence, ...] = ()
+    messages: Tuple[SystemMessage, ...] = ()
+    # Semantic tokens as consecutive (line, start, length, type) integers
+    tokens: Tuple[int, ...] = ()
+
+
+# Characters outside the Basic Multilingual Plane take two UTF-16 code units
+_astral_character = re.compile("[\U00010000-\U0010ffff]")
+
+
+def utf16_column(text: str, column: int) -> int:
+    """Converts a column of *text* from code points to UTF-16 code units."""
+    if text.isascii():
+        return column
+    return column + len(_astral_character.findall(text, 0, column))
+
+
+# Matches the borders of simple tables with at least two columns
+simple_table_border = re.compile(r"=+( +=+)+\s*$")
+
+
+def find_block_starts(
+    lines: Sequence[str], start: int, end: int
+) -> Tuple[List[int], bool]:
+    """Returns the first line of every top-level block in ``lines[start:end]``.
+
+    A top-level block starts with a non-indented line following a blank line. The
+    line at *start* is assumed to start a block. Since simple tables may contain
+    blank lines, a table only ends at a border that is followed by a blank line.
+    The second return value tells whether the range ends inside a simple table.
+    """
+    starts = []
+    in_table = False
+    previous_line_blank = True
+    previous_line_border = False
+    for line_index in range(start, end):
+        line = lines[line_index]
+        if not line.strip():
+            if previous_line_border:
+                in_table = False
+            previous_line_blank = True
+            previous_line_border = False
+            continue
+        is_border = bool(simple_table_border.match(line))
+        if previous_line_blank and not in_table and not line[0].isspace():
+            starts.append(line_index)
+            in_table = is_border
+        previous_line_blank = False
+        previous_line_border = is_border
+    if start < end and (not starts or starts[0] != start):
+        starts.insert(0, start)
+    return starts, in_table
@@ -1,38 +1,171 @@
+import asyncio
+import atexit
+import hashlib
+import heapq
+import json
+import logging
+import os
+import pickle
+import re
+import sqlite3
 import string
-from dataclasses import dataclass, field
-from typing import Iterable, List
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+from functools import partial, wraps
+from itertools import chain, islice
+from operator import attrgetter, itemgetter
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-import docutils.nodes as nodes
-from docutils.frontend import OptionParser
-from docutils.parsers.rst import Parser
-from docutils.utils import column_width, new_document
+from pygls.exceptions import JsonRpcInvalidParams
 from pygls.lsp.methods import (
     COMPLETION,
+    DEFINITION,
     DOCUMENT_SYMBOL,
+    INITIALIZED,
+    REFERENCES,
     TEXT_DOCUMENT_DID_CHANGE,
+    TEXT_DOCUMENT_DID_CLOSE,
     TEXT_DOCUMENT_DID_OPEN,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
+    WORKSPACE_DID_CHANGE_WATCHED_FILES,
+    WORKSPACE_SYMBOL,
 )
 from pygls.lsp.types import (
     CompletionItem,
     CompletionList,
     CompletionParams,
+    DefinitionParams,
+    Diagnostic,
+    DiagnosticSeverity,
     DidChangeTextDocumentParams,
+    DidChangeWatchedFilesParams,
+    DidChangeWatchedFilesRegistrationOptions,
+    DidCloseTextDocumentParams,
     DidOpenTextDocumentParams,
-    DocumentSymbol,
     DocumentSymbolParams,
+    FileChangeType,
+    FileSystemWatcher,
+    InitializedParams,
+    Location,
     Position,
     Range,
+    ReferenceParams,
+    Registration,
+    RegistrationParams,
+    SemanticTokensDeltaParams,
+    SemanticTokensLegend,
+    SemanticTokensParams,
+    SemanticTokensRangeParams,
+    SymbolInformation,
     SymbolKind,
+    TextDocumentContentChangeEvent,
+    TextDocumentContentChangeTextEvent,
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
+    WorkspaceSymbolParams,
 )
+from pygls.protocol import LanguageServerProtocol
 from pygls.server import LanguageServer
+from pygls.uris import to_fs_path
+from pygls.workspace import range_from_utf16
+
+from rst_language_server.records import (
+    ERROR_LEVEL,
+    SEVERE_LEVEL,
+    TOKEN_TYPES,
+    WARNING_LEVEL,
+    Block,
+    Footnote,
+    Heading,
+    Occurrence,
+    SystemMessage,
+    find_block_starts,
+    utf16_column,
+)
+
+if TYPE_CHECKING:
+    import docutils.nodes as nodes
+
+logger = logging.getLogger(__name__)
+
+# Command that reports the metrics collected by the server
+METRICS_COMMAND = "rst.metrics"
+# Commands that start sampling the call stacks of the server and that write the
+# samples to the file passed to the start command
+START_PROFILING_COMMAND = "rst.startProfiling"
+STOP_PROFILING_COMMAND = "rst.stopProfiling"
 
 
-@dataclass
 class _Section:
-    name: str
-    start: int
-    end: int
-    subsections: List["_Section"] = field(default_factory=list)
+    """Section of a document with absolute, inclusive start and end lines.
+
+    Open documents and the workspace index keep many sections, so sections only
+    have slots for their attributes.
+    """
+
+    __slots__ = ("name", "start", "end", "subsections")
+
+    def __init__(
+        self,
+        name: str,
+        start: int,
+        end: int,
+        subsections: Optional[List["_Section"]] = None,
+    ):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.subsections: List[_Section] = subsections if subsections else []
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, _Section):
+            return NotImplemented
+        return (self.name, self.start, self.end, self.subsections) == (
+            other.name,
+            other.start,
+            other.end,
+            other.subsections,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"_Section(name={self.name!r}, start={self.start!r}, end={self.end!r}, "
+            f"subsections={self.subsections!r})"
+        )
 
     def end_at(self, line: int):
         self.end = line
@@ -40,62 +173,1960 @@ class _Section:
             self.subsections[-1].end_at(line)
 
 
-def create_server(client_insert_text_interpretation: bool = True) -> LanguageServer:
-    rst_language_server = LanguageServer()
-    index = {
-        "footnotes": [],
-        "sections": {},
-    }
+class LintResult(NamedTuple):
+    """System messages of a file that was checked with :func:`lint_paths`."""
+
+    path: str
+    messages: List[SystemMessage]
+
+
+_SEMANTIC_TOKENS_LEGEND = SemanticTokensLegend(
+    token_types=TOKEN_TYPES, token_modifiers=[]
+)
+
+
+T = TypeVar("T")
+
+
+class _PrefixIndex(Generic[T]):
+    """Values sorted by their label to look up all labels with a common prefix."""
+
+    def __init__(self, labelled_values: Iterable[Tuple[str, T]]):
+        entries = sorted(labelled_values, key=itemgetter(0))
+        self._labels = [label for label, _ in entries]
+        self._values = [value for _, value in entries]
+
+    def complete(self, prefix: str, limit: int) -> Tuple[List[Tuple[str, T]], bool]:
+        """Returns up to *limit* labelled values whose label starts with *prefix*.
+
+        The second return value tells whether there were further matches.
+        """
+        matches = []
+        index = bisect_left(self._labels, prefix)
+        while index < len(self._labels) and self._labels[index].startswith(prefix):
+            if len(matches) == limit:
+                return matches, True
+            matches.append((self._labels[index], self._values[index]))
+            index += 1
+        return matches, False
+
+
+class _NameIndex:
+    """Definitions and uses of the names in a document.
+
+    Occurrences are looked up by kind and name, or by their position.
+    """
+
+    def __init__(
+        self, definitions: Iterable[Occurrence], references: Iterable[Occurrence]
+    ):
+        self._definitions: Dict[Tuple[str, str], List[Occurrence]] = {}
+        self._references: Dict[Tuple[str, str], List[Occurrence]] = {}
+        for names, occurrences in (
+            (self._definitions, definitions),
+            (self._references, references),
+        ):
+            for occurrence in occurrences:
+                names.setdefault((occurrence.kind, occurrence.name), []).append(
+                    occurrence
+                )
+        self._occurrences = sorted(
+            chain.from_iterable(
+                chain(self._definitions.values(), self._references.values())
+            ),
+            key=itemgetter(2, 3),
+        )
+        self._lines = [occurrence.line for occurrence in self._occurrences]
+
+    def definitions(self, kind: str, name: str) -> List[Occurrence]:
+        return self._definitions.get((kind, name), [])
+
+    def references(self, kind: str, name: str) -> List[Occurrence]:
+        return self._references.get((kind, name), [])
+
+    def at(self, line: int, character: int) -> Optional[Occurrence]:
+        """Returns the occurrence that contains the specified position, if any."""
+        index = bisect_left(self._lines, line)
+        while index < len(self._lines) and self._lines[index] == line:
+            occurrence = self._occurrences[index]
+            if occurrence.start <= character <= occurrence.end:
+                return occurrence
+            index += 1
+        return None
+
+
+@dataclass
+class _ParsedDocument:
+    uri: str
+    version: Optional[int]
+    lines: List[str]
+    blocks: List[Block]
+    block_starts: List[int]
+    _sections: Optional[List[_Section]] = field(default=None, repr=False)
+    _footnote_labels: Optional["_PrefixIndex[Footnote]"] = field(
+        default=None, repr=False
+    )
+    _names: Optional[_NameIndex] = field(default=None, repr=False)
+    _messages: Optional[List[SystemMessage]] = field(default=None, repr=False)
+    # Messages about names and titles across blocks, which reparsing carries over
+    _document_messages: Optional[List[SystemMessage]] = field(default=None, repr=False)
+
+    @property
+    def footnote_labels(self) -> "_PrefixIndex[Footnote]":
+        if self._footnote_labels is None:
+            self._footnote_labels = _PrefixIndex(
+                ("#" + fn.label if fn.auto_numbered else fn.label, fn)
+                for fn in self.footnotes
+            )
+        return self._footnote_labels
+
+    @property
+    def sections(self) -> List[_Section]:
+        if self._sections is None:
+            self._sections = _build_sections(
+                _absolute_headings(self.blocks, self.block_starts), len(self.lines)
+            )
+        return self._sections
+
+    @property
+    def names(self) -> _NameIndex:
+        if self._names is None:
+            self._names = _name_index(
+                self.lines,
+                _absolute_headings(self.blocks, self.block_starts),
+                self.blocks,
+                self.block_starts,
+            )
+        return self._names
+
+    @property
+    def size(self) -> int:
+        return sum(map(len, self.lines))
+
+    @property
+    def footnotes(self) -> Iterator[Footnote]:
+        return chain.from_iterable(block.footnotes for block in self.blocks)
+
+    @property
+    def messages(self) -> List[SystemMessage]:
+        """Returns the warnings and errors of the document ordered by line.
+
+        Blocks are parsed in isolation, so docutils cannot report names that are
+        defined in several blocks or titles that are inconsistent with the titles
+        of other blocks. Such messages are added for the document as a whole.
+        """
+        if self._messages is None:
+            if self._document_messages is None:
+                self._document_messages = _document_messages(
+                    self.blocks, self.block_starts
+                )
+            self._messages = sorted(
+                _block_messages(self.blocks, self.block_starts)
+                + self._document_messages,
+                key=attrgetter("line"),
+            )
+        return self._messages
+
+
+class _ParseCache:
+    """Holds the latest parse result of each document along with derived indexes.
+
+    Entries are keyed by document URI and are only returned when their version
+    matches the requested document version. When the total length of the cached
+    sources exceeds *max_size* characters, the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[_ParsedDocument, int]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, uri: str, version: Optional[int]) -> Optional[_ParsedDocument]:
+        entry = self.latest(uri)
+        if entry is None or entry.version != version:
+            return None
+        return entry
+
+    def latest(self, uri: str) -> Optional[_ParsedDocument]:
+        """Returns the cached entry for *uri* regardless of its version."""
+        if uri not in self._entries:
+            return None
+        self._entries.move_to_end(uri)
+        return self._entries[uri][0]
+
+    def put(self, entry: _ParsedDocument) -> None:
+        self.evict(entry.uri)
+        entry_size = entry.size
+        self._entries[entry.uri] = entry, entry_size
+        self._size += entry_size
+        while self._size > self.max_size and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def evict(self, uri: str) -> None:
+        _, entry_size = self._entries.pop(uri, (None, 0))
+        self._size -= entry_size
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._entries
+
+    def __iter__(self) -> Iterator[_ParsedDocument]:
+        return iter([entry for entry, _ in self._entries.values()])
+
+
+class _SharedParseCache:
+    """Shares parse results between documents with identical content.
+
+    Editors open the same content under different URIs, e.g. in symlinked trees,
+    git worktrees or preview buffers. Entries are keyed by a hash of the content
+    and of the parser settings, so that such documents are parsed once and share
+    their blocks and derived indexes. When the total size of the cached contents
+    exceeds *max_size* bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[_ParsedDocument, int]]" = OrderedDict()
+        self._size = 0
+
+    def parse(
+        self, uri: str, version: Optional[int], lines: List[str]
+    ) -> _ParsedDocument:
+        document = self.get(uri, version, lines)
+        if document is None:
+            document = _parse_lines(uri, version, lines)
+            self.put(document)
+        return document
+
+    def get(
+        self, uri: str, version: Optional[int], lines: List[str]
+    ) -> Optional[_ParsedDocument]:
+        """Returns a copy of the parse result of *lines* for *uri*, if cached."""
+        key, _ = self._key(lines)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        shared = entry[0]
+        # Build the derived indexes once for all documents with this content
+        shared.sections, shared.footnote_labels, shared.names
+        return replace(shared, uri=uri, version=version, lines=lines)
+
+    def put(self, document: _ParsedDocument) -> None:
+        """Caches the result of parsing a whole document."""
+        key, size = self._key(document.lines)
+        if key in self._entries:
+            return
+        self._entries[key] = document, size
+        self._size += size
+        while self._size > self.max_size and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    @staticmethod
+    def _key(lines: List[str]) -> Tuple[str, int]:
+        from rst_language_server import parsing
+
+        content = "".join(lines).encode("utf-8")
+        settings_key = parsing.SETTINGS_KEY.encode("utf-8")
+        return _content_hash(settings_key + b"\0" + content), len(content)
+
+
+class _DocumentLines:
+    """Lines of an open document that are kept in sync with the client's edits.
+
+    Lines keep their line breaks, so that they can be passed to the parser as is.
+    """
+
+    def __init__(self, version: Optional[int], source: str):
+        self.version = version
+        self.lines = source.splitlines(True)
+
+    def apply(
+        self,
+        version: Optional[int],
+        changes: Iterable[
+            Union[TextDocumentContentChangeEvent, TextDocumentContentChangeTextEvent]
+        ],
+    ) -> Tuple[int, int]:
+        """Applies content changes and returns the affected range of lines.
+
+        The range is given as the index of the first changed line and the number
+        of lines at the end of the document that remained unchanged.
+        """
+        self.lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+            self.lines, changes
+        )
+        self.version = version
+        return first_changed_line, unchanged_suffix
+
+    def __getitem__(self, index: int) -> str:
+        """Returns the text of the line at *index* without the line break.
+
+        Lines past the end of the document are empty.
+        """
+        if not 0 <= index < len(self.lines):
+            return ""
+        line = self.lines[index].splitlines()
+        return line[0] if line else ""
+
+
+@dataclass
+class _PendingChanges:
+    # Version of the parse result that the changed lines are relative to
+    base_version: Optional[int]
+    version: Optional[int]
+    lines: List[str]
+    first_changed_line: int
+    unchanged_suffix: int
+
+
+class _BackgroundParser:
+    """Parses changed documents in the background once edits have settled down.
+
+    Every edit postpones parsing of the edited document by *delay* seconds. A parse
+    covers all edits recorded until it starts and thereby supersedes the parses
+    scheduled for earlier versions. Bookkeeping happens on the event loop of the
+    language server, only the parsing itself runs on a worker thread or, if
+    *processes* is set, in a pool of worker processes.
+
+    Documents whose delay has passed wait until a worker is free, so that at most
+    one parse per worker is in flight. The focused document is parsed first and
+    the others in the order in which their delay passed.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        parse_cache: _ParseCache,
+        delay: float,
+        on_parsed: Optional[Callable[[_ParsedDocument], None]] = None,
+        metrics: Optional["_Metrics"] = None,
+        shared_parse_cache: Optional[_SharedParseCache] = None,
+        processes: Optional[int] = None,
+    ):
+        self._loop = loop
+        self._parse_cache = parse_cache
+        self._shared_parse_cache = shared_parse_cache
+        self._delay = delay
+        self._on_parsed = on_parsed
+        self._metrics = metrics or _Metrics(enabled=False)
+        self._executor: Executor
+        if processes:
+            self._executor = ProcessPoolExecutor(max_workers=processes)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="rst-language-server-parser"
+            )
+        self._in_process = bool(processes)
+        self._max_in_flight = processes or 1
+        self._in_flight = 0
+        self._pending: Dict[str, _PendingChanges] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # Documents whose delay has passed, in the order in which it passed
+        self._ready: "OrderedDict[str, None]" = OrderedDict()
+        self._running: Dict[str, asyncio.Future] = {}
+        self._focus: Optional[str] = None
+
+    def schedule(
+        self,
+        uri: str,
+        base_version: Optional[int],
+        version: Optional[int],
+        lines: List[str],
+        first_changed_line: int,
+        unchanged_suffix: int,
+    ) -> None:
+        """Records a change of a document from *base_version* and schedules a parse.
+
+        The changed lines are given by the index of the first changed line and the
+        number of unchanged lines at the end of the document. The *base_version* of
+        a document that has not been parsed yet is None.
+        """
+        pending = self._pending.get(uri)
+        if pending is not None:
+            base_version = pending.base_version
+            first_changed_line = min(first_changed_line, pending.first_changed_line)
+            unchanged_suffix = min(unchanged_suffix, pending.unchanged_suffix)
+        self._pending[uri] = _PendingChanges(
+            base_version=base_version,
+            version=version,
+            lines=lines,
+            first_changed_line=first_changed_line,
+            unchanged_suffix=unchanged_suffix,
+        )
+        self._ready.pop(uri, None)
+        timer = self._timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[uri] = self._loop.call_later(self._delay, self._start, uri)
+
+    def focus(self, uri: str) -> None:
+        """Parses *uri* before other documents, e.g. because the user works on it."""
+        self._focus = uri
+
+    def forget(self, uri: str) -> None:
+        """Discards pending changes and results of running parses for *uri*."""
+        self._pending.pop(uri, None)
+        self._ready.pop(uri, None)
+        self._running.pop(uri, None)
+        timer = self._timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+        if self._focus == uri:
+            self._focus = None
+
+    def _start(self, uri: str) -> None:
+        self._timers.pop(uri, None)
+        if uri in self._pending:
+            self._ready[uri] = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self._max_in_flight:
+            uri = self._next_ready()
+            if uri is None:
+                return
+            del self._ready[uri]
+            self._submit(uri, self._pending.pop(uri))
+
+    def _next_ready(self) -> Optional[str]:
+        # The parses of a document run one after another
+        if self._focus in self._ready and self._focus not in self._running:
+            return self._focus
+        return next((uri for uri in self._ready if uri not in self._running), None)
+
+    def _submit(self, uri: str, pending: _PendingChanges) -> None:
+        previous = self._parse_cache.latest(uri)
+        if previous is not None and previous.version != pending.base_version:
+            previous = None
+        if previous is None and self._shared_parse_cache is not None:
+            shared = self._shared_parse_cache.get(uri, pending.version, pending.lines)
+            if shared is not None:
+                self._deliver(shared)
+                return
+        previous_line_count = len(previous.lines) if previous is not None else 0
+        sent_previous = previous
+        if self._in_process:
+            # Reparsing only needs the line count of the previous result, and
+            # derived indexes that reparsing does not update are rebuilt on demand.
+            # The footnote index is replaced by an empty one, which the worker
+            # reports as reused if the footnotes did not change.
+            if previous is not None:
+                sent_previous = replace(
+                    previous,
+                    lines=[],
+                    _footnote_labels=(
+                        _PrefixIndex(())
+                        if previous._footnote_labels is not None
+                        else None
+                    ),
+                    _names=None,
+                    _messages=None,
+                )
+            parse: Callable[..., Any] = _parse_in_process
+        else:
+            parse = _parse_pending_changes
+        future = self._loop.run_in_executor(
+            self._executor, parse, uri, sent_previous, previous_line_count, pending
+        )
+        self._in_flight += 1
+        self._running[uri] = future
+        future.add_done_callback(
+            partial(self._finish, uri, pending, previous, time.perf_counter())
+        )
+
+    def _finish(
+        self,
+        uri: str,
+        pending: _PendingChanges,
+        previous: Optional[_ParsedDocument],
+        start: float,
+        future: asyncio.Future,
+    ) -> None:
+        self._in_flight -= 1
+        # Results of documents that were closed while being parsed are discarded
+        if self._running.get(uri) is future:
+            del self._running[uri]
+            if future.exception() is not None:
+                logger.error("Failed to parse %s", uri, exc_info=future.exception())
+            else:
+                self._metrics.record("parse", (time.perf_counter() - start) * 1e6)
+                if self._in_process:
+                    entry, reused_footnote_labels = future.result()
+                    entry = replace(entry, lines=pending.lines)
+                    if reused_footnote_labels and previous is not None:
+                        entry._footnote_labels = previous._footnote_labels
+                else:
+                    entry = future.result()
+                if previous is None and self._shared_parse_cache is not None:
+                    self._shared_parse_cache.put(entry)
+                self._deliver(entry)
+        self._dispatch()
+
+    def _deliver(self, entry: _ParsedDocument) -> None:
+        latest = self._parse_cache.latest(entry.uri)
+        if latest is None or not _is_newer(latest.version, entry.version):
+            self._parse_cache.put(entry)
+            if self._on_parsed is not None:
+                self._on_parsed(entry)
+
+
+class _DiagnosticsPublisher:
+    """Publishes the system messages of parsed documents as diagnostics.
+
+    Diagnostics are only sent to clients that support them and only when they
+    differ from the diagnostics last published for the document. Publications for
+    a document are at least *interval* seconds apart. Documents parsed within the
+    interval are published once it has passed, and only the latest one at that.
+    """
+
+    def __init__(self, server: LanguageServer, interval: float):
+        self._server = server
+        self._interval = interval
+        self._published: Dict[str, List[SystemMessage]] = {}
+        self._publish_times: Dict[str, float] = {}
+        self._latest: Dict[str, _ParsedDocument] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def publish(self, document: _ParsedDocument) -> None:
+        capabilities = getattr(self._server.lsp, "client_capabilities", None)
+        text_document_capabilities = capabilities and capabilities.text_document
+        if not (
+            text_document_capabilities
+            and text_document_capabilities.publish_diagnostics
+        ):
+            return
+        uri = document.uri
+        self._latest[uri] = document
+        if uri in self._timers:
+            return
+        loop = self._server.loop
+        delay = self._publish_times.get(uri, -self._interval) + self._interval
+        delay -= loop.time()
+        if delay > 0:
+            self._timers[uri] = loop.call_later(delay, self._publish_latest, uri)
+        else:
+            self._publish_latest(uri)
+
+    def clear(self, uri: str) -> None:
+        """Withdraws the diagnostics of a document, e.g. after it was closed."""
+        timer = self._timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+        self._latest.pop(uri, None)
+        self._publish_times.pop(uri, None)
+        if self._published.pop(uri, None):
+            self._server.publish_diagnostics(uri, [])
+
+    def _publish_latest(self, uri: str) -> None:
+        self._timers.pop(uri, None)
+        document = self._latest.pop(uri, None)
+        if document is None:
+            return
+        messages = document.messages
+        if messages == self._published.get(uri, []):
+            return
+        self._published[uri] = messages
+        self._publish_times[uri] = self._server.loop.time()
+        self._server.publish_diagnostics(
+            uri, [_to_diagnostic(document.lines, message) for message in messages]
+        )
+
+
+def _is_newer(version: Optional[int], other_version: Optional[int]) -> bool:
+    if version is None or other_version is None:
+        return False
+    return version > other_version
+
+
+def _parse_pending_changes(
+    uri: str,
+    previous: Optional[_ParsedDocument],
+    previous_line_count: int,
+    pending: _PendingChanges,
+) -> _ParsedDocument:
+    if previous is not None and previous.version == pending.base_version:
+        document = _reparse_changed_lines(
+            previous,
+            previous_line_count,
+            pending.version,
+            pending.lines,
+            pending.first_changed_line,
+            pending.unchanged_suffix,
+        )
+    else:
+        document = _parse_lines(uri, pending.version, pending.lines)
+    # Collect the messages along with the parse rather than when diagnostics are
+    # published on the event loop
+    document.messages
+    return document
+
+
+def _parse_in_process(
+    uri: str,
+    previous: Optional[_ParsedDocument],
+    previous_line_count: int,
+    pending: _PendingChanges,
+) -> Tuple[_ParsedDocument, bool]:
+    """Parses pending changes in a worker process.
+
+    Neither the previous result nor the result carry the lines of the document,
+    because the server has them already and sending them would double the
+    transfer. The same goes for the footnote index, so the second return value
+    only tells whether the result reuses the footnote index of *previous*.
+    """
+    document = _parse_pending_changes(uri, previous, previous_line_count, pending)
+    reused_footnote_labels = (
+        previous is not None
+        and previous._footnote_labels is not None
+        and document._footnote_labels is previous._footnote_labels
+    )
+    return (
+        replace(document, lines=[], _footnote_labels=None),
+        reused_footnote_labels,
+    )
+
+
+@dataclass
+class _FileIndex:
+    """Sections, footnotes and names of a file that is not necessarily open."""
+
+    uri: str
+    sections: List[_Section]
+    footnotes: List[Footnote]
+    names: _NameIndex
+
+
+class _IndexedFile(NamedTuple):
+    path: str
+    # None if the file could not be read
+    content_hash: Optional[str]
+    # None if the file could not be read or its content hash was known already
+    file_index: Optional[_FileIndex]
+
+
+def _index_files(files: Sequence[Tuple[str, Optional[str]]]) -> List[_IndexedFile]:
+    """Parses files in a worker process.
+
+    Each file is given by its path and the hash of its content when it was last
+    indexed. Files whose content still has the same hash are not parsed.
+    """
+    indexed_files = []
+    for path, known_content_hash in files:
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            source = content.decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            indexed_files.append(_IndexedFile(path, None, None))
+            continue
+        content_hash = _content_hash(content)
+        file_index = (
+            None
+            if content_hash == known_content_hash
+            else _index_source(Path(path).as_uri(), source)
+        )
+        indexed_files.append(_IndexedFile(path, content_hash, file_index))
+    return indexed_files
+
+
+def _lint_files(paths: Sequence[str]) -> List[LintResult]:
+    """Parses files in a worker process and returns their warnings and errors.
+
+    Each file is parsed as a whole, which takes about half the time of parsing its
+    blocks one by one with small files and two thirds with large ones. docutils
+    reports names and titles that conflict across blocks just like the server
+    does for open documents. Only where the server splits malformed markup, such
+    as a table that directly follows a paragraph, into other blocks than docutils
+    may its diagnostics differ from these messages.
+    """
+    from rst_language_server import parsing
+
+    results = []
+    for path in paths:
+        try:
+            with open(path, "rb") as file:
+                source = file.read().decode("utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            message = SystemMessage(
+                line=0, level=ERROR_LEVEL, message=f"Cannot read file: {e}"
+            )
+            results.append(LintResult(path, [message]))
+            continue
+        messages = parsing.system_messages(
+            parsing.parse_rst(source), source.splitlines()
+        )
+        messages.sort(key=attrgetter("line"))
+        results.append(LintResult(path, messages))
+    return results
+
+
+def lint_paths(
+    paths: Iterable[str], jobs: Optional[int] = None, batch_size: int = 16
+) -> Iterator[LintResult]:
+    """Parses files in *jobs* worker processes and yields their system messages.
+
+    Directories are searched for reStructuredText files. Results are yielded in
+    the order of the files. At most two batches per worker are queued, so that
+    memory usage does not depend on the number of files.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    files = chain.from_iterable(
+        [stat.path for stat in _find_rst_files(path)] if os.path.isdir(path) else [path]
+        for path in paths
+    )
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        queue: "deque[Future[List[LintResult]]]" = deque()
+        while True:
+            batch = list(islice(files, batch_size))
+            if not batch:
+                break
+            if len(queue) == 2 * jobs:
+                yield from queue.popleft().result()
+            queue.append(executor.submit(_lint_files, batch))
+        while queue:
+            yield from queue.popleft().result()
+
+
+def _content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+# Lines that may contain explicit markup, hyperlink references, inline targets or
+# substitution references
+_name_markup = re.compile(r"\s*\.\.\s|.*(_(?!\w)|\|)")
+
+
+def _index_source(uri: str, source: str) -> _FileIndex:
+    """Indexes a document without keeping its doctree.
+
+    Unless the section scanner gives up on the document, only the blocks that
+    may contain footnotes, targets or references are parsed.
+    """
+    from rst_language_server import parsing
+
+    lines = source.splitlines(True)
+    headings = parsing.scan_headings(lines)
+    if headings is None:
+        parsed_document = _parse_lines(uri, None, lines)
+        return _FileIndex(
+            uri=uri,
+            sections=parsed_document.sections,
+            footnotes=list(parsed_document.footnotes),
+            names=parsed_document.names,
+        )
+    block_starts, _ = find_block_starts(lines, 0, len(lines))
+    blocks = []
+    parsed_block_starts = []
+    for block_start, block_end in zip(block_starts, block_starts[1:] + [len(lines)]):
+        block_lines = lines[block_start:block_end]
+        if any(_name_markup.match(line) for line in block_lines):
+            blocks.append(parsing.parse_block(block_lines))
+            parsed_block_starts.append(block_start)
+    return _FileIndex(
+        uri=uri,
+        sections=_build_sections(headings, len(lines)),
+        footnotes=[footnote for block in blocks for footnote in block.footnotes],
+        names=_name_index(lines, headings, blocks, parsed_block_starts),
+    )
+
+
+class _FileStat(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+
+
+class _CacheEntry(NamedTuple):
+    mtime_ns: int
+    size: int
+    content_hash: str
+
+
+class _IndexCache:
+    """Index records of files that persist across restarts of the server.
+
+    Records are pickled into an SQLite database in *directory* and are keyed by
+    file path. A record is valid while the modification time and size of its file
+    are unchanged, or while the content hash of the file is unchanged. The cache
+    is discarded when the format of the records changes.
+
+    Records may be loaded in a thread other than the one that created the cache.
+    """
+
+    # Increment whenever the pickled records change
+    format_version = 5
+    # Number of records that are loaded with one query
+    load_batch_size = 500
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, "index.sqlite3"), check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        try:
+            self._create_table()
+        except sqlite3.Error:
+            self._connection.close()
+            raise
+
+    def _create_table(self) -> None:
+        (user_version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        with self._connection:
+            if user_version != self.format_version:
+                self._connection.execute("DROP TABLE IF EXISTS files")
+                self._connection.execute(
+                    f"PRAGMA user_version = {self.format_version:d}"
+                )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, "
+                "content_hash TEXT, record BLOB)"
+            )
+
+    def entries(self) -> Dict[str, _CacheEntry]:
+        """Returns the metadata of all cached records without loading them."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime_ns, size, content_hash FROM files"
+            ).fetchall()
+        return {path: _CacheEntry(*entry) for path, *entry in rows}
+
+    def load(self, paths: Sequence[str]) -> List[_FileIndex]:
+        """Returns the records of *paths*, which must all be cached."""
+        records = []
+        for start in range(0, len(paths), self.load_batch_size):
+            batch = paths[start:][: self.load_batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT record FROM files WHERE path IN ({placeholders})", batch
+                ).fetchall()
+            records.extend(pickle.loads(record) for (record,) in rows)
+        return records
+
+    def store(self, records: Iterable[Tuple[_FileStat, str, _FileIndex]]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        stat.path,
+                        stat.mtime_ns,
+                        stat.size,
+                        content_hash,
+                        pickle.dumps(file_index, pickle.HIGHEST_PROTOCOL),
+                    )
+                    for stat, content_hash, file_index in records
+                ),
+            )
+
+    def update_stats(self, stats: Iterable[_FileStat]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?",
+                ((stat.mtime_ns, stat.size, stat.path) for stat in stats),
+            )
+
+    def remove(self, paths: Iterable[str]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM files WHERE path = ?", ((path,) for path in paths)
+            )
+
+
+def _open_index_cache(directory: str) -> Optional[_IndexCache]:
+    """Opens the index cache in *directory*, or returns None if it is unusable.
+
+    The workspace is then indexed without a cache rather than failing to start
+    the server, e.g. when the directory is not writable or the database is
+    corrupt or locked.
+    """
+    try:
+        return _IndexCache(directory)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Indexing without the cache in %s: %s", directory, e)
+        return None
+
+
+class _WorkspaceIndex:
+    """Sections and footnotes of all reStructuredText files in a workspace.
+
+    Files are parsed in parallel by a pool of worker processes. Each worker
+    receives batches of *batch_size* files to keep the cost of transferring the
+    results between processes low. If a *cache* is given, only files that changed
+    since they were cached are parsed.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        batch_size: int = 16,
+        cache: Optional[_IndexCache] = None,
+    ):
+        self.files: Dict[str, _FileIndex] = {}
+        self._max_workers = max_workers
+        self._batch_size = batch_size
+        self._cache = cache
+
+    async def build(
+        self, root_path: str, report: Callable[[int, int], None] = lambda *_: None
+    ) -> None:
+        """Indexes all ``*.rst`` files below *root_path*.
+
+        Hidden directories are skipped. After each batch of files, *report* is
+        called with the number of indexed files and the total number of files.
+        Cached records of files below *root_path* that no longer exist are removed.
+        """
+        loop = asyncio.get_event_loop()
+        stats = await loop.run_in_executor(None, _find_rst_files, root_path)
+        cache_entries = self._cache.entries() if self._cache else {}
+        stats_to_index, cached_paths = [], []
+        for stat in stats:
+            entry = cache_entries.get(stat.path)
+            if entry and (entry.mtime_ns, entry.size) == (stat.mtime_ns, stat.size):
+                cached_paths.append(stat.path)
+                continue
+            stats_to_index.append(stat)
+        if self._cache:
+            existing_paths = {stat.path for stat in stats}
+            self._cache.remove(
+                path
+                for path in cache_entries
+                if path not in existing_paths and _is_workspace_file(path, root_path)
+            )
+            # Unpickling thousands of records would block the event loop
+            for file_index in await loop.run_in_executor(
+                None, self._cache.load, cached_paths
+            ):
+                self._add(file_index)
+        indexed_files = len(stats) - len(stats_to_index)
+        report(indexed_files, len(stats))
+        await self._index(
+            stats_to_index,
+            cache_entries,
+            lambda count: report(indexed_files + count, len(stats)),
+        )
+
+    async def update(
+        self,
+        changes: Dict[str, bool],
+        report: Callable[[int, int], None] = lambda *_: None,
+        is_superseded: Callable[[str], bool] = lambda _: False,
+    ) -> Tuple[List[_FileIndex], List[str]]:
+        """Reindexes changed files and removes deleted files from the index.
+
+        *changes* maps the paths of changed files to whether they were deleted.
+        Files that no longer exist are removed as well. The results of files for
+        which *is_superseded* returns True are dropped, because the files changed
+        again while they were being reindexed. After each batch of files, *report*
+        is called with the number of reindexed files and the total number of files.
+
+        Returns the indexes of the reindexed files and the URIs of removed files.
+        """
+        loop = asyncio.get_event_loop()
+        changed_paths = [path for path, deleted in changes.items() if not deleted]
+        stats = await loop.run_in_executor(None, _stat_files, changed_paths)
+        existing_paths = {stat.path for stat in stats}
+        removed_paths = [path for path in changes if path not in existing_paths]
+        removed_uris = []
+        for path in removed_paths:
+            uri = Path(path).as_uri()
+            if self.files.pop(uri, None) is not None:
+                removed_uris.append(uri)
+        if self._cache:
+            self._cache.remove(removed_paths)
+        report(0, len(stats))
+        cache_entries = self._cache.entries() if self._cache else {}
+        file_indexes = await self._index(
+            stats, cache_entries, lambda count: report(count, len(stats)), is_superseded
+        )
+        return file_indexes, removed_uris
+
+    async def _index(
+        self,
+        stats: List[_FileStat],
+        cache_entries: Dict[str, _CacheEntry],
+        report: Callable[[int], None],
+        is_superseded: Callable[[str], bool] = lambda _: False,
+    ) -> List[_FileIndex]:
+        """Indexes files in batches and returns their indexes.
+
+        Batches are distributed across worker processes, unless all files fit into
+        a single batch, which is not worth starting processes for.
+        """
+        loop = asyncio.get_event_loop()
+        stats_by_path = {stat.path: stat for stat in stats}
+        files_to_index = [
+            (
+                stat.path,
+                cache_entries[stat.path].content_hash
+                if stat.path in cache_entries
+                else None,
+            )
+            for stat in stats
+        ]
+        batch_starts = range(0, len(files_to_index), self._batch_size)
+        batches = [files_to_index[start:][: self._batch_size] for start in batch_starts]
+        file_indexes: List[_FileIndex] = []
+        if not batches:
+            return file_indexes
+        indexed_files = 0
+        executor_context: ContextManager[Optional[Executor]] = (
+            ProcessPoolExecutor(max_workers=self._max_workers)
+            if len(batches) > 1
+            else nullcontext()
+        )
+        with executor_context as executor:
+            pending = [
+                loop.run_in_executor(executor, _index_files, batch) for batch in batches
+            ]
+            for batch_result in asyncio.as_completed(pending):
+                results = await batch_result
+                records, unchanged_files = [], []
+                batch_indexes = []
+                for path, content_hash, file_index in results:
+                    if is_superseded(path):
+                        continue
+                    if content_hash is None:
+                        logger.warning("Skipped indexing unreadable file %s", path)
+                        continue
+                    if file_index is None:
+                        unchanged_files.append(stats_by_path[path])
+                    else:
+                        records.append((stats_by_path[path], content_hash, file_index))
+                        batch_indexes.append(file_index)
+                if self._cache:
+                    if unchanged_files:
+                        batch_indexes += await loop.run_in_executor(
+                            None,
+                            self._cache.load,
+                            [stat.path for stat in unchanged_files],
+                        )
+                    self._cache.store(records)
+                    self._cache.update_stats(unchanged_files)
+                for file_index in batch_indexes:
+                    self._add(file_index)
+                file_indexes += batch_indexes
+                indexed_files += len(results)
+                report(indexed_files)
+        return file_indexes
+
+    def _add(self, file_index: _FileIndex) -> None:
+        self.files[file_index.uri] = file_index
+
+
+class _FileChangeBatcher:
+    """Coalesces notifications about changed files into batches of reindexes.
+
+    Every notification postpones the next batch by *delay* seconds, so that the
+    many notifications of a bulk change, e.g. a checkout, end up in one batch. Only
+    the latest event of each file counts. Batches run one at a time, bookkeeping
+    happens on the event loop of the language server.
+
+    Files that change again while their batch runs are superseded. *reindex* is
+    passed a predicate that tells which files are, so that their stale results
+    can be dropped. They are reindexed by the next batch.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        delay: float,
+        reindex: Callable[[Dict[str, bool], Callable[[str], bool]], Awaitable[None]],
+    ):
+        self._loop = loop
+        self._delay = delay
+        self._reindex = reindex
+        # Whether changed files were deleted, by path
+        self._changes: Dict[str, bool] = {}
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Optional[asyncio.Future] = None
+
+    def add(self, path: str, deleted: bool) -> None:
+        """Records a change of the file at *path* and postpones the next batch."""
+        self._changes[path] = deleted
+        self._versions[path] += 1
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self._delay, self._start)
+
+    def _start(self) -> None:
+        self._timer = None
+        if self._running is not None or not self._changes:
+            return
+        changes, self._changes = self._changes, {}
+        versions = {path: self._versions[path] for path in changes}
+
+        def is_superseded(path: str) -> bool:
+            return self._versions[path] != versions[path]
+
+        self._running = asyncio.ensure_future(
+            self._reindex(changes, is_superseded), loop=self._loop
+        )
+        self._running.add_done_callback(self._finish)
+
+    def _finish(self, future: asyncio.Future) -> None:
+        self._running = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to reindex files", exc_info=future.exception())
+        # Only files that changed during the batch need to be told apart
+        self._versions = defaultdict(
+            int, {path: self._versions[path] for path in self._changes}
+        )
+        if self._timer is None:
+            self._start()
+
+
+class _Title(NamedTuple):
+    name: str
+    # Lower-case name for case-insensitive matching
+    key: str
+    uri: str
+    start: int
+    end: int
+    container_name: Optional[str]
+
+
+class _SymbolIndex:
+    """Section titles of many documents with a trigram index for fuzzy search.
+
+    Titles of a document are replaced as a whole. Replaced titles are only marked
+    as removed, and the index is compacted once most titles have been removed.
+    """
+
+    def __init__(self):
+        self._titles: List[Optional[_Title]] = []
+        self._title_ids: Dict[str, List[int]] = {}
+        self._sources: Dict[str, List[_Section]] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._removed_titles = 0
+
+    def update(self, uri: str, sections: List[_Section]) -> None:
+        """Replaces the titles of the document at *uri* with *sections*."""
+        if self._sources.get(uri) is sections:
+            return
+        self.remove(uri)
+        self._sources[uri] = sections
+        title_ids = []
+        for title in _flatten_titles(uri, sections, None):
+            title_id = len(self._titles)
+            self._titles.append(title)
+            for trigram in set(_trigrams(title.key)):
+                self._postings.setdefault(trigram, []).append(title_id)
+            title_ids.append(title_id)
+        self._title_ids[uri] = title_ids
+
+    def remove(self, uri: str) -> None:
+        self._sources.pop(uri, None)
+        for title_id in self._title_ids.pop(uri, ()):
+            self._titles[title_id] = None
+            self._removed_titles += 1
+        if self._removed_titles > len(self._titles) // 2:
+            self._compact()
+
+    def search(self, query: str, limit: int) -> List[_Title]:
+        """Returns up to *limit* titles that match *query* best.
+
+        Titles containing the query rank first, shorter titles before longer ones.
+        Queries of three or more characters also match titles that share at least
+        half of the query's trigrams, so that titles are found in spite of typos.
+        Queries with fewer characters match too many titles to rank them, and
+        return the first titles that contain the query.
+        """
+        key = query.lower()
+        query_trigrams = sorted(
+            set(_trigrams(key)),
+            key=lambda trigram: len(self._postings.get(trigram, ())),
+        )
+        if not query_trigrams:
+            return list(
+                islice(
+                    (
+                        title
+                        for title in self._titles
+                        if title is not None and key in title.key
+                    ),
+                    limit,
+                )
+            )
+        # Titles containing the query contain all of its trigrams
+        candidate_ids = set(self._postings.get(query_trigrams[0], ()))
+        for trigram in query_trigrams[1:]:
+            candidate_ids.intersection_update(self._postings.get(trigram, ()))
+        containing_titles = [
+            title
+            for title in map(self._titles.__getitem__, candidate_ids)
+            if title is not None and key in title.key
+        ]
+        matches = heapq.nsmallest(
+            limit, containing_titles, key=lambda title: len(title.key)
+        )
+        if len(matches) == limit:
+            return matches
+        shared_trigrams: Counter = Counter()
+        for trigram in query_trigrams:
+            shared_trigrams.update(self._postings.get(trigram, ()))
+        min_shared_trigrams = (len(query_trigrams) + 1) // 2
+        for title_id, shared in shared_trigrams.most_common():
+            if shared < min_shared_trigrams or len(matches) == limit:
+                break
+            title = self._titles[title_id]
+            if title is not None and key not in title.key:
+                matches.append(title)
+        return matches
+
+    def _compact(self) -> None:
+        sources = self._sources
+        self.__init__()
+        for uri, sections in sources.items():
+            self.update(uri, sections)
+
+
+def _flatten_titles(
+    uri: str, sections: Iterable[_Section], container_name: Optional[str]
+) -> Iterator[_Title]:
+    for section in sections:
+        yield _Title(
+            name=section.name,
+            key=section.name.lower(),
+            uri=uri,
+            start=section.start,
+            end=section.end,
+            container_name=container_name,
+        )
+        yield from _flatten_titles(uri, section.subsections, section.name)
+
+
+def _trigrams(text: str) -> Iterator[str]:
+    for start in range(len(text) - 2):
+        yield text[start:][:3]
+
+
+def _stat_files(paths: Iterable[str]) -> List[_FileStat]:
+    """Returns the stats of the files among *paths* that exist."""
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats.append(_FileStat(path, stat.st_mtime_ns, stat.st_size))
+    return stats
+
+
+def _is_workspace_file(path: str, root_path: str) -> bool:
+    """Returns whether the workspace index covers the file at *path*."""
+    try:
+        relative_path = Path(path).relative_to(root_path)
+    except ValueError:
+        return False
+    directories = relative_path.parts[:-1]
+    return relative_path.suffix == ".rst" and not any(
+        directory.startswith(".") for directory in directories
+    )
+
+
+def _find_rst_files(root_path: str) -> List[_FileStat]:
+    stats = []
+    for directory, subdirectories, filenames in os.walk(root_path):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))
+        for filename in sorted(filenames):
+            if not filename.endswith(".rst"):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats.append(_FileStat(path, stat.st_mtime_ns, stat.st_size))
+    return stats
+
+
+class _Histogram:
+    """Distribution of non-negative values in buckets of exponentially growing size.
+
+    Bucket *i* counts the values whose integral part has a bit length of *i*,
+    so that memory usage does not depend on the number of values.
+    """
+
+    def __init__(self):
+        self.bucket_counts: List[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        bucket = int(value).bit_length()
+        if bucket >= len(self.bucket_counts):
+            self.bucket_counts += [0] * (bucket + 1 - len(self.bucket_counts))
+        self.bucket_counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
 
-    class FootnoteVisitor(nodes.SparseNodeVisitor):
-        def visit_footnote(self, node: nodes.footnote) -> None:
-            index["footnotes"].append(node)
+    def quantile(self, q: float) -> float:
+        """Returns an upper bound of the *q* quantile of the recorded values."""
+        rank = q * self.count
+        cumulative_count = 0
+        for bucket, bucket_count in enumerate(self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(float(2**bucket), self.max)
+        return self.max
 
-        def unknown_visit(self, node: nodes.Node) -> None:
-            pass
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
 
-    @rst_language_server.feature(TEXT_DOCUMENT_DID_OPEN)
+
+class _Metrics:
+    """Histograms of handler time, parse time, index update time and payload size.
+
+    Durations are recorded in microseconds and sizes in bytes. Histograms are
+    named after the LSP method during whose handling a value was recorded,
+    e.g. "textDocument/completion/parse". Values recorded on other threads or
+    outside of handlers are attributed to "background". Nothing is recorded
+    unless the metrics are *enabled*.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms: Dict[str, _Histogram] = defaultdict(_Histogram)
+        self._lock = threading.Lock()
+        self._context = threading.local()
+
+    @contextmanager
+    def handling(self, method: str) -> Iterator[None]:
+        """Attributes the values recorded on this thread to *method*."""
+        previous_method = getattr(self._context, "method", None)
+        self._context.method = method
+        try:
+            with self.timed("handler"):
+                yield
+        finally:
+            self._context.method = previous_method
+
+    def timed(self, kind: str) -> ContextManager[None]:
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(kind)
+
+    @contextmanager
+    def _timed(self, kind: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, (time.perf_counter() - start) * 1e6)
+
+    def record(self, kind: str, value: float, method: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        method = method or getattr(self._context, "method", None) or "background"
+        with self._lock:
+            self._histograms[f"{method}/{kind}"].record(value)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: histogram.summary()
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+
+def _instrumented(metrics: _Metrics, method: str, handler: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(handler):
+
+        @wraps(handler)
+        async def instrumented_coroutine(*args, **kwargs):
+            with metrics.handling(method):
+                return await handler(*args, **kwargs)
+
+        return instrumented_coroutine
+
+    @wraps(handler)
+    def instrumented(*args, **kwargs):
+        with metrics.handling(method):
+            return handler(*args, **kwargs)
+
+    return instrumented
+
+
+class _CountingTransport:
+    """Forwards writes to a transport and counts the number of bytes written."""
+
+    def __init__(self, transport: Any):
+        self._transport = transport
+        self.bytes_written = 0
+
+    def write(self, data: Union[bytes, str]) -> None:
+        self.bytes_written += len(data)
+        self._transport.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._transport, name)
+
+
+class _SerializedResult(NamedTuple):
+    """Result of a request that the handler already serialized to JSON."""
+
+    body: str
+
+
+class _SemanticTokens(NamedTuple):
+    """Encoded semantic tokens of a parsed version of a document."""
+
+    lines: List[str]
+    blocks: List[Block]
+    result_id: str
+    data: List[int]
+
+
+class _SerializedResponse(NamedTuple):
+    """Response message that pygls writes as is instead of serializing it."""
+
+    msg_id: Any
+    result: _SerializedResult
+
+    def json(self, **kwargs) -> str:
+        return (
+            f'{{"id": {json.dumps(self.msg_id)}, '
+            f'"jsonrpc": "{LanguageServerProtocol.VERSION}", '
+            f'"result": {self.result.body}}}'
+        )
+
+
+class _Protocol(LanguageServerProtocol):
+    """Sends results that handlers serialized themselves as they are.
+
+    Handlers can return a :class:`_SerializedResult` to skip the validation and
+    serialization of response models.
+    """
+
+    def _check_ret_type_and_send_response(
+        self, method_name, method_type, msg_id, result
+    ):
+        if isinstance(result, _SerializedResult):
+            self._send_response(msg_id, result=result)
+            return
+        super()._check_ret_type_and_send_response(
+            method_name, method_type, msg_id, result
+        )
+
+    def _send_response(self, msg_id, result=None, error=None):
+        if isinstance(result, _SerializedResult):
+            self._send_data(_SerializedResponse(msg_id, result))
+        else:
+            super()._send_response(msg_id, result, error)
+
+
+class _InstrumentedProtocol(_Protocol):
+    """Records how long it takes to serialize and write responses and their size."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = _Metrics(enabled=False)
+        self._request_methods: Dict[Any, str] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        super().connection_made(_CountingTransport(transport))
+
+    def _handle_request(self, msg_id, method_name, params):
+        if self.metrics.enabled:
+            self._request_methods[msg_id] = method_name
+        super()._handle_request(msg_id, method_name, params)
+
+    def _send_response(self, msg_id, result=None, error=None):
+        method = self._request_methods.pop(msg_id, None)
+        if method is None:
+            super()._send_response(msg_id, result, error)
+            return
+        bytes_written = self.transport.bytes_written
+        start = time.perf_counter()
+        super()._send_response(msg_id, result, error)
+        elapsed = (time.perf_counter() - start) * 1e6
+        self.metrics.record("send", elapsed, method)
+        payload_size = self.transport.bytes_written - bytes_written
+        self.metrics.record("payload_bytes", payload_size, method)
+
+
+class _StackSampler:
+    """Samples the call stacks of all threads of the server at a fixed interval.
+
+    The samples are written in the collapsed stack format that flame graph tools
+    read: one line per distinct stack with semicolon-separated frames, from the
+    thread name to the innermost frame, followed by the number of samples.
+    Waiting threads are sampled as well.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.path: Optional[str] = None
+        self._stack_counts: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, path: str) -> bool:
+        """Starts sampling unless sampling is already running."""
+        if self.running:
+            return False
+        self.path = path
+        self._stack_counts.clear()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="rst-language-server-profiler", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> Optional[int]:
+        """Stops sampling, writes the samples and returns their number."""
+        if self._thread is None:
+            return None
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        with open(self.path, "w", encoding="utf-8") as profile_file:
+            for stack, count in self._stack_counts.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        return sum(self._stack_counts.values())
+
+    def _sample(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    file_name = os.path.basename(code.co_filename)
+                    frames.append(f"{code.co_name} ({file_name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(thread_names.get(thread_id, str(thread_id)))
+                self._stack_counts[";".join(reversed(frames))] += 1
+
+
+def create_server(
+    client_insert_text_interpretation: bool = True,
+    max_parse_cache_size: int = 32 * 1024 * 1024,
+    max_shared_parse_size: int = 32 * 1024 * 1024,
+    parse_delay: Optional[float] = None,
+    parse_processes: Optional[int] = None,
+    max_completion_items: int = 100,
+    index_workspace: bool = False,
+    cache_dir: Optional[str] = None,
+    watched_files_delay: float = 0.2,
+    max_workspace_symbols: int = 100,
+    diagnostics_interval: float = 0.5,
+    collect_metrics: bool = False,
+    metrics_log_interval: Optional[float] = None,
+    profile_path: Optional[str] = None,
+) -> LanguageServer:
+    """Creates a language server for reStructuredText.
+
+    Documents are parsed synchronously upon each change, unless *parse_delay* is
+    set. In that case, a document is parsed on a worker thread once there were no
+    edits for *parse_delay* seconds, and requests are answered from the latest
+    completed parse. Documents that are opened are parsed on the worker as well.
+    Documents with identical content share the result of one parse, as long as the
+    content is among the most recently parsed *max_shared_parse_size* bytes.
+
+    If *parse_processes* is set, documents are parsed in the background by that
+    many worker processes, so that several documents that changed at once, e.g.
+    after a checkout, are parsed in parallel. *parse_delay* defaults to 0 seconds
+    in that case. Documents are parsed in the order in which their delay passed,
+    except that the document of the latest request goes first.
+
+    Completion responses contain at most *max_completion_items* footnotes. Clients
+    are told that the list is incomplete when there are further candidates.
+
+    If *index_workspace* is set, all reStructuredText files in the workspace root
+    are indexed in worker processes once the client is initialized. The index is
+    kept in *cache_dir*, if specified, so that unchanged files are not parsed again
+    when the server restarts. Files that the client reports as changed on disk are
+    reindexed in batches, once no further changes were reported for
+    *watched_files_delay* seconds.
+
+    Workspace symbol responses contain at most *max_workspace_symbols* section
+    titles of open documents and, if available, of the workspace index.
+
+    Semantic tokens of section titles, directives, roles, footnote and citation
+    references and literals are encoded once per parse of a document. Delta
+    requests are answered with the part of the encoded tokens that changed, and
+    range requests only encode the blocks within the range.
+
+    Footnotes, citations, hyperlink targets and substitutions are resolved within
+    the document first. Names that the document does not define are looked up in
+    the other open documents and in the workspace index.
+
+    Warnings and errors of the parser are published as diagnostics of open
+    documents, at most once every *diagnostics_interval* seconds per document.
+
+    If *collect_metrics* is set, the server records histograms of the time spent
+    in request handlers, parsing, index updates and sending responses, as well as
+    of the response sizes. They are reported by the "rst.metrics" command and
+    logged every *metrics_log_interval* seconds, if specified.
+
+    The call stacks of the server can be sampled between the "rst.startProfiling"
+    and "rst.stopProfiling" commands. If *profile_path* is set, sampling starts
+    right away and the samples are written to *profile_path* when the process
+    exits.
+    """
+    collect_metrics = collect_metrics or metrics_log_interval is not None
+    if parse_processes and parse_delay is None:
+        parse_delay = 0.0
+    metrics = _Metrics(enabled=collect_metrics)
+    if collect_metrics:
+        rst_language_server = LanguageServer(protocol_cls=_InstrumentedProtocol)
+        rst_language_server.lsp.metrics = metrics
+    else:
+        rst_language_server = LanguageServer(protocol_cls=_Protocol)
+    parse_cache = _ParseCache(max_parse_cache_size)
+    shared_parse_cache = _SharedParseCache(max_shared_parse_size)
+    diagnostics = _DiagnosticsPublisher(rst_language_server, diagnostics_interval)
+
+    def _on_parsed(parsed_document: _ParsedDocument) -> None:
+        diagnostics.publish(parsed_document)
+        if parsed_document.uri in stale_semantic_tokens:
+            _refresh_semantic_tokens(parsed_document.uri)
+
+    background_parser = (
+        _BackgroundParser(
+            rst_language_server.loop,
+            parse_cache,
+            parse_delay,
+            _on_parsed,
+            metrics,
+            shared_parse_cache,
+            parse_processes,
+        )
+        if parse_delay is not None
+        else None
+    )
+    workspace_index = (
+        _WorkspaceIndex(cache=_open_index_cache(cache_dir) if cache_dir else None)
+        if index_workspace
+        else None
+    )
+
+    # Indexes the workspace once the client is initialized
+    workspace_index_build: Optional[asyncio.Future] = None
+
+    symbol_index = _SymbolIndex()
+
+    def feature(method: str, options: Any = None) -> Callable[[Callable], Callable]:
+        """Registers a feature handler that is instrumented if metrics are enabled."""
+        register = rst_language_server.feature(method, options)
+        if not collect_metrics:
+            return register
+        return lambda handler: register(_instrumented(metrics, method, handler))
+
+    @feature(INITIALIZED)
+    def initialized(ls: LanguageServer, params: InitializedParams):
+        nonlocal workspace_index_build
+        threading.Thread(
+            target=_import_parsing, name="import parsing", daemon=True
+        ).start()
+        if workspace_index is not None and ls.workspace.root_path:
+            workspace_index_build = asyncio.ensure_future(
+                _build_workspace_index(ls), loop=ls.loop
+            )
+            _watch_workspace_files(ls)
+        if metrics_log_interval is not None:
+            ls.loop.call_later(metrics_log_interval, _log_metrics)
+
+    def _log_metrics():
+        logger.info("Metrics: %s", json.dumps(metrics.snapshot()))
+        rst_language_server.loop.call_later(metrics_log_interval, _log_metrics)
+
+    @rst_language_server.command(METRICS_COMMAND)
+    def report_metrics(ls: LanguageServer, arguments: Any):
+        return metrics.snapshot()
+
+    profiler = _StackSampler()
+    if profile_path is not None:
+        profiler.start(profile_path)
+        atexit.register(profiler.stop)
+
+    @rst_language_server.command(START_PROFILING_COMMAND)
+    def start_profiling(ls: LanguageServer, arguments: Optional[List[Any]]):
+        if not arguments or not isinstance(arguments[0], str):
+            raise JsonRpcInvalidParams(
+                message=f"{START_PROFILING_COMMAND} expects the path of the profile"
+            )
+        return profiler.start(arguments[0])
+
+    @rst_language_server.command(STOP_PROFILING_COMMAND)
+    def stop_profiling(ls: LanguageServer, arguments: Any):
+        sample_count = profiler.stop()
+        if sample_count is None:
+            return None
+        return {"path": profiler.path, "samples": sample_count}
+
+    async def _begin_progress(ls: LanguageServer, title: str) -> Optional[str]:
+        """Creates a progress token, unless the client does not support progress."""
+        window_capabilities = ls.client_capabilities.window
+        if not (window_capabilities and window_capabilities.work_done_progress):
+            return None
+        progress_token = str(uuid.uuid4())
+        await ls.progress.create_async(progress_token)
+        ls.progress.begin(
+            progress_token, WorkDoneProgressBegin(title=title, percentage=0)
+        )
+        return progress_token
+
+    def _report_progress(
+        ls: LanguageServer, progress_token: Optional[str], done: int, total: int
+    ):
+        if progress_token is None:
+            return
+        ls.progress.report(
+            progress_token,
+            WorkDoneProgressReport(
+                message=f"{done}/{total} files",
+                percentage=done * 100 // max(total, 1),
+            ),
+        )
+
+    def _end_progress(ls: LanguageServer, progress_token: Optional[str], message: str):
+        if progress_token is not None:
+            ls.progress.end(progress_token, WorkDoneProgressEnd(message=message))
+
+    async def _build_workspace_index(ls: LanguageServer):
+        progress_token = await _begin_progress(ls, "Indexing workspace")
+        try:
+            build_start = time.perf_counter()
+            await workspace_index.build(
+                ls.workspace.root_path, partial(_report_progress, ls, progress_token)
+            )
+            with metrics.timed("index"):
+                for uri, file_index in workspace_index.files.items():
+                    # Open documents may differ from the files on disk
+                    if uri not in document_lines:
+                        symbol_index.update(uri, file_index.sections)
+            metrics.record(
+                "index", (time.perf_counter() - build_start) * 1e6, "workspace"
+            )
+        except Exception:
+            logger.exception("Failed to index workspace %s", ls.workspace.root_path)
+        finally:
+            _end_progress(
+                ls, progress_token, f"Indexed {len(workspace_index.files)} files"
+            )
+
+    def _watch_workspace_files(ls: LanguageServer):
+        """Asks the client to report changes of files on disk, if it supports that."""
+        workspace_capabilities = ls.client_capabilities.workspace
+        watched_files_capabilities = (
+            workspace_capabilities.did_change_watched_files
+            if workspace_capabilities
+            else None
+        )
+        if not (
+            watched_files_capabilities
+            and watched_files_capabilities.dynamic_registration
+        ):
+            return
+        ls.register_capability(
+            RegistrationParams(
+                registrations=[
+                    Registration(
+                        id=str(uuid.uuid4()),
+                        method=WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                        register_options=DidChangeWatchedFilesRegistrationOptions(
+                            watchers=[FileSystemWatcher(glob_pattern="**/*.rst")]
+                        ),
+                    )
+                ]
+            )
+        )
+
+    async def _reindex_files(
+        changes: Dict[str, bool], is_superseded: Callable[[str], bool]
+    ):
+        ls = rst_language_server
+        if workspace_index_build is not None:
+            # Results of the initial build would overwrite newer ones otherwise
+            await workspace_index_build
+        progress_token = await _begin_progress(ls, "Reindexing changed files")
+        file_indexes: List[_FileIndex] = []
+        try:
+            reindex_start = time.perf_counter()
+            file_indexes, removed_uris = await workspace_index.update(
+                changes, partial(_report_progress, ls, progress_token), is_superseded
+            )
+            with metrics.timed("index"):
+                for file_index in file_indexes:
+                    # Open documents may differ from the files on disk
+                    if file_index.uri not in document_lines:
+                        symbol_index.update(file_index.uri, file_index.sections)
+                for uri in removed_uris:
+                    if uri not in document_lines:
+                        symbol_index.remove(uri)
+            metrics.record(
+                "index",
+                (time.perf_counter() - reindex_start) * 1e6,
+                WORKSPACE_DID_CHANGE_WATCHED_FILES,
+            )
+        except Exception:
+            logger.exception("Failed to reindex %d changed files", len(changes))
+        finally:
+            _end_progress(ls, progress_token, f"Reindexed {len(file_indexes)} files")
+
+    file_change_batcher = _FileChangeBatcher(
+        rst_language_server.loop, watched_files_delay, _reindex_files
+    )
+
+    @feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
+    def did_change_watched_files(
+        ls: LanguageServer, params: DidChangeWatchedFilesParams
+    ):
+        root_path = ls.workspace.root_path
+        if workspace_index is None or not root_path:
+            return
+        for change in params.changes:
+            path = to_fs_path(change.uri)
+            if _is_workspace_file(path, root_path):
+                file_change_batcher.add(path, change.type == FileChangeType.Deleted)
+
+    # Current lines of all open documents
+    document_lines: Dict[str, _DocumentLines] = {}
+
+    def _document_lines(uri: str) -> _DocumentLines:
+        lines = document_lines.get(uri)
+        if lines is None:
+            document = rst_language_server.workspace.get_document(uri)
+            lines = _DocumentLines(document.version, document.source)
+            document_lines[uri] = lines
+        return lines
+
+    def _parsed_document(uri: str) -> _ParsedDocument:
+        lines = _document_lines(uri)
+        if background_parser:
+            entry = parse_cache.latest(uri)
+        else:
+            entry = parse_cache.get(uri, lines.version)
+        if entry is None:
+            with metrics.timed("parse"):
+                entry = shared_parse_cache.parse(uri, lines.version, lines.lines)
+            parse_cache.put(entry)
+        return entry
+
+    def _focus(uri: str) -> None:
+        """Parses the document that the user works on before other documents."""
+        if background_parser:
+            background_parser.focus(uri)
+
+    @feature(TEXT_DOCUMENT_DID_OPEN)
     def did_open(ls: LanguageServer, params: DidOpenTextDocumentParams):
-        file_content = params.text_document.text
-        rst = parse_rst(file_content)
-        rst.walk(FootnoteVisitor(rst))
+        uri = params.text_document.uri
+        _focus(uri)
+        lines = _DocumentLines(params.text_document.version, params.text_document.text)
+        document_lines[uri] = lines
+        if background_parser:
+            background_parser.schedule(uri, None, lines.version, lines.lines, 0, 0)
+        else:
+            diagnostics.publish(_parsed_document(uri))
 
-    @rst_language_server.feature(TEXT_DOCUMENT_DID_CHANGE)
+    @feature(TEXT_DOCUMENT_DID_CHANGE)
     def did_change(ls: LanguageServer, params: DidChangeTextDocumentParams):
-        doc_id = params.text_document.uri
-        new_doc = ls.workspace.get_document(doc_id)
-        # Rebuild footnotes index
-        index["footnotes"].clear()
-        rst = parse_rst(new_doc.source)
-        rst.walk(FootnoteVisitor(rst))
-
-    @rst_language_server.feature(COMPLETION)
+        uri = params.text_document.uri
+        lines = document_lines.get(uri)
+        if lines is None:
+            _parsed_document(uri)
+            return
+        base_version = lines.version
+        first_changed_line, unchanged_suffix = lines.apply(
+            params.text_document.version, params.content_changes
+        )
+        if background_parser:
+            background_parser.schedule(
+                uri,
+                base_version,
+                lines.version,
+                lines.lines,
+                first_changed_line,
+                unchanged_suffix,
+            )
+            return
+        previous = parse_cache.latest(uri)
+        if previous is None or previous.version != base_version:
+            diagnostics.publish(_parsed_document(uri))
+            return
+        with metrics.timed("parse"):
+            entry = _reparse_changed_lines(
+                previous,
+                len(previous.lines),
+                lines.version,
+                lines.lines,
+                first_changed_line,
+                unchanged_suffix,
+            )
+        parse_cache.put(entry)
+        diagnostics.publish(entry)
+
+    @feature(TEXT_DOCUMENT_DID_CLOSE)
+    def did_close(ls: LanguageServer, params: DidCloseTextDocumentParams):
+        uri = params.text_document.uri
+        document_lines.pop(uri, None)
+        if background_parser:
+            background_parser.forget(uri)
+        parse_cache.evict(uri)
+        symbol_responses.pop(uri, None)
+        semantic_tokens.pop(uri, None)
+        stale_semantic_tokens.discard(uri)
+        diagnostics.clear(uri)
+        file_index = workspace_index.files.get(uri) if workspace_index else None
+        if file_index is None:
+            symbol_index.remove(uri)
+        else:
+            symbol_index.update(uri, file_index.sections)
+
+    @feature(COMPLETION)
     def completion(params: CompletionParams):
+        _focus(params.text_document.uri)
         completion_items = []
-        completion_items += list(_complete_footnote_references(params))
+        footnote_items, is_incomplete = _complete_footnote_references(params)
+        completion_items += footnote_items
         completion_items += list(_complete_headings(params))
         return CompletionList(
-            is_incomplete=False,
+            is_incomplete=is_incomplete,
             items=completion_items,
         )
 
     def _complete_footnote_references(
         params: CompletionParams,
-    ) -> Iterable[CompletionItem]:
-        completions = []
-        for fn in index["footnotes"]:
-            label = fn["names"][0]
-            if "auto" in fn:
-                label = "#" + label
-            paragraphs = [
-                child for child in fn.children if child.tagname == "paragraph"
-            ]
-            completion_detail = paragraphs[0].astext() if paragraphs else None
-            completion = CompletionItem(
-                label=label, insert_text=f"{label}]_", detail=completion_detail
-            )
-            completions.append(completion)
-        return completions
+    ) -> Tuple[List[CompletionItem], bool]:
+        current_line = _document_lines(params.text_document.uri)[params.position.line]
+        prefix = _footnote_label_prefix(current_line[: params.position.character])
+        parsed_document = _parsed_document(params.text_document.uri)
+        footnotes, is_incomplete = parsed_document.footnote_labels.complete(
+            prefix, max_completion_items
+        )
+        completions = [
+            CompletionItem(label=label, insert_text=f"{label}]_", detail=fn.detail)
+            for label, fn in footnotes
+        ]
+        return completions, is_incomplete
 
     def _complete_headings(params: CompletionParams) -> Iterable[CompletionItem]:
         current_line_index = params.position.line
@@ -103,20 +2134,18 @@ def create_server(client_insert_text_interpretation: bool = True) -> LanguageSer
         current_line_length = params.position.character
         if current_line_length == 0 or previous_line_index < 0:
             return ()
-        document_uri = params.text_document.uri
-        doc = rst_language_server.workspace.get_document(document_uri)
-        document_content: str = doc.source
-        if not document_content:
+        lines = _document_lines(params.text_document.uri)
+        current_line = lines[current_line_index]
+        if not current_line:
             return ()
-        lines = document_content.splitlines()
-        adornment_char = lines[current_line_index][-1]
-        if not adornment_char or adornment_char not in string.punctuation:
+        adornment_char = current_line[-1]
+        if adornment_char not in string.punctuation:
             return ()
-        consists_of_one_char = (
-            lines[current_line_index] == len(lines[current_line_index]) * adornment_char
-        )
+        consists_of_one_char = current_line == len(current_line) * adornment_char
         if not consists_of_one_char:
             return ()
+        from docutils.utils import column_width
+
         title_width = column_width(lines[previous_line_index])
         if current_line_length >= title_width:
             return ()
@@ -131,80 +2160,845 @@ def create_server(client_insert_text_interpretation: bool = True) -> LanguageSer
             ),
         )
 
-    @rst_language_server.feature(DOCUMENT_SYMBOL)
+    # Serialized document symbols along with the lines and sections they describe
+    symbol_responses: Dict[
+        str, Tuple[List[str], List[_Section], _SerializedResult]
+    ] = {}
+
+    @feature(DOCUMENT_SYMBOL)
     def symbols(ls: LanguageServer, params: DocumentSymbolParams):
-        doc_id = params.text_document.uri
-        index["sections"][doc_id] = []
-        document = ls.workspace.get_document(doc_id)
-        rst = parse_rst(document.source)
-
-        class SymbolVisitor(nodes.SparseNodeVisitor):
-            def __init__(self, doc: nodes.document):
-                super().__init__(doc)
-                self.section_stack = []
-
-            def visit_section(self, node: nodes.section) -> None:
-                section_title = node[0]
-                section_start = node.line - 2
-                top_level_sections = index["sections"][doc_id]
-                s = _Section(
-                    name=section_title.astext(),
-                    start=section_start,
-                    end=-1,
+        uri = params.text_document.uri
+        _focus(uri)
+        lines, sections = _document_sections(uri)
+        # Every version of a document has its own lines and sections, so the
+        # response is still valid if both are the same objects
+        cached = symbol_responses.get(uri)
+        if cached is not None and cached[0] is lines and cached[1] is sections:
+            return cached[2]
+        with metrics.timed("serialize"):
+            response = _SerializedResult(_serialize_symbols(lines, sections))
+        symbol_responses[uri] = (lines, sections, response)
+        return response
+
+    # Semantic tokens that were last encoded for each document, which delta
+    # requests refer to by their result ID
+    semantic_tokens: Dict[str, _SemanticTokens] = {}
+    # Documents whose semantic tokens were answered from an outdated parse
+    stale_semantic_tokens: Set[str] = set()
+
+    @feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL, _SEMANTIC_TOKENS_LEGEND)
+    def full_semantic_tokens(ls: LanguageServer, params: SemanticTokensParams):
+        uri = params.text_document.uri
+        _focus(uri)
+        tokens = _semantic_tokens(uri)
+        with metrics.timed("serialize"):
+            return _SerializedResult(
+                json.dumps({"resultId": tokens.result_id, "data": tokens.data})
+            )
+
+    @feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA, _SEMANTIC_TOKENS_LEGEND)
+    def semantic_token_edits(ls: LanguageServer, params: SemanticTokensDeltaParams):
+        uri = params.text_document.uri
+        _focus(uri)
+        previous = semantic_tokens.get(uri)
+        tokens = _semantic_tokens(uri)
+        if previous is None or previous.result_id != params.previous_result_id:
+            # The client refers to tokens that are no longer known
+            with metrics.timed("serialize"):
+                return _SerializedResult(
+                    json.dumps({"resultId": tokens.result_id, "data": tokens.data})
                 )
-                if top_level_sections:
-                    # End all sections at the same or deeper level
-                    top_level_sections[-1].end_at(section_start - 1)
-                # If there is a section at a higher level, add this section as a subsection
-                if self.section_stack:
-                    self.section_stack[-1].subsections.append(s)
-                else:
-                    # Add a new top-level section
-                    index["sections"][doc_id].append(s)
-                self.section_stack.append(s)
+        with metrics.timed("serialize"):
+            edits = _token_edits(previous.data, tokens.data)
+            return _SerializedResult(
+                json.dumps({"resultId": tokens.result_id, "edits": edits})
+            )
+
+    @feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE, _SEMANTIC_TOKENS_LEGEND)
+    def semantic_tokens_in_range(ls: LanguageServer, params: SemanticTokensRangeParams):
+        uri = params.text_document.uri
+        # Editors request the tokens of the visible lines before those of the
+        # whole document, so only the blocks in the range are encoded
+        _focus(uri)
+        parsed_document = _token_source(uri)
+        with metrics.timed("serialize"):
+            data = _encode_tokens(
+                parsed_document.blocks,
+                parsed_document.block_starts,
+                params.range.start.line,
+                params.range.end.line + 1,
+            )
+            return _SerializedResult(json.dumps({"data": data}))
+
+    def _semantic_tokens(uri: str) -> _SemanticTokens:
+        """Returns the semantic tokens of a document, which are encoded once per parse."""
+        parsed_document = _token_source(uri)
+        cached = semantic_tokens.get(uri)
+        if (
+            cached is not None
+            and cached.lines is parsed_document.lines
+            and cached.blocks is parsed_document.blocks
+        ):
+            return cached
+        tokens = _SemanticTokens(
+            parsed_document.lines,
+            parsed_document.blocks,
+            str(uuid.uuid4()),
+            _encode_tokens(parsed_document.blocks, parsed_document.block_starts),
+        )
+        semantic_tokens[uri] = tokens
+        return tokens
+
+    def _token_source(uri: str) -> _ParsedDocument:
+        """Returns the latest parse of a document and notes if it is outdated.
+
+        The client is asked to request the tokens again once the background parser
+        has parsed the current version.
+        """
+        parsed_document = _parsed_document(uri)
+        if parsed_document.version != _document_lines(uri).version:
+            stale_semantic_tokens.add(uri)
+        return parsed_document
+
+    def _refresh_semantic_tokens(uri: str) -> None:
+        stale_semantic_tokens.discard(uri)
+        workspace_capabilities = rst_language_server.client_capabilities.workspace
+        semantic_tokens_capabilities = (
+            workspace_capabilities.semantic_tokens if workspace_capabilities else None
+        )
+        if (
+            semantic_tokens_capabilities
+            and semantic_tokens_capabilities.refresh_support
+        ):
+            rst_language_server.semantic_tokens_refresh()
+
+    def _document_sections(uri: str) -> Tuple[List[str], List[_Section]]:
+        """Returns the sections of a document along with the lines they refer to.
+
+        Until the background parser has parsed a document, the section titles are
+        determined by a scanner, unless the document is too intricate to scan.
+        """
+        if background_parser and parse_cache.latest(uri) is None:
+            from rst_language_server import parsing
+
+            lines = _document_lines(uri).lines
+            headings = parsing.scan_headings(lines)
+            if headings is not None:
+                return lines, _build_sections(headings, len(lines))
+        parsed_document = _parsed_document(uri)
+        return parsed_document.lines, parsed_document.sections
+
+    @feature(WORKSPACE_SYMBOL)
+    def workspace_symbols(ls: LanguageServer, params: WorkspaceSymbolParams):
+        # Titles of documents that did not change since the last request are kept
+        for uri in document_lines:
+            _, sections = _document_sections(uri)
+            with metrics.timed("index"):
+                symbol_index.update(uri, sections)
+        return [
+            SymbolInformation(
+                name=title.name,
+                kind=SymbolKind.Class,
+                location=Location(
+                    uri=title.uri,
+                    range=Range(
+                        start=Position(line=title.start, character=0),
+                        end=Position(line=title.end + 1, character=0),
+                    ),
+                ),
+                container_name=title.container_name,
+            )
+            for title in symbol_index.search(params.query, max_workspace_symbols)
+        ]
+
+    @feature(DEFINITION)
+    def definition(
+        ls: LanguageServer, params: DefinitionParams
+    ) -> Optional[List[Location]]:
+        _focus(params.text_document.uri)
+        occurrence = _occurrence_at(params.text_document.uri, params.position)
+        if occurrence is None:
+            return None
+        for uri, names in _name_indexes(params.text_document.uri):
+            definitions = names.definitions(occurrence.kind, occurrence.name)
+            if definitions:
+                return [_to_location(uri, d) for d in definitions]
+        return []
+
+    @feature(REFERENCES)
+    def references(
+        ls: LanguageServer, params: ReferenceParams
+    ) -> Optional[List[Location]]:
+        _focus(params.text_document.uri)
+        occurrence = _occurrence_at(params.text_document.uri, params.position)
+        if occurrence is None:
+            return None
+        kind, name = occurrence.kind, occurrence.name
+        name_indexes = list(_name_indexes(params.text_document.uri))
+        # Resolve the name like definition requests, so that the result does not
+        # depend on the document that the request starts from
+        defining_uri = next(
+            (uri for uri, names in name_indexes if names.definitions(kind, name)),
+            None,
+        )
+        locations = []
+        for uri, names in name_indexes:
+            definitions = names.definitions(kind, name)
+            # Other documents resolve the name to their own definition
+            if definitions and uri != defining_uri:
+                continue
+            if params.context.include_declaration:
+                locations += [_to_location(uri, d) for d in definitions]
+            locations += [_to_location(uri, r) for r in names.references(kind, name)]
+        return locations
 
-            def depart_section(self, node: nodes.section) -> None:
-                self.section_stack.pop()
+    def _occurrence_at(uri: str, position: Position) -> Optional[Occurrence]:
+        # Occurrences record UTF-16 positions, like the client sends them
+        return _parsed_document(uri).names.at(position.line, position.character)
 
-            def unknown_visit(self, node: nodes.Node) -> None:
-                pass
+    def _name_indexes(uri: str) -> Iterator[Tuple[str, _NameIndex]]:
+        """Yields the names of a document, followed by the names of other documents.
 
-        rst.walkabout(SymbolVisitor(rst))
-        if index["sections"][doc_id]:
-            index["sections"][doc_id][-1].end_at(len(document.lines) - 1)
-        symbols = []
-        for s in index["sections"][doc_id]:
-            symbol = _to_symbol(document.lines, s)
-            symbols.append(symbol)
-        return symbols
+        Open documents are taken from their latest parse and all other files from
+        the workspace index, if available.
+        """
+        yield uri, _parsed_document(uri).names
+        for other_uri in list(document_lines):
+            if other_uri != uri:
+                yield other_uri, _parsed_document(other_uri).names
+        if workspace_index is not None:
+            for other_uri, file_index in workspace_index.files.items():
+                if other_uri != uri and other_uri not in document_lines:
+                    yield other_uri, file_index.names
 
     return rst_language_server
 
 
-def _to_symbol(lines: List[str], s: _Section) -> DocumentSymbol:
-    name, start, end = s.name, s.start, s.end
-    last_line_length = len(lines[end])
-    section_range = Range(
-        start=Position(line=start, character=0),
-        end=Position(line=end, character=last_line_length - 1),
-    )
-    symbol = DocumentSymbol(
-        name=name,
-        kind=SymbolKind.Class,
-        range=section_range,
-        selection_range=section_range,
-        children=[_to_symbol(lines, subsection) for subsection in s.subsections],
-    )
-    return symbol
-
-
-def parse_rst(text: str) -> nodes.document:
-    rst_parser = Parser()
-    components = (Parser,)
-    default_settings = dict(report_level=3)  # Report errors and worse
-    settings = OptionParser(
-        components=components, defaults=default_settings
-    ).get_default_values()
-    document = new_document("rst document", settings=settings)
-    rst_parser.parse(text, document)
-    return document
+def _parse_blocks(lines: Sequence[str], starts: List[int], end: int) -> List[Block]:
+    from rst_language_server import parsing
+
+    return [
+        parsing.parse_block(lines[block_start:block_end])
+        for block_start, block_end in zip(starts, starts[1:] + [end])
+    ]
+
+
+def _parse_document(uri: str, version: Optional[int], source: str) -> _ParsedDocument:
+    return _parse_lines(uri, version, source.splitlines(True))
+
+
+def _parse_lines(uri: str, version: Optional[int], lines: List[str]) -> _ParsedDocument:
+    block_starts, _ = find_block_starts(lines, 0, len(lines))
+    blocks = _parse_blocks(lines, block_starts, len(lines))
+    return _ParsedDocument(
+        uri=uri,
+        version=version,
+        lines=lines,
+        blocks=blocks,
+        block_starts=block_starts,
+    )
+
+
+def _apply_content_changes(
+    lines: List[str],
+    changes: Iterable[
+        Union[TextDocumentContentChangeEvent, TextDocumentContentChangeTextEvent]
+    ],
+) -> Tuple[List[str], int, int]:
+    """Applies LSP content changes to a copy of the specified lines.
+
+    Returns the changed lines, the index of the first changed line, and the number
+    of lines at the end of the document that remained unchanged.
+    """
+    lines = list(lines)
+    first_changed_line = len(lines)
+    unchanged_suffix = len(lines)
+    for change in changes:
+        change_range = getattr(change, "range", None)
+        if change_range is None:
+            new_lines = change.text.splitlines(True)
+            common_prefix = _common_prefix_length(lines, new_lines)
+            common_suffix = _common_prefix_length(
+                reversed(lines[common_prefix:]), reversed(new_lines[common_prefix:])
+            )
+            lines = new_lines
+            first_changed_line = min(first_changed_line, common_prefix)
+            unchanged_suffix = min(unchanged_suffix, common_suffix)
+            continue
+        change_range = range_from_utf16(lines, change_range)
+        start_line, start_character = _clamp_position(lines, change_range.start)
+        end_line, end_character = _clamp_position(lines, change_range.end)
+        prefix = lines[start_line][:start_character] if lines else ""
+        suffix = lines[end_line][end_character:] if lines else ""
+        replacement = (prefix + change.text + suffix).splitlines(True)
+        after_end_line = end_line + 1
+        lines[start_line:after_end_line] = replacement
+        first_changed_line = min(first_changed_line, start_line)
+        unchanged_suffix = min(
+            unchanged_suffix, len(lines) - start_line - len(replacement)
+        )
+    return lines, first_changed_line, unchanged_suffix
+
+
+def _clamp_position(lines: Sequence[str], position: Position) -> Tuple[int, int]:
+    """Moves positions past the last line to the end of the last line."""
+    if position.line >= len(lines):
+        return max(len(lines) - 1, 0), len(lines[-1]) if lines else 0
+    return position.line, position.character
+
+
+def _common_prefix_length(a: Iterable[str], b: Iterable[str]) -> int:
+    length = 0
+    for a_item, b_item in zip(a, b):
+        if a_item != b_item:
+            break
+        length += 1
+    return length
+
+
+def _reparse_changed_lines(
+    previous: _ParsedDocument,
+    previous_line_count: int,
+    version: Optional[int],
+    lines: List[str],
+    first_changed_line: int,
+    unchanged_suffix: int,
+) -> _ParsedDocument:
+    """Reparses the blocks affected by a change and reuses all other blocks.
+
+    The blocks that contain the first and the last changed line are reparsed along
+    with their neighbours, because a change can merge or split blocks. If the
+    section tree of the previous document was built and the change left all
+    titles intact, the tree is carried over with updated line ranges. The lines of
+    *previous* are not used, so callers may leave them out and pass their count.
+    """
+    blocks, block_starts = previous.blocks, previous.block_starts
+    line_count_change = len(lines) - previous_line_count
+    last_changed_line = max(
+        previous_line_count - unchanged_suffix - 1, first_changed_line
+    )
+    first_block = max(bisect_right(block_starts, first_changed_line) - 2, 0)
+    last_block = min(bisect_right(block_starts, last_changed_line), len(blocks) - 1)
+    region_start = block_starts[first_block] if blocks else 0
+    while True:
+        region_end = (
+            block_starts[last_block + 1]
+            if last_block + 1 < len(blocks)
+            else previous_line_count
+        ) + line_count_change
+        new_block_starts, ends_in_table = find_block_starts(
+            lines, region_start, region_end
+        )
+        if not ends_in_table or last_block + 1 >= len(blocks):
+            break
+        last_block += 1
+    new_blocks = _parse_blocks(lines, new_block_starts, region_end)
+    first_unchanged_block = last_block + 1
+    sections = None
+    if previous._sections is not None:
+        old_headings = _absolute_headings(
+            blocks[first_block:first_unchanged_block],
+            block_starts[first_block:first_unchanged_block],
+        )
+        new_headings = _absolute_headings(new_blocks, new_block_starts)
+        if [(h.name, h.style) for h in old_headings] == [
+            (h.name, h.style) for h in new_headings
+        ]:
+            sections = _shift_sections(
+                previous._sections,
+                _LineShift(
+                    region_start=region_start,
+                    old_region_end=region_end - line_count_change,
+                    line_count_change=line_count_change,
+                    region_heading_lines={
+                        old.line: new.line
+                        for old, new in zip(old_headings, new_headings)
+                    },
+                ),
+                old_last_line=previous_line_count - 1,
+                new_last_line=len(lines) - 1,
+            )
+    footnote_labels = None
+    if previous._footnote_labels is not None and list(
+        chain.from_iterable(
+            block.footnotes for block in blocks[first_block:first_unchanged_block]
+        )
+    ) == list(chain.from_iterable(block.footnotes for block in new_blocks)):
+        # Footnote records have no positions, so the index stays the same
+        footnote_labels = previous._footnote_labels
+    document_messages = None
+    if previous._document_messages is not None:
+        document_messages = _shift_document_messages(
+            previous._document_messages,
+            (
+                block_starts[first_block:first_unchanged_block],
+                region_end - line_count_change,
+            ),
+            blocks[first_block:first_unchanged_block],
+            new_blocks,
+            new_block_starts,
+            line_count_change,
+        )
+    blocks = blocks[:first_block] + new_blocks + blocks[first_unchanged_block:]
+    block_starts = (
+        block_starts[:first_block]
+        + new_block_starts
+        + [start + line_count_change for start in block_starts[first_unchanged_block:]]
+    )
+    return _ParsedDocument(
+        uri=previous.uri,
+        version=version,
+        lines=lines,
+        blocks=blocks,
+        block_starts=block_starts,
+        _sections=sections,
+        _footnote_labels=footnote_labels,
+        _document_messages=document_messages,
+    )
+
+
+def _block_messages(
+    blocks: Sequence[Block], block_starts: Sequence[int]
+) -> List[SystemMessage]:
+    return [
+        message._replace(line=block_start + message.line)
+        for block, block_start in zip(blocks, block_starts)
+        for message in block.messages
+    ]
+
+
+def _document_messages(
+    blocks: Sequence[Block], block_starts: Sequence[int]
+) -> List[SystemMessage]:
+    """Returns the messages about names and titles across blocks."""
+    messages = _duplicate_definition_messages(blocks, block_starts)
+    messages += [
+        # Reported on the underline, like docutils does
+        SystemMessage(
+            line=heading.line + len(heading.style),
+            level=SEVERE_LEVEL,
+            message="Title level inconsistent:",
+        )
+        for heading, level in _heading_levels(_absolute_headings(blocks, block_starts))
+        if level is None
+    ]
+    return messages
+
+
+def _names_and_titles(
+    blocks: Sequence[Block], block_starts: Sequence[int]
+) -> Tuple[List[Tuple[Any, ...]], List[int]]:
+    """Returns what the messages about the document as a whole depend on.
+
+    These are the names and title styles of each block that has any. The second
+    return value holds the lines of the definitions and title underlines, which
+    the messages refer to, in the same order.
+    """
+    keys: List[Tuple[Any, ...]] = []
+    lines: List[int] = []
+    for block, block_start in zip(blocks, block_starts):
+        if block.definitions or block.headings:
+            keys.append(
+                (
+                    tuple((d.kind, d.name, d.uri) for d in block.definitions),
+                    tuple(heading.style for heading in block.headings),
+                )
+            )
+            lines += (block_start + d.line for d in block.definitions)
+            lines += (block_start + h.line + len(h.style) for h in block.headings)
+    return keys, lines
+
+
+def _shift_document_messages(
+    messages: List[SystemMessage],
+    old_region: Tuple[List[int], int],
+    old_blocks: Sequence[Block],
+    new_blocks: Sequence[Block],
+    new_block_starts: Sequence[int],
+    line_count_change: int,
+) -> Optional[List[SystemMessage]]:
+    """Carries the messages about the document as a whole over to a reparse.
+
+    *old_region* holds the starts of the replaced blocks and the end of their
+    lines. If the new blocks have the same names and title styles as the replaced
+    blocks, the messages are the same apart from their lines. Otherwise None is
+    returned.
+    """
+    old_block_starts, old_region_end = old_region
+    old_keys, old_lines = _names_and_titles(old_blocks, old_block_starts)
+    new_keys, new_lines = _names_and_titles(new_blocks, new_block_starts)
+    if old_keys != new_keys:
+        return None
+    region_start = old_block_starts[0] if old_block_starts else old_region_end
+    region_lines = dict(zip(old_lines, new_lines))
+    shifted = []
+    for message in messages:
+        if message.line < region_start:
+            shifted.append(message)
+        elif message.line >= old_region_end:
+            shifted.append(message._replace(line=message.line + line_count_change))
+        elif message.line in region_lines:
+            shifted.append(message._replace(line=region_lines[message.line]))
+        else:
+            return None
+    return shifted
+
+
+def _absolute_headings(
+    blocks: Sequence[Block], block_starts: Sequence[int]
+) -> List[Heading]:
+    return [
+        Heading(name=heading.name, line=block_start + heading.line, style=heading.style)
+        for block, block_start in zip(blocks, block_starts)
+        for heading in block.headings
+    ]
+
+
+def _name_index(
+    lines: Sequence[str],
+    headings: Iterable[Heading],
+    blocks: Sequence[Block],
+    block_starts: Sequence[int],
+) -> _NameIndex:
+    """Indexes the names of the specified blocks and the implicit section targets.
+
+    Headings have absolute line numbers, whereas the occurrences of each block are
+    relative to the start of the block.
+    """
+    definitions = [_title_target(lines, heading) for heading in headings]
+    references = []
+    for block, block_start in zip(blocks, block_starts):
+        definitions += _shift_occurrences(block.definitions, block_start)
+        references += _shift_occurrences(block.references, block_start)
+    return _NameIndex(definitions, references)
+
+
+def _shift_occurrences(
+    occurrences: Iterable[Occurrence], line_offset: int
+) -> Iterator[Occurrence]:
+    for occurrence in occurrences:
+        yield occurrence._replace(line=occurrence.line + line_offset)
+
+
+def _title_target(lines: Sequence[str], heading: Heading) -> Occurrence:
+    """Returns the implicit hyperlink target of a section title."""
+    from docutils.nodes import fully_normalize_name
+
+    title_line = heading.line + 1 if len(heading.style) == 2 else heading.line
+    title = lines[title_line].rstrip()
+    return Occurrence(
+        kind="target",
+        name=fully_normalize_name(heading.name),
+        line=title_line,
+        start=len(title) - len(title.lstrip()),
+        end=utf16_column(title, len(title)),
+    )
+
+
+@dataclass
+class _LineShift:
+    """Maps title lines before a change to title lines after the change.
+
+    Only the region of reparsed lines may contain titles that moved by an amount
+    other than the change in the number of lines.
+    """
+
+    region_start: int
+    old_region_end: int
+    line_count_change: int
+    region_heading_lines: Dict[int, int]
+
+    def __call__(self, line: int) -> int:
+        if line < self.region_start:
+            return line
+        if line >= self.old_region_end:
+            return line + self.line_count_change
+        return self.region_heading_lines[line]
+
+
+def _shift_sections(
+    sections: Sequence[_Section],
+    shift: _LineShift,
+    old_last_line: int,
+    new_last_line: int,
+) -> List[_Section]:
+    """Returns a copy of the section tree with line ranges moved by *shift*.
+
+    Sections that end before the reparsed region are reused as they are.
+    """
+    shifted = []
+    for section in sections:
+        if section.end + 1 < shift.region_start:
+            shifted.append(section)
+            continue
+        # Sections end right before the next title or at the end of the document
+        end = (
+            new_last_line
+            if section.end == old_last_line
+            else shift(section.end + 1) - 1
+        )
+        shifted.append(
+            _Section(
+                name=section.name,
+                start=shift(section.start),
+                end=end,
+                subsections=_shift_sections(
+                    section.subsections, shift, old_last_line, new_last_line
+                ),
+            )
+        )
+    return shifted
+
+
+def _heading_levels(
+    headings: Iterable[Heading],
+) -> Iterator[Tuple[Heading, Optional[int]]]:
+    """Yields headings along with the level of their section, counted from 0.
+
+    Like docutils, the level is determined by the order in which the title styles
+    appear in the document. Titles that would skip a level, or that introduce a new
+    style below the deepest level, are inconsistent and yielded with None. docutils
+    does not start sections for them.
+    """
+    styles: List[str] = []
+    # Number of levels up to and including the current section
+    depth = 0
+    for heading in headings:
+        if heading.style in styles:
+            level = styles.index(heading.style)
+            if level > depth:
+                yield heading, None
+                continue
+        elif len(styles) == depth:
+            level = len(styles)
+            styles.append(heading.style)
+        else:
+            yield heading, None
+            continue
+        depth = level + 1
+        yield heading, level
+
+
+# Kinds of names that share the namespace of explicit targets in docutils
+_explicit_target_kinds = frozenset(["footnote", "citation", "target"])
+
+
+def _duplicate_definition_messages(
+    blocks: Sequence[Block], block_starts: Sequence[int]
+) -> List[SystemMessage]:
+    """Reports names that are defined in several blocks, like docutils does.
+
+    Hyperlink targets may be repeated with the URI of the first target. Duplicates
+    within a block were reported when the block was parsed.
+    """
+    definitions: Dict[Tuple[str, str], List[Tuple[int, Occurrence]]] = defaultdict(list)
+    for block_index, (block, block_start) in enumerate(zip(blocks, block_starts)):
+        for definition in block.definitions:
+            namespace = (
+                "target"
+                if definition.kind in _explicit_target_kinds
+                else "substitution"
+            )
+            definitions[namespace, definition.name].append(
+                (block_index, definition._replace(line=block_start + definition.line))
+            )
+    messages = []
+    for (namespace, name), occurrences in definitions.items():
+        first_uri = occurrences[0][1].uri
+        block_indexes = {occurrences[0][0]}
+        # Whether a duplicate made docutils forget the first target
+        first_target_dropped = False
+        for block_index, occurrence in occurrences[1:]:
+            reported = block_index in block_indexes
+            block_indexes.add(block_index)
+            if namespace == "substitution":
+                message = SystemMessage(
+                    line=occurrence.line,
+                    level=ERROR_LEVEL,
+                    message=f'Duplicate substitution definition name: "{name}".',
+                )
+            elif (
+                not first_target_dropped
+                and occurrence.uri is not None
+                and occurrence.uri == first_uri
+            ):
+                continue
+            else:
+                first_target_dropped = True
+                message = SystemMessage(
+                    line=occurrence.line,
+                    level=WARNING_LEVEL,
+                    message=f'Duplicate explicit target name: "{name}".',
+                )
+            if not reported:
+                messages.append(message)
+    return messages
+
+
+def _build_sections(headings: Iterable[Heading], line_count: int) -> List[_Section]:
+    """Arranges headings with absolute line numbers into a tree of sections.
+
+    Headings whose title level is inconsistent do not start sections.
+    """
+    sections: List[_Section] = []
+    section_stack: List[Tuple[int, _Section]] = []
+    for heading, level in _heading_levels(headings):
+        if level is None:
+            continue
+        s = _Section(name=heading.name, start=heading.line, end=-1)
+        if sections:
+            # End all sections at the same or deeper level
+            sections[-1].end_at(heading.line - 1)
+        while section_stack and section_stack[-1][0] >= level:
+            section_stack.pop()
+        # If there is a section at a higher level, add this section as a subsection
+        if section_stack:
+            section_stack[-1][1].subsections.append(s)
+        else:
+            # Add a new top-level section
+            sections.append(s)
+        section_stack.append((level, s))
+    if sections:
+        sections[-1].end_at(line_count - 1)
+    return sections
+
+
+# Matches the label of a footnote reference up to the cursor, e.g. "[#no"
+_footnote_label_prefix_pattern = re.compile(r"\[([^\s\[\]]*)$")
+
+
+def _footnote_label_prefix(text_before_cursor: str) -> str:
+    match = _footnote_label_prefix_pattern.search(text_before_cursor)
+    # docutils normalizes footnote labels to lower case
+    return match.group(1).lower() if match else ""
+
+
+def _to_diagnostic(lines: Sequence[str], message: SystemMessage) -> Diagnostic:
+    line = lines[message.line].rstrip("\r\n") if message.line < len(lines) else ""
+    return Diagnostic(
+        range=Range(
+            start=Position(line=message.line, character=0),
+            end=Position(line=message.line, character=utf16_column(line, len(line))),
+        ),
+        severity=(
+            DiagnosticSeverity.Error
+            if message.severity == "error"
+            else DiagnosticSeverity.Warning
+        ),
+        source="docutils",
+        message=message.message,
+    )
+
+
+def _to_location(uri: str, occurrence: Occurrence) -> Location:
+    return Location(
+        uri=uri,
+        range=Range(
+            start=Position(line=occurrence.line, character=occurrence.start),
+            end=Position(line=occurrence.line, character=occurrence.end),
+        ),
+    )
+
+
+def _serialize_symbols(lines: List[str], sections: List[_Section]) -> str:
+    """Serializes the section tree of a document as a list of DocumentSymbols.
+
+    The symbols are built as plain dictionaries without recursion, because
+    validating thousands of nested pydantic models takes longer than the request.
+    """
+    symbols: List[Dict[str, Any]] = []
+    stack = [(s, symbols) for s in reversed(sections)]
+    while stack:
+        s, siblings = stack.pop()
+        section_range = {
+            "start": {"line": s.start, "character": 0},
+            "end": {"line": s.end, "character": len(lines[s.end]) - 1},
+        }
+        children: List[Dict[str, Any]] = []
+        siblings.append(
+            {
+                "name": s.name,
+                "kind": int(SymbolKind.Class),
+                "range": section_range,
+                "selectionRange": section_range,
+                "children": children,
+            }
+        )
+        stack.extend((subsection, children) for subsection in reversed(s.subsections))
+    return json.dumps(symbols)
+
+
+def _encode_tokens(
+    blocks: List[Block],
+    block_starts: List[int],
+    start_line: int = 0,
+    end_line: Optional[int] = None,
+) -> List[int]:
+    """Encodes the semantic tokens of the lines from *start_line* to *end_line*.
+
+    Every token is encoded as five integers: its line and start character relative
+    to the previous token, its length, its type and its (absent) modifiers. Only
+    the blocks that overlap the lines are visited.
+    """
+    data: List[int] = []
+    previous_line = previous_start = 0
+    first_block = max(bisect_right(block_starts, start_line) - 1, 0)
+    for block_start, block in zip(
+        islice(block_starts, first_block, None), islice(blocks, first_block, None)
+    ):
+        if end_line is not None and block_start >= end_line:
+            break
+        tokens = block.tokens
+        for index in range(0, len(tokens), 4):
+            line = block_start + tokens[index]
+            if line < start_line:
+                continue
+            if end_line is not None and line >= end_line:
+                break
+            start = tokens[index + 1]
+            data += (
+                line - previous_line,
+                start - previous_start if line == previous_line else start,
+                tokens[index + 2],
+                tokens[index + 3],
+                0,
+            )
+            previous_line, previous_start = line, start
+    return data
+
+
+def _token_edits(previous: List[int], current: List[int]) -> List[Dict[str, Any]]:
+    """Returns the edit that turns the *previous* token data into the *current* one.
+
+    Edits within a document leave the data before and after the edited lines
+    unchanged, so a single edit replaces what lies between the common prefix and
+    suffix.
+    """
+    if previous == current:
+        return []
+    max_common = min(len(previous), len(current))
+    prefix = 0
+    while prefix < max_common and previous[prefix] == current[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < max_common - prefix and previous[-1 - suffix] == current[-1 - suffix]
+    ):
+        suffix += 1
+    return [
+        {
+            "start": prefix,
+            "deleteCount": len(previous) - prefix - suffix,
+            "data": current[prefix:][: len(current) - prefix - suffix],
+        }
+    ]
+
+
+def _import_parsing() -> None:
+    from rst_language_server import parsing  # noqa: F401
+
+
+def parse_rst(text: str) -> "nodes.document":
+    from rst_language_server import parsing
+
+    return parsing.parse_rst(text)
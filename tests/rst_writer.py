@@ -75,6 +75,25 @@ class _SerializationVisitor(nodes.SparseNodeVisitor):
     def depart_emphasis(self, node: nodes.emphasis) -> None:
         self.text += "*"
 
+    def visit_footnote(self, node: nodes.footnote) -> None:
+        indentation = 4 * len(self._structural_element) * " "
+        self.text += indentation
+        self.text += ".. ["
+        self._structural_element.append(node)
+
+    def depart_footnote(self, node: nodes.footnote) -> None:
+        self._structural_element.pop()
+
+    def visit_footnote_reference(self, node: nodes.footnote_reference) -> None:
+        self.text += "["
+
+    def depart_footnote_reference(self, node: nodes.footnote_reference) -> None:
+        self.text += "]_"
+
+    def depart_label(self, node: nodes.label) -> None:
+        if isinstance(node.parent, nodes.footnote):
+            self.text += "] "
+
     def visit_literal(self, node: nodes.literal) -> None:
         self.text += "``"
 
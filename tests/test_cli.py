@@ -1,4 +1,10 @@
+import json
 import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
 from unittest.mock import patch
 
 import pytest
@@ -65,6 +71,22 @@ def test_log_level_option_configures_level_for_pygls_logger(tmp_path, log_level:
     assert logging.getLevelName(logger.level) == log_level.upper()
 
 
+def _server_options(**options) -> Dict[str, Any]:
+    """Returns the keyword arguments that rst-ls passes to create_server."""
+    return {
+        **dict(
+            parse_delay=None,
+            parse_processes=None,
+            index_workspace=False,
+            cache_dir=None,
+            collect_metrics=False,
+            metrics_log_interval=None,
+            profile_path=None,
+        ),
+        **options,
+    }
+
+
 @pytest.mark.parametrize("flag", (True, False))
 def test_client_insert_text_interpretation_propagates_config_value(flag: bool):
     cli = CliRunner()
@@ -76,4 +98,185 @@ def test_client_insert_text_interpretation_propagates_config_value(flag: bool):
             catch_exceptions=False,
         )
 
-    create_call.assert_called_once_with(flag)
+    create_call.assert_called_once_with(flag, **_server_options())
+
+
+@pytest.mark.parametrize(
+    "options, server_options",
+    (
+        (["--parse-delay=0.25"], _server_options(parse_delay=0.25)),
+        (["--parse-processes=4"], _server_options(parse_processes=4)),
+        (["--index-workspace"], _server_options(index_workspace=True)),
+        (["--cache-dir=cache"], _server_options(cache_dir="cache")),
+        (["--metrics"], _server_options(collect_metrics=True)),
+        (["--metrics-interval=60"], _server_options(metrics_log_interval=60.0)),
+        (["--profile=profile.txt"], _server_options(profile_path="profile.txt")),
+    ),
+)
+def test_server_options_propagate_config_values(
+    options: List[str], server_options: Dict[str, Any]
+):
+    cli = CliRunner()
+
+    with patch("rst_language_server.cli.create_server") as create_call:
+        cli.invoke(rst_ls, options, catch_exceptions=False)
+
+    create_call.assert_called_once_with(True, **server_options)
+
+
+def test_check_writes_diagnostics_as_json_lines_and_fails_on_errors(tmp_path):
+    cli = CliRunner()
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "warning.rst").write_text("Text *emph\n")
+    (tmp_path / "docs" / "valid.rst").write_text("Text\n")
+    error_file = tmp_path / "error.txt"
+    error_file.write_text("Text\n\n.. unknown:: x\n")
+
+    result = cli.invoke(
+        rst_ls,
+        ["check", str(tmp_path / "docs"), str(error_file)],
+        catch_exceptions=False,
+    )
+
+    diagnostics = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(d["path"], d["line"], d["severity"]) for d in diagnostics] == [
+        (str(tmp_path / "docs" / "warning.rst"), 1, "warning"),
+        (str(error_file), 3, "error"),
+    ]
+    assert result.exit_code == 2
+
+
+def test_check_writes_sarif_log_and_fails_on_warnings(tmp_path):
+    cli = CliRunner()
+    file_path = tmp_path / "warning.rst"
+    file_path.write_text("Title\n=====\n\nText *emph\n")
+
+    result = cli.invoke(
+        rst_ls, ["check", "--format=sarif", str(file_path)], catch_exceptions=False
+    )
+
+    sarif_log = json.loads(result.stdout)
+    (run,) = sarif_log["runs"]
+    assert [
+        (
+            r["level"],
+            r["locations"][0]["physicalLocation"]["artifactLocation"]["uri"],
+            r["locations"][0]["physicalLocation"]["region"]["startLine"],
+        )
+        for r in run["results"]
+    ] == [("warning", file_path.resolve().as_uri(), 4)]
+    assert result.exit_code == 1
+
+
+def test_check_writes_sarif_locations_relative_to_working_directory(
+    tmp_path, monkeypatch
+):
+    cli = CliRunner()
+    file_path = tmp_path / "my docs" / "warning.rst"
+    file_path.parent.mkdir()
+    file_path.write_text("Text *emph\n")
+    monkeypatch.chdir(tmp_path)
+
+    result = cli.invoke(
+        rst_ls,
+        ["check", "--format=sarif", str(Path("my docs", "warning.rst"))],
+        catch_exceptions=False,
+    )
+
+    (run,) = json.loads(result.stdout)["runs"]
+    (sarif_result,) = run["results"]
+    assert sarif_result["locations"][0]["physicalLocation"]["artifactLocation"] == {
+        "uri": "my%20docs/warning.rst",
+        "uriBaseId": "%SRCROOT%",
+    }
+    assert run["originalUriBaseIds"] == {
+        "%SRCROOT%": {"uri": tmp_path.resolve().as_uri() + "/"}
+    }
+
+
+def test_check_succeeds_without_diagnostics(tmp_path):
+    cli = CliRunner()
+    (tmp_path / "valid.rst").write_text("Title\n=====\n")
+
+    result = cli.invoke(rst_ls, ["check", str(tmp_path)], catch_exceptions=False)
+
+    assert result.stdout == ""
+    assert result.exit_code == 0
+
+
+def test_check_jobs_propagates_config_value(tmp_path):
+    cli = CliRunner()
+
+    with patch("rst_language_server.cli.lint_paths", return_value=[]) as lint_call:
+        cli.invoke(rst_ls, ["check", "--jobs=3", str(tmp_path)], catch_exceptions=False)
+
+    lint_call.assert_called_once_with((str(tmp_path),), 3)
+
+
+# Upper bound for the time from starting rst-ls until it answers the initialize
+# request. It is well above the startup time on a developer machine, so that it
+# only catches regressions such as eagerly importing the docutils parser.
+STARTUP_BUDGET_SECONDS = 2.0
+
+
+def _start_and_initialize(tmp_path) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """Starts rst-ls in a new process and sends an initialize request.
+
+    Returns the time until the response arrived and the self and cumulative
+    import time of every module in microseconds, as reported by -X importtime.
+    """
+    request = json.dumps(
+        {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "initialize",
+            "params": {
+                "processId": None,
+                "rootUri": tmp_path.as_uri(),
+                "capabilities": {},
+            },
+        }
+    ).encode()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-m", "rst_language_server"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    server.stdin.write(b"Content-Length: %d\r\n\r\n" % len(request) + request)
+    server.stdin.flush()
+    content_length = int(server.stdout.readline().split()[-1])
+    while server.stdout.readline().strip():
+        pass
+    response = json.loads(server.stdout.read(content_length))
+    elapsed = time.perf_counter() - start
+    _, import_report = server.communicate(timeout=60)
+    assert "capabilities" in response["result"]
+    import_times = {}
+    for line in import_report.decode().splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative_time, module = line.split(":", 1)[1].split("|")
+        import_times[module.strip()] = (int(self_time), int(cumulative_time))
+    return elapsed, import_times
+
+
+def test_answers_initialize_without_importing_the_docutils_parser(tmp_path):
+    _, import_times = _start_and_initialize(tmp_path)
+
+    assert "docutils.parsers.rst" not in import_times
+    assert "rst_language_server.parsing" not in import_times
+
+
+def test_answers_initialize_within_startup_budget(tmp_path):
+    elapsed, import_times = _start_and_initialize(tmp_path)
+
+    slowest_imports = sorted(
+        import_times.items(), key=lambda item: item[1][1], reverse=True
+    )[:10]
+    report = "\n".join(
+        f"{cumulative_time / 1000:8.1f} ms {module}"
+        for module, (_, cumulative_time) in slowest_imports
+    )
+    assert elapsed < STARTUP_BUDGET_SECONDS, f"Slowest imports:\n{report}"
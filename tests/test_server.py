@@ -1,43 +1,81 @@
+import asyncio
 import json
 import os
+import sqlite3
 import string
 import sys
+import time
 import uuid
 from contextlib import contextmanager
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, BinaryIO, List
+from typing import Any, BinaryIO, List, Set, Tuple
 
 import docutils.nodes
 import hypothesis.strategies as st
 import pytest
+from docutils.frontend import OptionParser
 from docutils.io import StringOutput
+from docutils.parsers.rst import Parser
 from docutils.utils import column_width, new_document
 from hypothesis import assume, given
 from pydantic import parse_obj_as
+from pygls.exceptions import JsonRpcInvalidParams
 from pygls.lsp.methods import (
     COMPLETION,
+    DEFINITION,
     DOCUMENT_SYMBOL,
     INITIALIZE,
+    INITIALIZED,
+    REFERENCES,
     TEXT_DOCUMENT_DID_CHANGE,
+    TEXT_DOCUMENT_DID_CLOSE,
     TEXT_DOCUMENT_DID_OPEN,
+    TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+    TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
+    WORKSPACE_DID_CHANGE_WATCHED_FILES,
+    WORKSPACE_EXECUTE_COMMAND,
+    WORKSPACE_SYMBOL,
 )
 from pygls.lsp.types import (
     ClientCapabilities,
     CompletionParams,
+    DefinitionParams,
+    DiagnosticSeverity,
+    DidChangeWatchedFilesParams,
     DocumentSymbol,
     DocumentSymbolParams,
+    ExecuteCommandParams,
+    FileChangeType,
+    FileEvent,
+    InitializedParams,
     InitializeParams,
+    Location,
     Position,
+    PublishDiagnosticsClientCapabilities,
+    Range,
+    ReferenceContext,
+    ReferenceParams,
+    SemanticTokensDeltaParams,
+    SemanticTokensParams,
+    SemanticTokensRangeParams,
+    SymbolInformation,
     SymbolKind,
+    TextDocumentClientCapabilities,
+    TextDocumentContentChangeEvent,
     TextDocumentContentChangeTextEvent,
     TextDocumentIdentifier,
     TextDocumentItem,
     VersionedTextDocumentIdentifier,
+    WorkspaceSymbolParams,
 )
 from pygls.protocol import (
     DidChangeTextDocumentParams,
+    DidCloseTextDocumentParams,
     DidOpenTextDocumentParams,
+    JsonRPCNotification,
     JsonRPCProtocol,
     JsonRPCRequestMessage,
     JsonRPCResponseMessage,
@@ -45,7 +83,32 @@ from pygls.protocol import (
 from pygls.server import LanguageServer, StdOutTransportAdapter, deserialize_message
 
 import hypothesis_doctree as du
-from rst_language_server.server import create_server
+from rst_language_server.parsing import scan_headings
+from rst_language_server.records import TOKEN_TYPES
+from rst_language_server.server import (
+    METRICS_COMMAND,
+    START_PROFILING_COMMAND,
+    STOP_PROFILING_COMMAND,
+    _apply_content_changes,
+    _BackgroundParser,
+    _build_sections,
+    _FileChangeBatcher,
+    _Histogram,
+    _index_source,
+    _IndexCache,
+    _parse_document,
+    _ParseCache,
+    _ParsedDocument,
+    _reparse_changed_lines,
+    _Section,
+    _SharedParseCache,
+    _SymbolIndex,
+    _token_edits,
+    _WorkspaceIndex,
+    create_server,
+    lint_paths,
+    parse_rst,
+)
 from tests.rst_writer import RstWriter
 
 text = (
@@ -65,7 +128,9 @@ footnote_content = text.filter(lambda t: t != "::")
 
 
 @contextmanager
-def _client(client_insert_text_interpretation: bool = True) -> "LspClient":
+def _client(
+    client_insert_text_interpretation: bool = True, **server_options
+) -> "LspClient":
     # Establish pipes for communication between server and tests
     stdout_read_fd, stdout_write_fd = os.pipe()
     stdin_read_fd, stdin_write_fd = os.pipe()
@@ -76,7 +141,7 @@ def _client(client_insert_text_interpretation: bool = True) -> "LspClient":
         stdout_write_fd, "wb"
     )
 
-    server = create_server(client_insert_text_interpretation)
+    server = create_server(client_insert_text_interpretation, **server_options)
     transport = StdOutTransportAdapter(stdin_read, stdout_write)
     server.lsp.connection_made(transport)
 
@@ -92,15 +157,24 @@ class LspClient:
     def __init__(self, server: LanguageServer, server_stdout: BinaryIO):
         self.server = server
         self.stdout = server_stdout
+        # Notifications that the server sent before its responses
+        self.notifications: List[JsonRPCNotification] = []
 
-    def initialize(self, root_uri: str) -> JsonRPCResponseMessage:
+    def initialize(
+        self, root_uri: str, capabilities: ClientCapabilities = None
+    ) -> JsonRPCResponseMessage:
         return self._send_lsp_request(
             INITIALIZE,
             InitializeParams(
-                process_id=42, root_uri=root_uri, capabilities=ClientCapabilities()
+                process_id=42,
+                root_uri=root_uri,
+                capabilities=capabilities or ClientCapabilities(),
             ),
         )
 
+    def initialized(self) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(INITIALIZED, InitializedParams())
+
     def open(self, uri: str, text: str) -> JsonRPCResponseMessage:
         return self._send_lsp_request(
             TEXT_DOCUMENT_DID_OPEN,
@@ -116,7 +190,14 @@ class LspClient:
             ),
         )
 
-    def change(self, uri: str, text: str) -> JsonRPCResponseMessage:
+    def change(
+        self, uri: str, text: str, range: Range = None
+    ) -> JsonRPCResponseMessage:
+        content_change = (
+            TextDocumentContentChangeEvent(range=range, text=text)
+            if range
+            else TextDocumentContentChangeTextEvent(text=text)
+        )
         return self._send_lsp_request(
             TEXT_DOCUMENT_DID_CHANGE,
             DidChangeTextDocumentParams(
@@ -124,10 +205,16 @@ class LspClient:
                     uri=uri,
                     version=1,
                 ),
-                content_changes=[TextDocumentContentChangeTextEvent(text=text)],
+                content_changes=[content_change],
             ),
         )
 
+    def close(self, uri: str) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            TEXT_DOCUMENT_DID_CLOSE,
+            DidCloseTextDocumentParams(text_document=TextDocumentIdentifier(uri=uri)),
+        )
+
     def symbols(self, uri: str) -> JsonRPCResponseMessage:
         return self._send_lsp_request(
             DOCUMENT_SYMBOL,
@@ -145,6 +232,79 @@ class LspClient:
             ),
         )
 
+    def semantic_tokens(self, uri: str) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+            SemanticTokensParams(text_document=TextDocumentIdentifier(uri=uri)),
+        )
+
+    def semantic_token_edits(
+        self, uri: str, previous_result_id: str
+    ) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+            SemanticTokensDeltaParams(
+                text_document=TextDocumentIdentifier(uri=uri),
+                previous_result_id=previous_result_id,
+            ),
+        )
+
+    def semantic_tokens_in_range(
+        self, uri: str, range: Range
+    ) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
+            SemanticTokensRangeParams(
+                text_document=TextDocumentIdentifier(uri=uri), range=range
+            ),
+        )
+
+    def change_watched_files(self, *changes: FileEvent) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            WORKSPACE_DID_CHANGE_WATCHED_FILES,
+            DidChangeWatchedFilesParams(changes=list(changes)),
+        )
+
+    def workspace_symbols(self, query: str) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            WORKSPACE_SYMBOL, WorkspaceSymbolParams(query=query)
+        )
+
+    def definition(
+        self, uri: str, *, line: int, character: int
+    ) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            DEFINITION,
+            DefinitionParams(
+                text_document=TextDocumentIdentifier(uri=uri),
+                position=Position(line=line, character=character),
+            ),
+        )
+
+    def references(
+        self, uri: str, *, line: int, character: int, include_declaration: bool
+    ) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            REFERENCES,
+            ReferenceParams(
+                text_document=TextDocumentIdentifier(uri=uri),
+                position=Position(line=line, character=character),
+                context=ReferenceContext(include_declaration=include_declaration),
+            ),
+        )
+
+    def metrics(self) -> JsonRPCResponseMessage:
+        return self.execute_command(METRICS_COMMAND)
+
+    def execute_command(self, command: str, *arguments: Any) -> JsonRPCResponseMessage:
+        return self._send_lsp_request(
+            WORKSPACE_EXECUTE_COMMAND,
+            ExecuteCommandParams(command=command, arguments=list(arguments)),
+        )
+
+    def run_event_loop(self, seconds: float) -> None:
+        self.server.loop.run_until_complete(asyncio.sleep(seconds))
+
     def _send_lsp_request(self, method: str, params: Any) -> JsonRPCResponseMessage:
         request = JsonRPCRequestMessage(
             id=str(uuid.uuid4()),
@@ -160,14 +320,17 @@ class LspClient:
             f"Content-Type: {JsonRPCProtocol.CONTENT_TYPE}; charset={JsonRPCProtocol.CHARSET}\r\n\r\n"
         ).encode(JsonRPCProtocol.CHARSET)
         self.server.lsp.data_received(header + body)
-        content_length_header = self.stdout.readline()
-        content_length = int(content_length_header.split()[-1])
-        while self.stdout.readline().strip():
-            # Read all header lines until encountering an empty line
-            pass
-        response_data = self.stdout.read(content_length)
-        response = deserialize_message(json.loads(response_data))
-        return response
+        while True:
+            content_length_header = self.stdout.readline()
+            content_length = int(content_length_header.split()[-1])
+            while self.stdout.readline().strip():
+                # Read all header lines until encountering an empty line
+                pass
+            response_data = self.stdout.read(content_length)
+            response = deserialize_message(json.loads(response_data))
+            if not isinstance(response, JsonRPCNotification):
+                return response
+            self.notifications.append(response)
 
 
 @given(footnote_label=du.footnote_labels(), footnote_content=footnote_content)
@@ -403,3 +566,1470 @@ def test_reports_nested_sections_as_nested_symbols(tmp_path_factory):
     assert symbols[0].children[1].range.end == Position(line=7, character=len(lines[7]))
     assert symbols[1].range.start == Position(line=8, character=0)
     assert symbols[1].range.end == Position(line=9, character=len(lines[9]))
+
+
+def test_does_not_nest_titles_of_inconsistent_level(tmp_path_factory):
+    text = "A\n=\n\nB\n-\n\nC\n~\n\nD\n=\n\nE\n~\n\nText\n"
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=text)
+
+        response = client.symbols(file_path.as_uri()).result
+
+    symbols = parse_obj_as(List[DocumentSymbol], response)
+    assert [symbol.name for symbol in symbols] == ["A", "D"]
+    assert symbols[1].children == []
+    assert symbols[1].range.end.line == 15
+
+
+def test_updates_symbols_upon_document_change(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Heading 1\n=========\n")
+        client.symbols(file_path.as_uri())
+        client.change(file_path.as_uri(), text="Heading 2\n=========\n")
+
+        response = client.symbols(file_path.as_uri()).result
+
+    symbols = parse_obj_as(List[DocumentSymbol], response)
+    assert [symbol.name for symbol in symbols] == ["Heading 2"]
+
+
+def test_updates_symbol_ranges_upon_edits_within_a_section(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Heading\n=======\nText\n")
+        first_response = client.symbols(file_path.as_uri()).result
+        repeated_response = client.symbols(file_path.as_uri()).result
+        client.change(
+            file_path.as_uri(),
+            text=" and more text",
+            range=Range(
+                start=Position(line=2, character=4), end=Position(line=2, character=4)
+            ),
+        )
+
+        changed_response = client.symbols(file_path.as_uri()).result
+
+    assert repeated_response == first_response
+    symbols = parse_obj_as(List[DocumentSymbol], changed_response)
+    assert symbols[0].range.end == Position(line=2, character=len("Text and more text"))
+
+
+def _decode_tokens(data: List[int]) -> List[Tuple[int, int, int, str]]:
+    """Returns the line, start, length and type of semantic tokens."""
+    tokens = []
+    line = start = 0
+    for index in range(0, len(data), 5):
+        delta_line, delta_start, length, token_type, _ = data[index:][:5]
+        start = start + delta_start if delta_line == 0 else delta_start
+        line += delta_line
+        tokens.append((line, start, length, TOKEN_TYPES[token_type]))
+    return tokens
+
+
+def _apply_token_edits(data: List[int], edits: List[dict]) -> List[int]:
+    data = list(data)
+    for edit in edits:
+        start = edit["start"]
+        end = start + edit["deleteCount"]
+        data[start:end] = edit["data"]
+    return data
+
+
+def test_reports_semantic_tokens_of_markup(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    text = dedent(
+        """\
+        Title
+        =====
+
+        See [#note]_, ``code`` and :emphasis:`text`::
+
+            literal
+
+        .. note:: Note
+        """
+    )
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=text)
+
+        response = client.semantic_tokens(file_path.as_uri()).result
+
+    assert _decode_tokens(response["data"]) == [
+        (0, 0, 5, "class"),
+        (3, 4, 8, "variable"),
+        (3, 14, 8, "string"),
+        (3, 27, 10, "function"),
+        (5, 4, 7, "string"),
+        (7, 0, 9, "macro"),
+    ]
+
+
+def test_reports_semantic_tokens_in_utf16_code_units(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(
+            uri=file_path.as_uri(),
+            text="\U0001f600\U0001f600 see [#n]_ and ``\U0001f600``\n\n.. [#n] Note\n",
+        )
+
+        response = client.semantic_tokens(file_path.as_uri()).result
+
+    assert _decode_tokens(response["data"])[:2] == [
+        (0, 9, 5, "variable"),
+        (0, 19, 6, "string"),
+    ]
+
+
+def test_reports_semantic_token_edits_upon_document_change(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    paragraphs = [f"Paragraph with ``literal {i}``\n\n" for i in range(20)]
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="".join(paragraphs))
+        previous = client.semantic_tokens(file_path.as_uri()).result
+        paragraphs[10] = "Paragraph with :emphasis:`text`\n\n"
+        client.change(file_path.as_uri(), text="".join(paragraphs))
+
+        response = client.semantic_token_edits(
+            file_path.as_uri(), previous["resultId"]
+        ).result
+        current = client.semantic_tokens(file_path.as_uri()).result
+
+    assert response["resultId"] != previous["resultId"]
+    assert response["resultId"] == current["resultId"]
+    (edit,) = response["edits"]
+    assert len(edit["data"]) < len(current["data"])
+    assert _apply_token_edits(previous["data"], [edit]) == current["data"]
+
+
+def test_reports_all_semantic_tokens_upon_unknown_previous_result(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Some ``literal``\n")
+
+        response = client.semantic_token_edits(file_path.as_uri(), "unknown").result
+
+    assert "edits" not in response
+    assert _decode_tokens(response["data"]) == [(0, 5, 11, "string")]
+
+
+def test_reports_semantic_tokens_within_range(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    text = "".join(f"Paragraph ``{i}``\n\n" for i in range(10))
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=text)
+
+        response = client.semantic_tokens_in_range(
+            file_path.as_uri(),
+            Range(
+                start=Position(line=4, character=0), end=Position(line=8, character=0)
+            ),
+        ).result
+        all_tokens = _decode_tokens(
+            client.semantic_tokens(file_path.as_uri()).result["data"]
+        )
+
+    assert _decode_tokens(response["data"]) == [
+        token for token in all_tokens if 4 <= token[0] <= 8
+    ]
+
+
+@given(
+    previous=st.lists(st.integers(min_value=0, max_value=3)),
+    current=st.lists(st.integers(min_value=0, max_value=3)),
+)
+def test_semantic_token_edits_turn_previous_into_current_data(
+    previous: List[int], current: List[int]
+):
+    data = _apply_token_edits(previous, _token_edits(previous, current))
+
+    assert data == current
+
+
+def test_does_not_complete_footnotes_of_closed_documents(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    closed_file_path: Path = server_root / f"closed_file.rst"
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=closed_file_path.as_uri(), text=".. [#MyNote] Note\n")
+        client.open(uri=file_path.as_uri(), text="")
+        client.close(closed_file_path.as_uri())
+
+        response = client.complete(file_path.as_uri(), line=1, character=0).result
+
+    assert len(response["items"]) == 0
+
+
+def test_parse_cache_evicts_least_recently_used_documents_when_full():
+    cache = _ParseCache(max_size=10)
+    cache.put(_parse_document("file:///a.rst", 0, "Paragraph"))
+    cache.put(_parse_document("file:///b.rst", 0, "Paragraph"))
+
+    assert "file:///a.rst" not in cache
+    assert cache.get("file:///b.rst", 0) is not None
+
+
+def test_parse_cache_misses_outdated_document_versions():
+    cache = _ParseCache(max_size=1024)
+    cache.put(_parse_document("file:///a.rst", 0, "Paragraph"))
+
+    assert cache.get("file:///a.rst", 1) is None
+
+
+def test_shared_parse_cache_shares_parse_results_of_identical_contents():
+    cache = _SharedParseCache(max_size=1024)
+    lines = ["Title\n", "=====\n", "\n", "Text [#note]_\n"]
+    first = cache.parse("file:///a.rst", 0, lines)
+    first_sections = first.sections
+
+    second = cache.parse("file:///worktree/a.rst", 3, list(lines))
+
+    assert second.uri == "file:///worktree/a.rst"
+    assert second.version == 3
+    assert second.blocks is first.blocks
+    assert second.sections is first_sections
+    assert second.names is first.names
+
+
+def test_shared_parse_cache_parses_different_contents_separately():
+    cache = _SharedParseCache(max_size=1024)
+    first = cache.parse("file:///a.rst", 0, ["Paragraph\n"])
+
+    second = cache.parse("file:///b.rst", 0, ["Other paragraph\n"])
+
+    assert second.blocks is not first.blocks
+
+
+def test_shared_parse_cache_evicts_least_recently_used_contents_when_full():
+    cache = _SharedParseCache(max_size=15)
+    first = cache.parse("file:///a.rst", 0, ["Paragraph\n"])
+    cache.parse("file:///b.rst", 0, ["Other\n"])
+
+    second = cache.parse("file:///c.rst", 0, ["Paragraph\n"])
+
+    assert second.blocks is not first.blocks
+
+
+@given(sections=st.lists(du.sections(max_size=3, max_level=1), min_size=1, max_size=3))
+def test_parse_rst_produces_same_doctree_as_docutils_parser(
+    sections: List[docutils.nodes.section],
+):
+    document = new_document("testDoc")
+    for section in sections:
+        document.append(section)
+    output = StringOutput(encoding="unicode")
+    RstWriter().write(document, output)
+    text = output.destination
+    settings = OptionParser(
+        components=(Parser,), defaults=dict(report_level=3)
+    ).get_default_values()
+    expected = new_document("rst document", settings=settings)
+    Parser().parse(text, expected)
+
+    parse_rst(text)
+    actual = parse_rst(text)
+
+    assert actual.pformat() == expected.pformat()
+
+
+def test_updates_symbols_upon_incremental_document_change(tmp_path_factory):
+    text = dedent(
+        """\
+        Heading 1
+        =========
+        Some text
+
+        Heading 2
+        =========
+        """
+    )
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=text)
+        client.change(
+            file_path.as_uri(),
+            text="Heading 1.1\n-----------\n",
+            range=Range(
+                start=Position(line=4, character=0), end=Position(line=4, character=0)
+            ),
+        )
+
+        response = client.symbols(file_path.as_uri()).result
+
+    symbols = parse_obj_as(List[DocumentSymbol], response)
+    assert [symbol.name for symbol in symbols] == ["Heading 1", "Heading 2"]
+    assert [child.name for child in symbols[0].children] == ["Heading 1.1"]
+    assert symbols[1].range.start == Position(line=6, character=0)
+
+
+_rst_snippets = st.sampled_from(
+    [
+        "\n",
+        "Paragraph\n",
+        "  Indented\n",
+        "Title\n=====\n",
+        "Subtitle\n--------\n",
+        "=====\nTitle\n=====\n",
+        ".. [#note] Footnote\n",
+        "=====  =====\nA      B\n=====  =====\n1      2\n\n3      4\n=====  =====\n",
+        "=",
+        "x",
+    ]
+)
+_rst_texts = st.lists(_rst_snippets, max_size=10).map("".join)
+
+
+@given(text=_rst_texts, replacement=_rst_texts, data=st.data())
+def test_reparsing_changed_lines_equals_parsing_the_whole_document(
+    text: str, replacement: str, data
+):
+    start = data.draw(st.integers(min_value=0, max_value=len(text)))
+    end = data.draw(st.integers(min_value=start, max_value=len(text)))
+    changed_text = text[:start] + replacement + text[end:]
+    previous = _parse_document("file:///a.rst", 0, text)
+
+    def position(offset: int) -> Position:
+        line = text.count("\n", 0, offset)
+        return Position(line=line, character=offset - (text.rfind("\n", 0, offset) + 1))
+
+    change = TextDocumentContentChangeEvent(
+        range=Range(start=position(start), end=position(end)), text=replacement
+    )
+    lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+        previous.lines, [change]
+    )
+    reparsed = _reparse_changed_lines(
+        previous, len(previous.lines), 1, lines, first_changed_line, unchanged_suffix
+    )
+
+    expected = _parse_document("file:///a.rst", 1, changed_text)
+    assert reparsed.lines == expected.lines
+    assert reparsed.block_starts == expected.block_starts
+    assert reparsed.blocks == expected.blocks
+    assert reparsed.sections == expected.sections
+
+
+def test_answers_completion_requests_from_latest_parse_until_background_parse_completes(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(parse_delay=0.01) as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="")
+        client.run_event_loop(seconds=0.5)
+        client.change(file_path.as_uri(), text=".. [#MyNote] https://www.example.com\n")
+
+        response_before_parse = client.complete(
+            file_path.as_uri(), line=1, character=0
+        ).result
+        client.run_event_loop(seconds=0.5)
+        response_after_parse = client.complete(
+            file_path.as_uri(), line=1, character=0
+        ).result
+
+    assert len(response_before_parse["items"]) == 0
+    assert len(response_after_parse["items"]) > 0
+
+
+def test_background_parse_covers_all_changes_since_previous_parse(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(parse_delay=0.01) as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Heading\n")
+        for character in range(len("Heading")):
+            client.change(
+                file_path.as_uri(),
+                text="=",
+                range=Range(
+                    start=Position(line=1, character=character),
+                    end=Position(line=1, character=character),
+                ),
+            )
+            if character == 2:
+                client.run_event_loop(seconds=0.5)
+        client.run_event_loop(seconds=0.5)
+
+        response = client.symbols(file_path.as_uri()).result
+
+    symbols = parse_obj_as(List[DocumentSymbol], response)
+    assert [symbol.name for symbol in symbols] == ["Heading"]
+    assert symbols[0].range.end.line == 1
+
+
+def test_parses_documents_in_worker_processes(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_paths = [server_root / f"test_file_{index}.rst" for index in range(3)]
+    with _client(parse_processes=2) as client:
+
+        def footnote_labels() -> List[Set[str]]:
+            return [
+                {
+                    item["label"]
+                    for item in client.complete(
+                        file_path.as_uri(), line=5, character=0
+                    ).result["items"]
+                }
+                for file_path in file_paths
+            ]
+
+        def wait_for_footnote_labels(expected: List[Set[str]]) -> List[Set[str]]:
+            # Worker processes take a while to start
+            deadline = time.monotonic() + 30
+            while footnote_labels() != expected and time.monotonic() < deadline:
+                client.run_event_loop(seconds=0.1)
+            return footnote_labels()
+
+        client.initialize(server_root.as_uri())
+        for index, file_path in enumerate(file_paths):
+            client.open(uri=file_path.as_uri(), text=f".. [#Note{index}] Note\n")
+        labels_after_open = wait_for_footnote_labels(
+            [{"#note0"}, {"#note1"}, {"#note2"}]
+        )
+        client.change(
+            file_paths[0].as_uri(),
+            text="\n.. [#Extra] Note\n",
+            range=Range(
+                start=Position(line=1, character=0), end=Position(line=1, character=0)
+            ),
+        )
+        labels_after_change = wait_for_footnote_labels(
+            [{"#extra", "#note0"}, {"#note1"}, {"#note2"}]
+        )
+        # Leaves the footnotes unchanged, so that the worker reuses the index
+        client.change(
+            file_paths[0].as_uri(),
+            text="\nText\n",
+            range=Range(
+                start=Position(line=3, character=0), end=Position(line=3, character=0)
+            ),
+        )
+        client.run_event_loop(seconds=1)
+        labels_after_text_change = footnote_labels()
+
+    assert labels_after_open == [{"#note0"}, {"#note1"}, {"#note2"}]
+    assert labels_after_change == [{"#extra", "#note0"}, {"#note1"}, {"#note2"}]
+    assert labels_after_text_change == labels_after_change
+
+
+def test_background_parser_parses_focused_document_first_once_the_worker_is_free():
+    loop = asyncio.new_event_loop()
+    parsed_uris = []
+    background_parser = _BackgroundParser(
+        loop,
+        _ParseCache(max_size=1024),
+        delay=0,
+        on_parsed=lambda document: parsed_uris.append(document.uri),
+    )
+    for name in ("a", "b", "c"):
+        background_parser.schedule(f"file:///{name}.rst", None, 0, ["Text\n"], 0, 0)
+    background_parser.focus("file:///c.rst")
+
+    loop.run_until_complete(asyncio.sleep(0.5))
+    loop.close()
+
+    assert parsed_uris == ["file:///a.rst", "file:///c.rst", "file:///b.rst"]
+
+
+def test_completes_only_footnotes_of_the_current_document(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    other_file_path: Path = server_root / f"other_file.rst"
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=other_file_path.as_uri(), text=".. [#OtherNote] Note\n")
+        client.open(uri=file_path.as_uri(), text=".. [#MyNote] Note\n")
+
+        response = client.complete(file_path.as_uri(), line=1, character=0).result
+
+    assert [item["label"] for item in response["items"]] == ["#mynote"]
+
+
+def test_does_not_complete_footnotes_without_label(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=".. [#] Note\n\n.. [*] Note\n")
+
+        response = client.complete(file_path.as_uri(), line=3, character=0).result
+
+    assert len(response["items"]) == 0
+
+
+def test_completes_footnotes_matching_the_label_prefix_before_the_cursor(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(
+            uri=file_path.as_uri(),
+            text=".. [#Notes] Note\n\n.. [#Other] Note\n\n.. [#NoMore] Note\n\nSee [#No",
+        )
+
+        response = client.complete(file_path.as_uri(), line=6, character=8).result
+
+    assert [item["label"] for item in response["items"]] == ["#nomore", "#notes"]
+
+
+def test_marks_completion_list_as_incomplete_when_footnotes_exceed_item_limit(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    footnotes = "\n".join(f".. [#note{i}] Note\n" for i in range(5))
+    with _client(max_completion_items=3) as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=footnotes)
+
+        response = client.complete(file_path.as_uri(), line=10, character=0).result
+
+    assert [item["label"] for item in response["items"]] == [
+        "#note0",
+        "#note1",
+        "#note2",
+    ]
+    assert response["isIncomplete"]
+
+
+def test_autocompletes_title_adornment_after_incremental_document_change(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Paragraph\n\nMyTitle\n")
+        client.change(
+            file_path.as_uri(),
+            "==\n",
+            range=Range(
+                start=Position(line=3, character=0), end=Position(line=3, character=0)
+            ),
+        )
+
+        response = client.complete(file_path.as_uri(), line=3, character=2).result
+
+    assert [item["insertText"] for item in response["items"]] == ["======="]
+
+
+@given(text=_rst_texts, replacement=_rst_texts, data=st.data())
+def test_shifting_sections_of_reparsed_document_equals_building_them_anew(
+    text: str, replacement: str, data
+):
+    start = data.draw(st.integers(min_value=0, max_value=len(text)))
+    end = data.draw(st.integers(min_value=start, max_value=len(text)))
+    changed_text = text[:start] + replacement + text[end:]
+    previous = _parse_document("file:///a.rst", 0, text)
+    assert previous.sections is not None
+    change = TextDocumentContentChangeTextEvent(text=changed_text)
+    lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+        previous.lines, [change]
+    )
+
+    reparsed = _reparse_changed_lines(
+        previous, len(previous.lines), 1, lines, first_changed_line, unchanged_suffix
+    )
+
+    expected = _parse_document("file:///a.rst", 1, changed_text)
+    assert reparsed.sections == expected.sections
+
+
+_rst_texts_with_messages = st.lists(
+    st.one_of(
+        _rst_snippets,
+        st.sampled_from(
+            [
+                "Text *emph\n",
+                ".. _a: https://a.org\n",
+                ".. _a: https://b.org\n",
+                ".. |v| replace:: 1\n",
+                "Title\n=====\n",
+                "Subsubtitle\n~~~~~~~~~~~\n",
+            ]
+        ),
+    ),
+    max_size=10,
+).map("".join)
+
+
+@given(
+    text=_rst_texts_with_messages,
+    replacement=_rst_texts_with_messages,
+    data=st.data(),
+)
+def test_reusing_messages_of_reparsed_document_equals_collecting_them_anew(
+    text: str, replacement: str, data
+):
+    start = data.draw(st.integers(min_value=0, max_value=len(text)))
+    end = data.draw(st.integers(min_value=start, max_value=len(text)))
+    changed_text = text[:start] + replacement + text[end:]
+    previous = _parse_document("file:///a.rst", 0, text)
+    assert previous.messages is not None
+    change = TextDocumentContentChangeTextEvent(text=changed_text)
+    lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+        previous.lines, [change]
+    )
+
+    reparsed = _reparse_changed_lines(
+        previous, len(previous.lines), 1, lines, first_changed_line, unchanged_suffix
+    )
+
+    expected = _parse_document("file:///a.rst", 1, changed_text)
+    assert reparsed.messages == expected.messages
+
+
+@given(
+    text=_rst_texts_with_messages,
+    replacement=_rst_texts_with_messages,
+    data=st.data(),
+)
+def test_reusing_footnote_index_of_reparsed_document_equals_building_it_anew(
+    text: str, replacement: str, data
+):
+    start = data.draw(st.integers(min_value=0, max_value=len(text)))
+    end = data.draw(st.integers(min_value=start, max_value=len(text)))
+    changed_text = text[:start] + replacement + text[end:]
+    previous = _parse_document("file:///a.rst", 0, text)
+    assert previous.footnote_labels is not None
+    change = TextDocumentContentChangeTextEvent(text=changed_text)
+    lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+        previous.lines, [change]
+    )
+
+    reparsed = _reparse_changed_lines(
+        previous, len(previous.lines), 1, lines, first_changed_line, unchanged_suffix
+    )
+
+    expected = _parse_document("file:///a.rst", 1, changed_text)
+    assert reparsed.footnote_labels.complete("", limit=100) == (
+        expected.footnote_labels.complete("", limit=100)
+    )
+
+
+def test_reparsing_reuses_footnote_index_unless_footnotes_change():
+    previous = _parse_document(
+        "file:///a.rst", 0, ".. [#note] Note\n\nText\n\nMore text\n"
+    )
+    footnote_labels = previous.footnote_labels
+
+    def reparse(line: int, text: str) -> _ParsedDocument:
+        change = TextDocumentContentChangeEvent(
+            range=Range(
+                start=Position(line=line, character=0),
+                end=Position(line=line, character=0),
+            ),
+            text=text,
+        )
+        lines, first_changed_line, unchanged_suffix = _apply_content_changes(
+            previous.lines, [change]
+        )
+        return _reparse_changed_lines(
+            previous,
+            len(previous.lines),
+            1,
+            lines,
+            first_changed_line,
+            unchanged_suffix,
+        )
+
+    assert reparse(4, "Changed ").footnote_labels is footnote_labels
+    assert reparse(0, "Text\n\n").footnote_labels is footnote_labels
+    assert reparse(4, ".. [#other] Other\n\n").footnote_labels is not footnote_labels
+
+
+@given(sections=st.lists(du.sections(max_size=3), min_size=1, max_size=3))
+def test_scanned_sections_equal_parsed_sections_of_written_documents(
+    sections: List[docutils.nodes.section],
+):
+    document = new_document("testDoc")
+    for section in sections:
+        document.append(section)
+    output = StringOutput(encoding="unicode")
+    RstWriter().write(document, output)
+    text = output.destination
+    lines = text.splitlines(True)
+
+    headings = scan_headings(lines)
+
+    assume(headings is not None)
+    expected = _parse_document("file:///a.rst", 0, text)
+    assert _build_sections(headings, len(lines)) == expected.sections
+
+
+@given(text=_rst_texts)
+def test_scanned_sections_equal_parsed_sections_unless_scanner_gives_up(text: str):
+    lines = text.splitlines(True)
+
+    headings = scan_headings(lines)
+
+    assume(headings is not None)
+    expected = _parse_document("file:///a.rst", 0, text)
+    assert _build_sections(headings, len(lines)) == expected.sections
+
+
+def test_reports_symbols_of_opened_document_before_background_parse_completes(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(parse_delay=60) as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Heading\n=======\n\nText\n")
+
+        response = client.symbols(file_path.as_uri()).result
+
+    symbols = parse_obj_as(List[DocumentSymbol], response)
+    assert [symbol.name for symbol in symbols] == ["Heading"]
+    assert symbols[0].range.end.line == 3
+
+
+def test_workspace_index_contains_sections_and_footnotes_of_all_rst_files(
+    tmp_path_factory,
+):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    (workspace_root / "docs").mkdir()
+    (workspace_root / ".hidden").mkdir()
+    (workspace_root / "index.rst").write_text("Index\n=====\n")
+    (workspace_root / "docs" / "guide.rst").write_text(".. [#note] Footnote\n")
+    (workspace_root / ".hidden" / "ignored.rst").write_text("Ignored\n=======\n")
+    (workspace_root / "README.md").write_text("# Ignored\n")
+    workspace_index = _WorkspaceIndex(max_workers=2, batch_size=1)
+    progress = []
+
+    asyncio.run(
+        workspace_index.build(
+            str(workspace_root), lambda done, total: progress.append((done, total))
+        )
+    )
+
+    assert sorted(workspace_index.files) == [
+        (workspace_root / "docs" / "guide.rst").as_uri(),
+        (workspace_root / "index.rst").as_uri(),
+    ]
+    index_file = workspace_index.files[(workspace_root / "index.rst").as_uri()]
+    assert [section.name for section in index_file.sections] == ["Index"]
+    guide_file = workspace_index.files[(workspace_root / "docs" / "guide.rst").as_uri()]
+    assert [footnote.label for footnote in guide_file.footnotes] == ["note"]
+    assert progress == [(0, 2), (1, 2), (2, 2)]
+
+
+def test_index_cache_discards_records_of_other_format_versions(tmp_path_factory):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    (workspace_root / "index.rst").write_text("Index\n=====\n")
+    asyncio.run(
+        _WorkspaceIndex(cache=_IndexCache(str(cache_dir))).build(str(workspace_root))
+    )
+    connection = sqlite3.connect(str(cache_dir / "index.sqlite3"))
+    with connection:
+        connection.execute(f"PRAGMA user_version = {_IndexCache.format_version - 1}")
+    connection.close()
+
+    assert _IndexCache(str(cache_dir)).entries() == {}
+
+
+def test_workspace_index_reuses_cached_records_of_unmodified_files(tmp_path_factory):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    file_path = workspace_root / "index.rst"
+    file_path.write_text("Index\n=====\n")
+    asyncio.run(
+        _WorkspaceIndex(cache=_IndexCache(str(cache_dir))).build(str(workspace_root))
+    )
+    # Change the file without changing its size or modification time
+    mtime_ns = file_path.stat().st_mtime_ns
+    file_path.write_text("Other\n=====\n")
+    os.utime(file_path, ns=(mtime_ns, mtime_ns))
+    workspace_index = _WorkspaceIndex(cache=_IndexCache(str(cache_dir)))
+
+    asyncio.run(workspace_index.build(str(workspace_root)))
+
+    index_file = workspace_index.files[file_path.as_uri()]
+    assert [section.name for section in index_file.sections] == ["Index"]
+
+
+def test_workspace_index_reindexes_files_that_changed_since_they_were_cached(
+    tmp_path_factory,
+):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    file_path = workspace_root / "index.rst"
+    file_path.write_text("Index\n=====\n")
+    asyncio.run(
+        _WorkspaceIndex(cache=_IndexCache(str(cache_dir))).build(str(workspace_root))
+    )
+    mtime_ns = file_path.stat().st_mtime_ns
+    file_path.write_text("Other\n=====\n")
+    os.utime(file_path, ns=(mtime_ns + 1, mtime_ns + 1))
+    workspace_index = _WorkspaceIndex(cache=_IndexCache(str(cache_dir)))
+
+    asyncio.run(workspace_index.build(str(workspace_root)))
+
+    index_file = workspace_index.files[file_path.as_uri()]
+    assert [section.name for section in index_file.sections] == ["Other"]
+
+
+def test_workspace_index_removes_cached_records_of_deleted_files(tmp_path_factory):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    kept_path = workspace_root / "kept.rst"
+    kept_path.write_text("Kept\n====\n")
+    deleted_path = workspace_root / "deleted.rst"
+    deleted_path.write_text("Deleted\n=======\n")
+    asyncio.run(
+        _WorkspaceIndex(cache=_IndexCache(str(cache_dir))).build(str(workspace_root))
+    )
+    deleted_path.unlink()
+    workspace_index = _WorkspaceIndex(cache=_IndexCache(str(cache_dir)))
+
+    asyncio.run(workspace_index.build(str(workspace_root)))
+
+    assert list(workspace_index.files) == [kept_path.as_uri()]
+    assert list(_IndexCache(str(cache_dir)).entries()) == [str(kept_path)]
+
+
+def test_indexes_workspace_without_cache_that_is_not_a_database(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    (cache_dir / "index.sqlite3").write_bytes(b"Not a database" * 100)
+    (server_root / "index.rst").write_text("Index\n=====\n")
+    with _client(index_workspace=True, cache_dir=str(cache_dir)) as client:
+        client.initialize(server_root.as_uri())
+        client.initialized()
+        client.run_event_loop(3)
+
+        response = client.workspace_symbols("").result
+
+    symbols = parse_obj_as(List[SymbolInformation], response)
+    assert [symbol.name for symbol in symbols] == ["Index"]
+
+
+def test_workspace_index_update_reindexes_changed_files_and_removes_deleted_files(
+    tmp_path_factory,
+):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    cache_dir: Path = tmp_path_factory.mktemp("rst_language_server_cache")
+    changed_path = workspace_root / "changed.rst"
+    changed_path.write_text("Index\n=====\n")
+    deleted_path = workspace_root / "deleted.rst"
+    deleted_path.write_text("Deleted\n=======\n")
+    workspace_index = _WorkspaceIndex(cache=_IndexCache(str(cache_dir)))
+    asyncio.run(workspace_index.build(str(workspace_root)))
+    changed_path.write_text("Changed\n=======\n")
+    created_path = workspace_root / "created.rst"
+    created_path.write_text("Created\n=======\n")
+    # Reported as changed, but deleted afterwards
+    deleted_path.unlink()
+    progress = []
+
+    file_indexes, removed_uris = asyncio.run(
+        workspace_index.update(
+            {
+                str(changed_path): False,
+                str(created_path): False,
+                str(deleted_path): False,
+            },
+            lambda done, total: progress.append((done, total)),
+        )
+    )
+
+    assert sorted(file_index.uri for file_index in file_indexes) == [
+        changed_path.as_uri(),
+        created_path.as_uri(),
+    ]
+    assert removed_uris == [deleted_path.as_uri()]
+    assert sorted(workspace_index.files) == sorted(
+        [changed_path.as_uri(), created_path.as_uri()]
+    )
+    assert [
+        section.name
+        for section in workspace_index.files[changed_path.as_uri()].sections
+    ] == ["Changed"]
+    assert progress == [(0, 2), (2, 2)]
+    assert sorted(_IndexCache(str(cache_dir)).entries()) == sorted(
+        [str(changed_path), str(created_path)]
+    )
+
+
+def test_workspace_index_update_drops_results_of_superseded_files(tmp_path_factory):
+    workspace_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path = workspace_root / "index.rst"
+    file_path.write_text("Index\n=====\n")
+    workspace_index = _WorkspaceIndex()
+
+    file_indexes, _ = asyncio.run(
+        workspace_index.update({str(file_path): False}, is_superseded=lambda _: True)
+    )
+
+    assert file_indexes == []
+    assert workspace_index.files == {}
+
+
+def test_file_change_batcher_reindexes_latest_change_per_file_in_one_batch():
+    loop = asyncio.new_event_loop()
+    batches = []
+
+    async def reindex(changes, is_superseded):
+        batches.append(changes)
+
+    batcher = _FileChangeBatcher(loop, 0.01, reindex)
+    batcher.add("/a.rst", False)
+    batcher.add("/b.rst", False)
+    batcher.add("/a.rst", True)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    loop.close()
+
+    assert batches == [{"/a.rst": True, "/b.rst": False}]
+
+
+def test_file_change_batcher_reindexes_files_that_changed_during_a_batch_again():
+    loop = asyncio.new_event_loop()
+    batches = []
+    superseded = []
+
+    async def reindex(changes, is_superseded):
+        batches.append(changes)
+        if len(batches) == 1:
+            batcher.add("/a.rst", False)
+            await asyncio.sleep(0.05)
+        superseded.append(sorted(path for path in changes if is_superseded(path)))
+
+    batcher = _FileChangeBatcher(loop, 0.01, reindex)
+    batcher.add("/a.rst", False)
+    batcher.add("/b.rst", False)
+    loop.run_until_complete(asyncio.sleep(0.2))
+    loop.close()
+
+    assert batches == [{"/a.rst": False, "/b.rst": False}, {"/a.rst": False}]
+    assert superseded == [["/a.rst"], []]
+
+
+def test_reindexes_files_that_changed_on_disk(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    changed_path: Path = server_root / "changed.rst"
+    changed_path.write_text("Original\n========\n")
+    deleted_path: Path = server_root / "deleted.rst"
+    deleted_path.write_text("Deleted\n=======\n")
+    hidden_path: Path = server_root / ".hidden" / "hidden.rst"
+    with _client(index_workspace=True, watched_files_delay=0.01) as client:
+        client.initialize(server_root.as_uri())
+        client.initialized()
+        client.run_event_loop(3)
+        changed_path.write_text("Changed\n=======\n")
+        deleted_path.unlink()
+        hidden_path.parent.mkdir()
+        hidden_path.write_text("Hidden\n======\n")
+        client.change_watched_files(
+            FileEvent(uri=changed_path.as_uri(), type=FileChangeType.Changed),
+            FileEvent(uri=deleted_path.as_uri(), type=FileChangeType.Deleted),
+            FileEvent(uri=hidden_path.as_uri(), type=FileChangeType.Created),
+        )
+        client.run_event_loop(1)
+
+        response = client.workspace_symbols("").result
+
+    symbols = parse_obj_as(List[SymbolInformation], response)
+    assert [symbol.name for symbol in symbols] == ["Changed"]
+
+
+def test_reports_workspace_symbols_matching_query_despite_typos(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(
+            uri=file_path.as_uri(),
+            text="Installation\n============\n\nUsage\n-----\n\nLicense\n=======\n",
+        )
+
+        response = client.workspace_symbols("instalation").result
+
+    symbols = parse_obj_as(List[SymbolInformation], response)
+    assert [symbol.name for symbol in symbols] == ["Installation"]
+    assert symbols[0].location.uri == file_path.as_uri()
+    assert symbols[0].location.range.start.line == 0
+
+
+def test_updates_workspace_symbols_upon_document_change(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Heading\n=======\n")
+        client.workspace_symbols("head")
+        client.change(file_path.as_uri(), text="Renamed\n=======\n")
+
+        response = client.workspace_symbols("").result
+
+    symbols = parse_obj_as(List[SymbolInformation], response)
+    assert [symbol.name for symbol in symbols] == ["Renamed"]
+
+
+def test_symbol_index_finds_titles_of_remaining_documents_after_compaction():
+    symbol_index = _SymbolIndex()
+    for index in range(3):
+        symbol_index.update(
+            f"file:///{index}.rst", [_Section(name=f"Title {index}", start=0, end=1)]
+        )
+    symbol_index.remove("file:///0.rst")
+    symbol_index.remove("file:///1.rst")
+
+    titles = symbol_index.search("title", limit=10)
+
+    assert [(title.uri, title.name) for title in titles] == [
+        ("file:///2.rst", "Title 2")
+    ]
+
+
+def test_resolves_definition_of_footnote_reference(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(
+            uri=file_path.as_uri(),
+            text="See [#note]_ and [#other]_.\n\n.. [#other] Other\n.. [#note] Note\n",
+        )
+
+        response = client.definition(file_path.as_uri(), line=0, character=6).result
+
+    locations = parse_obj_as(List[Location], response)
+    assert [(loc.uri, loc.range.start.line) for loc in locations] == [
+        (file_path.as_uri(), 3)
+    ]
+    assert locations[0].range.start.character == 3
+    assert locations[0].range.end.character == 10
+
+
+def test_reports_locations_in_utf16_code_units(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(
+            uri=file_path.as_uri(),
+            text="\U0001f600\U0001f600 see [#n]_\n\n.. [#n] Note\n",
+        )
+
+        response = client.references(
+            file_path.as_uri(), line=0, character=10, include_declaration=True
+        ).result
+
+    locations = parse_obj_as(List[Location], response)
+    assert [
+        (loc.range.start.line, loc.range.start.character, loc.range.end.character)
+        for loc in locations
+    ] == [(2, 3, 7), (0, 9, 14)]
+
+
+def test_resolves_no_definition_outside_of_references(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="See target_.\n\n.. _target: x\n")
+
+        response = client.definition(file_path.as_uri(), line=0, character=1).result
+
+    assert response is None
+
+
+@pytest.mark.parametrize("include_declaration", (True, False))
+def test_finds_references_to_hyperlink_target(
+    tmp_path_factory, include_declaration: bool
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    text = dedent(
+        """\
+        Title
+        =====
+
+        See target_ and `Title`_, or
+        - the `Target`_
+
+        .. _target: https://example.org
+        """
+    )
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=text)
+
+        response = client.references(
+            file_path.as_uri(),
+            line=6,
+            character=5,
+            include_declaration=include_declaration,
+        ).result
+
+    locations = parse_obj_as(List[Location], response)
+    ranges = [
+        (loc.range.start.line, loc.range.start.character, loc.range.end.character)
+        for loc in locations
+    ]
+    references = [(3, 4, 11), (4, 6, 15)]
+    assert ranges == ([(6, 3, 11)] if include_declaration else []) + references
+
+
+def test_resolves_definition_in_other_document(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    other_file_path: Path = server_root / f"other_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Version |version|\n")
+        client.open(uri=other_file_path.as_uri(), text=".. |version| replace:: 1.0\n")
+
+        response = client.definition(file_path.as_uri(), line=0, character=10).result
+
+    locations = parse_obj_as(List[Location], response)
+    assert [(loc.uri, loc.range.start.line) for loc in locations] == [
+        (other_file_path.as_uri(), 0)
+    ]
+
+
+@pytest.mark.parametrize("start_in_defining_document", [False, True])
+def test_finds_references_across_documents(
+    tmp_path_factory, start_in_defining_document: bool
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    other_file_path: Path = server_root / f"other_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Version |version|\n")
+        client.open(
+            uri=other_file_path.as_uri(),
+            text=".. |version| replace:: 1.0\n\nVersion |version|\n",
+        )
+
+        if start_in_defining_document:
+            response = client.references(
+                other_file_path.as_uri(),
+                line=2,
+                character=10,
+                include_declaration=True,
+            ).result
+        else:
+            response = client.references(
+                file_path.as_uri(), line=0, character=10, include_declaration=True
+            ).result
+
+    locations = parse_obj_as(List[Location], response)
+    assert sorted(
+        (loc.uri, loc.range.start.line, loc.range.start.character) for loc in locations
+    ) == sorted(
+        [
+            (file_path.as_uri(), 0, 8),
+            (other_file_path.as_uri(), 0, 3),
+            (other_file_path.as_uri(), 2, 8),
+        ]
+    )
+
+
+def test_resolves_definition_in_workspace_index(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    other_file_path: Path = server_root / f"other_file.rst"
+    other_file_path.write_text("Intro\n\n.. [CIT2022] Citation\n")
+    with _client(index_workspace=True) as client:
+        client.initialize(server_root.as_uri())
+        client.initialized()
+        client.run_event_loop(3)
+        client.open(uri=file_path.as_uri(), text="As shown in [CIT2022]_\n")
+
+        response = client.definition(file_path.as_uri(), line=0, character=14).result
+
+    locations = parse_obj_as(List[Location], response)
+    assert [(loc.uri, loc.range.start.line) for loc in locations] == [
+        (other_file_path.as_uri(), 2)
+    ]
+
+
+_rst_texts_with_names = st.lists(
+    st.one_of(
+        _rst_snippets,
+        st.sampled_from(
+            [
+                "See [#note]_ and target_\n",
+                "A `Title`_, |sub| and _`inline`\n",
+                ".. _target: https://example.org\n",
+                ".. |sub| replace:: text\n",
+                "- [CIT]_\n",
+            ]
+        ),
+    ),
+    max_size=10,
+).map("".join)
+
+
+@given(text=_rst_texts_with_names)
+def test_indexed_names_equal_names_of_parsed_document(text: str):
+    file_index = _index_source("file:///a.rst", text)
+
+    expected = _parse_document("file:///a.rst", 0, text).names
+    assert file_index.names._occurrences == expected._occurrences
+
+
+_diagnostics_capabilities = ClientCapabilities(
+    text_document=TextDocumentClientCapabilities(
+        publish_diagnostics=PublishDiagnosticsClientCapabilities()
+    )
+)
+
+
+def _published_diagnostics(client: "LspClient") -> List[Any]:
+    return [
+        notification.params
+        for notification in client.notifications
+        if notification.method == TEXT_DOCUMENT_PUBLISH_DIAGNOSTICS
+    ]
+
+
+def test_publishes_parser_messages_as_diagnostics(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+
+        client.open(
+            uri=file_path.as_uri(),
+            text="Title\n=====\n\nText *emph\n\n.. unknown:: x\n",
+        )
+
+    published = _published_diagnostics(client)
+    assert [params.uri for params in published] == [file_path.as_uri()]
+    assert [
+        (d.range.start.line, d.range.end.character, d.severity)
+        for d in published[0].diagnostics
+    ] == [(3, 10, DiagnosticSeverity.Warning), (5, 14, DiagnosticSeverity.Error)]
+
+
+def test_publishes_duplicate_substitution_definition_on_its_line(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+
+        client.open(
+            uri=file_path.as_uri(),
+            text="Text\n\n.. |v| replace:: 1\n.. |v| replace:: 2\n",
+        )
+
+    (published,) = _published_diagnostics(client)
+    assert [(d.range.start.line, d.message) for d in published.diagnostics] == [
+        (3, 'Duplicate substitution definition name: "v".')
+    ]
+
+
+def test_does_not_publish_diagnostics_to_clients_without_support(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+
+        client.open(uri=file_path.as_uri(), text="Text *emph\n")
+
+    assert not _published_diagnostics(client)
+
+
+def test_does_not_republish_unchanged_diagnostics(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(diagnostics_interval=0) as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+        client.open(uri=file_path.as_uri(), text="Text *emph\n\nParagraph\n")
+
+        client.change(
+            file_path.as_uri(),
+            text="Changed",
+            range=Range(
+                start=Position(line=2, character=0), end=Position(line=2, character=9)
+            ),
+        )
+
+    assert len(_published_diagnostics(client)) == 1
+
+
+def test_publishes_latest_diagnostics_once_interval_has_passed(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(diagnostics_interval=0.2) as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+        client.open(uri=file_path.as_uri(), text="Text *emph\n")
+        client.change(file_path.as_uri(), text="Text **strong\n")
+        client.change(file_path.as_uri(), text="Text\n")
+        assert len(_published_diagnostics(client)) == 1
+
+        client.run_event_loop(seconds=0.5)
+        client.symbols(file_path.as_uri())
+
+    published = _published_diagnostics(client)
+    assert [len(params.diagnostics) for params in published] == [1, 0]
+
+
+def test_withdraws_diagnostics_of_closed_documents(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+        client.open(uri=file_path.as_uri(), text="Text *emph\n")
+
+        client.close(file_path.as_uri())
+
+    published = _published_diagnostics(client)
+    assert [len(params.diagnostics) for params in published] == [1, 0]
+
+
+def test_publishes_same_diagnostics_as_check_for_names_and_titles_across_blocks(
+    tmp_path_factory,
+):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    text = dedent(
+        """\
+        A
+        =
+
+        B
+        -
+
+        C
+        ~
+
+        .. _a: https://a.org
+        .. [1] One
+        .. |v| replace:: 1
+
+        D
+        =
+
+        E
+        ~
+
+        .. _a: https://b.org
+
+        .. [1] Two
+
+        .. |v| replace:: 2
+        """
+    )
+    file_path.write_text(text)
+    with _client() as client:
+        client.initialize(server_root.as_uri(), _diagnostics_capabilities)
+
+        client.open(uri=file_path.as_uri(), text=text)
+
+    (published,) = _published_diagnostics(client)
+    diagnostics = [
+        (d.range.start.line, d.severity, d.message) for d in published.diagnostics
+    ]
+    (lint_result,) = lint_paths([str(file_path)], jobs=1)
+    severities = {
+        "error": DiagnosticSeverity.Error,
+        "warning": DiagnosticSeverity.Warning,
+    }
+    assert diagnostics == [
+        (m.line, severities[m.severity], m.message) for m in lint_result.messages
+    ]
+    assert diagnostics == [
+        (17, DiagnosticSeverity.Error, "Title level inconsistent:"),
+        (19, DiagnosticSeverity.Warning, 'Duplicate explicit target name: "a".'),
+        (21, DiagnosticSeverity.Warning, 'Duplicate explicit target name: "1".'),
+        (23, DiagnosticSeverity.Error, 'Duplicate substitution definition name: "v".'),
+    ]
+
+
+def test_reports_metrics_of_handled_requests(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client(collect_metrics=True) as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text=".. [#note] Footnote\n")
+        client.complete(file_path.as_uri(), line=1, character=0)
+
+        response = client.metrics().result
+
+    assert response["textDocument/didOpen/parse"]["count"] == 1
+    assert response["textDocument/completion/handler"]["count"] == 1
+    assert response["textDocument/completion/send"]["count"] == 1
+    assert response["textDocument/completion/payload_bytes"]["max"] > len("note")
+
+
+def test_reports_no_metrics_unless_enabled(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.open(uri=file_path.as_uri(), text="Text\n")
+
+        response = client.metrics().result
+
+    assert response == {}
+
+
+def test_histogram_quantiles_are_upper_bounds_of_recorded_values():
+    histogram = _Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+
+    summary = histogram.summary()
+
+    assert summary["count"] == 100
+    assert 50 <= summary["p50"] <= 64
+    assert 95 <= summary["p95"] <= 100
+    assert summary["p99"] <= summary["max"] == 100
+
+
+def test_writes_sampled_call_stacks_between_profiling_commands(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    file_path: Path = server_root / f"test_file.rst"
+    profile_path: Path = server_root / "profile.txt"
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+        client.execute_command(START_PROFILING_COMMAND, str(profile_path))
+        client.open(uri=file_path.as_uri(), text="Title\n=====\n")
+        client.run_event_loop(seconds=0.1)
+
+        response = client.execute_command(STOP_PROFILING_COMMAND).result
+
+    assert response["path"] == str(profile_path)
+    stacks = profile_path.read_text().splitlines()
+    assert sum(int(stack.rsplit(" ", 1)[1]) for stack in stacks) == response["samples"]
+    assert any(stack.startswith("MainThread;") for stack in stacks)
+
+
+def test_rejects_start_profiling_command_without_profile_path(tmp_path_factory):
+    server_root: Path = tmp_path_factory.mktemp("rst_language_server_test")
+    with _client() as client:
+        client.initialize(server_root.as_uri())
+
+        response = client.execute_command(START_PROFILING_COMMAND)
+        stop_response = client.execute_command(STOP_PROFILING_COMMAND)
+
+    assert response.error["code"] == JsonRpcInvalidParams.CODE
+    assert stop_response.result is None